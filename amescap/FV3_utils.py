@@ -1,5 +1,6 @@
 import numpy as np
 import warnings     # suppress certain errors when dealing with NaN arrays
+from functools import lru_cache
 
 # NOTE p_half = half-level = layer interfaces
 # NOTE p_full = full-level = layer midpoints
@@ -822,6 +823,43 @@ def area_weights_deg(var_shape, lat_c, axis=-2):
         return W*np.ones(var_shape)
 
 
+def coarsen_lat_lon(var, lat_c, n, lat_axis=-2, lon_axis=-1, area_weighted=True):
+    '''
+    Coarsen a variable on a regular grid by averaging blocks of n by n cells.
+    Args:
+        var: a ND variable, e.g. (time, lev, lat, lon)
+        lat_c: latitude of cell centers in [degree]
+        n: coarsening factor, must divide the number of latitudes and longitudes
+        lat_axis: position of the latitude axis, None if there is no latitude axis
+        lon_axis: position of the longitude axis, None if there is no longitude axis
+        area_weighted: if True, weight the cells by their area (see area_weights_deg), otherwise use a simple average
+    Returns:
+        var_c: the coarsened variable, e.g (time, lev, lat/n, lon/n)
+
+    ***NOTE***
+    NaN and masked values are ignored. A coarse cell is NaN only if all the cells in the block are NaN or masked.
+    Since the weights are normalized, the weighted average of var_c over the coarse grid is the same as the one of var.
+    '''
+    var = np.ma.filled(np.ma.asarray(var, dtype=float), np.nan)
+    if lat_axis is not None and area_weighted:
+        W = area_weights_deg(var.shape, lat_c, axis=lat_axis)
+    else:
+        W = np.ones(var.shape)
+    valid = ~np.isnan(var)
+    num = np.where(valid, var*W, 0.)
+    den = np.where(valid, W, 0.)
+    for axis in [lat_axis, lon_axis]:
+        if axis is None:
+            continue
+        axis = axis % var.ndim
+        # e.g. (time, lev, lat, lon) > (time, lev, lat/n, n, lon) and sum over the blocks
+        shape = num.shape[:axis]+(num.shape[axis]//n, n)+num.shape[axis+1:]
+        num = num.reshape(shape).sum(axis=axis+1)
+        den = den.reshape(shape).sum(axis=axis+1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(den > 0, num/den, np.nan)
+
+
 def areo_avg(VAR, areo, Ls_target, Ls_angle, symmetric=True):
     """
     Return a value average over a central solar longitude
@@ -956,9 +994,6 @@ def mass_stream(v_avg, lat, level, type='pstd', psfc=700, H=8000., factor=1.e-8)
     v_avg = v_avg.reshape((nlev, len(lat), np.prod(v_avg.shape[2:])))
     MSF = np.zeros_like(v_avg)
 
-    # Sum variable, same dimensions as v_avg but for the first dimension
-    I = np.zeros(v_avg.shape[2:])
-
     # Make note of NaN positions and replace by zero for downward integration
     isNan = False
     if np.isnan(v_avg).any():
@@ -980,16 +1015,15 @@ def mass_stream(v_avg, lat, level, type='pstd', psfc=700, H=8000., factor=1.e-8)
     else:  # Copy zagl or zstd instead of using a pseudo height
         Z = level.copy()
 
-    for k0 in range(nlev-2, 0, -1):
-        I[:] = 0.
-        for k in range(nlev-2, k0, -1):
-            zn = Z[k]
-            znp1 = Z[k+1]
-            fn = v_avg[k, :, ...] * np.exp(-zn/H)
-            fnp1 = v_avg[k+1, :, ...]*np.exp(-znp1/H)
-            I = I+0.5*(znp1-zn)*(fnp1+fn)
-        MSF[k0, :, ...] = 2*np.pi*a*psfc / \
-            (g*H)*np.cos(np.pi/180*lat).reshape([len(lat), 1])*I*factor
+    # Trapezoidal integral over each layer [k, k+1], for k = 0 ... nlev-2
+    fn = v_avg*np.exp(-Z/H).reshape([nlev, 1, 1])
+    dI = 0.5*(Z[1:]-Z[0:-1]).reshape([nlev-1, 1, 1])*(fn[1:, ...]+fn[0:-1, ...])
+
+    # Cumulative sum from the top: I[k] is the integral from level k to nlev-1.
+    # MSF[k0] integrates from level k0+1 to the top, MSF[0] and MSF[nlev-2:] are 0.
+    I = np.cumsum(dI[::-1, ...], axis=0)[::-1, ...]
+    MSF[1:nlev-2, ...] = 2*np.pi*a*psfc / \
+        (g*H)*np.cos(np.pi/180*lat).reshape([len(lat), 1])*I[2:, ...]*factor
 
     # Replace NaN where they initially were:
     if isNan:
@@ -2362,20 +2396,25 @@ def mollweide2cart(LAT, LON):
 
     def compute_theta(lat):
         '''
-        Internal function to compute theta, lat is in radians here
+        Internal function to compute theta, lat is a 1D array in radians here.
+        The iterations stop independently for each latitude.
         '''
-        theta0 = lat
+        lat = lat.astype(float)
+        theta0 = lat.copy()
+        theta1 = lat.copy()
+        running = np.ones(lat.shape, dtype=bool)
         sum = 0
-        running = True
         # Solve for theta using Newton–Raphson
-        while running and sum <= 100:
-            theta1 = theta0-(2*theta0+np.sin(2*theta0)-np.pi *
-                             np.sin(lat))/(2+2*np.cos(2*theta0))
+        while running.any() and sum <= 100:
+            t0 = theta0[running]
+            t1 = t0-(2*t0+np.sin(2*t0)-np.pi *
+                     np.sin(lat[running]))/(2+2*np.cos(2*t0))
             sum += 1
-            if np.abs((theta1-theta0)) < 10**-3:
-                running = False
-            theta0 = theta1
-        if sum == 100:
+            theta1[running] = t1
+            theta0[running] = t1
+            running[running] = ~(np.abs((t1-t0)) < 10**-3)
+        # At the poles, the iterations diverge to NaN
+        if (running & np.isfinite(theta1)).any():
             print("Warning,in mollweide2cart():  Reached Max iterations")
         return theta1
 
@@ -2384,16 +2423,11 @@ def mollweide2cart(LAT, LON):
         nlat = len(np.atleast_1d(LAT))
         LAT = LAT.reshape((nlat))
         LON = LON.reshape((nlat))
-        THETA = np.zeros((nlat))
-        for i in range(0, nlat):
-            THETA[i] = compute_theta(LAT[i])
+        THETA = compute_theta(LAT)
 
     else:  # 2D array
-        nlat = LAT.shape[0]
         nlon = LAT.shape[1]
-        theta = np.zeros((nlat))
-        for i in range(0, nlat):
-            theta[i] = compute_theta(LAT[i, 0])
+        theta = compute_theta(LAT[:, 0])
         THETA = np.repeat(theta[:, np.newaxis], nlon, axis=1)
 
     X = 2*np.sqrt(2)/np.pi*(LON-lon0)*np.cos(THETA)
@@ -2441,6 +2475,54 @@ def robin2cart(LAT, LON):
 
     return X, Y
 
+
+@lru_cache(maxsize=64)
+def _projection_grid(proj, lat, lon, lat0, lon0, dtype):
+    '''
+    Cached implementation of projection_grid(), lat and lon are tuples.
+    '''
+    LON, LAT = np.meshgrid(np.array(lon, dtype=dtype), np.array(lat, dtype=dtype))
+    if proj == 'robin':
+        out = robin2cart(LAT, LON)
+    elif proj == 'moll':
+        out = mollweide2cart(LAT, LON)
+    elif proj == 'azimuth':
+        out = azimuth2cart(LAT, LON, lat0, lon0)
+    elif proj == 'ortho':
+        out = ortho2cart(LAT, LON, lat0, lon0)
+    else:
+        raise ValueError("Unknown projection '%s'" % (proj))
+    out = tuple(np.reshape(arr, LAT.shape) for arr in out)
+    # The arrays are shared by all the callers
+    for arr in out:
+        arr.flags.writeable = False
+    return out
+
+
+def projection_grid(proj, lat, lon, lat0=0., lon0=0.):
+    '''
+    Projects the grid spanned by 1D arrays of latitudes and longitudes. The results
+    are cached so that the panels and gridlines using the same grid share the geometry.
+    Args:
+        proj: 'robin', 'moll', 'azimuth' or 'ortho'
+        lat,lon: floats or 1D arrays of latitudes, longitudes in degree
+        lat0,lon0:(floats) coordinates of the pole for 'azimuth' and 'ortho'
+    Returns:
+        X,Y: (read-only) cartesian coordinates, size [nlat,nlon]
+        MASK: for 'ortho' only, NaN array that is used to hide the back side of the planet
+
+    ***NOTE***
+    Plot all the meridians at once with plt.plot(X,Y) and the parallels with plt.plot(X.T,Y.T)
+    '''
+    lat = np.atleast_1d(np.asarray(lat))
+    lon = np.atleast_1d(np.asarray(lon))
+    # The computation is done with the precision of the floating point inputs,
+    # e.g. the meridians of a float32 grid are computed in float32
+    floats = [arr for arr in [lat, lon] if arr.dtype.kind == 'f']
+    dtype = np.result_type(*floats).str if floats else '<f8'
+    return _projection_grid(proj, tuple(lat.tolist()), tuple(lon.tolist()),
+                            float(lat0), float(lon0), dtype)
+
 # ===================== (End projections section) ================================
 
 
@@ -2460,7 +2542,8 @@ def sol2ls(jld, cummulative=False):
     zero_date = 488.  # time of perihelion passage
     equinox = 180  # day of northern equinox:  (for 668 sol year)
     small_value = 1.0e-7
-    pi = np.math.pi
+    max_iter = 100  # the Newton iteration converges in less than 10 iterations for Mars' eccentricity
+    pi = np.pi
     degrad = pi/180.0
 
     # if jld is a scalar, reshape as a 1-element arra
@@ -2479,35 +2562,27 @@ def sol2ls(jld, cummulative=False):
         ec = .093  # orbit eccentricity
         er = ((1.0+ec)/(1.0-ec))**0.5
 
-        # Initialize working arrays
-        w, rad, als, areols, MY = [np.zeros_like(jld) for _ in range(0, 5)]
-
         # date= days since last perihelion passage
         date = jld - zero_date
 
-        # determine true anomaly at equinox:  eq
-
-        qq = 2.0 * pi * equinox / year   # qq is the mean anomaly
-        e = 1.0
-        diff = 1.0
-        while (diff > small_value):
-            ep = e - (e-ec*np.math.sin(e)-qq) / (1.0-ec*np.cos(e))
-            diff = abs(ep-e)
-            e = ep
-
-        eq1 = 2.0 * np.math.atan(er * np.math.tan(0.5*e))
-
-        # determine true anomaly at current date:  w
-
-        for i in range(0, len(jld)):
-            e = 1.0
-            diff = 1.0
-            em = 2. * pi * date[i] / year
-            while (diff > small_value):
-                ep = e - (e - ec * np.sin(e) - em) / (1.0 - ec * np.cos(e))
-                diff = abs(ep-e)
-                e = ep
-            w[i] = 2.0 * np.math.atan(er * np.math.tan(0.5*e))
+        # Solve Kepler's equation  e - ec*sin(e) = em  for the eccentric anomaly e with Newton's method,
+        # for the equinox (last element) and all the dates at once.
+        # Each element stops being updated once it has converged, as with a scalar iteration
+        em = 2.0 * pi * np.append(date, equinox) / year   # em is the mean anomaly
+        e = np.ones_like(em)
+        active = np.ones(em.shape, dtype=bool)
+        for _ in range(0, max_iter):
+            ep = e - (e - ec * np.sin(e) - em) / (1.0 - ec * np.cos(e))
+            diff = np.abs(ep-e)
+            e = np.where(active, ep, e)
+            active &= diff > small_value
+            if not active.any():
+                break
+
+        # true anomaly at equinox (eq1) and at current date (w)
+        w = 2.0 * np.arctan(er * np.tan(0.5*e))
+        eq1 = w[-1]
+        w = w[:-1]
 
         als = w - eq1  # Aerocentric Longitude
         areols = als/degrad
@@ -2527,7 +2602,6 @@ def sol2ls(jld, cummulative=False):
         For those edges cases where Ls is close to 359.9, the routine calculate again the Ls at a later time (say 1 sols) to check for outlier points.
         '''
         # Calculate cummulative Ls using sol2ls function() and adding +360 for every mars year
-        areols, MY = [np.zeros_like(jld) for _ in range(0, 2)]
         date = jld - zero_date
         MY = (date-equinox)//(year)+1  # MY=(date-equinox)//(year)
         Ls_mod = sol2ls_mod(jld)
@@ -2537,19 +2611,18 @@ def sol2ls(jld, cummulative=False):
         # The [0] turns tuple from np.where into a list
         index = np.where(Ls_mod >= 359.9)[0]
 
-        for ii in index:
-            jld_plus1 = jld[ii] + \
+        if index.size > 0:
+            jld_plus1 = jld[index] + \
                 1.  # compute Ls one day after (arbitrary length)
-            Ls_plus1 = sol2ls(jld_plus1)
+            Ls_plus1 = sol2ls_mod(jld_plus1)
             date_plus1 = jld_plus1 - zero_date
             MY_plus1 = (date_plus1-equinox)//(668.)+1  # Compute MY
             Ls_cum_plus1 = Ls_plus1+MY_plus1 * \
                 360.  # Cummulative Ls 1 day after.
             # If things are smooth the Ls should go from [359>361]. If it reads [359>721], we need to update the MY for those indices
             # difference between two consecutive Ls, should be small unless Ls_cum was too big at the first place
-            diff = Ls_cum_plus1-Ls_cum[ii]
-            if diff < 0:
-                MY[ii] -= 1
+            diff = Ls_cum_plus1-Ls_cum[index]
+            MY[index[diff < 0]] -= 1
         # Recompute one more more time with updated MY
         Ls_cum = Ls_mod+MY*360.
         return Ls_cum
@@ -2561,30 +2634,36 @@ def sol2ls(jld, cummulative=False):
 
 
 
+ls2sol_table=None #(sol,Ls) lookup table for one Mars year, built at the first call to ls2sol()
+
 def ls2sol(Ls_in):
     '''
     Ls to sol converter.
     Args:
         Ls_in (float or 1D array) : Solar longitudes 0-360...720
     Return:
-        sol: the corresponding sol number
+        sol: the corresponding sol number, as a float for a single Ls or a 1D array otherwise
     ***NOTE***
-    This function simply uses a numerical solver on the sol2ls() function.
-    '''
-    #===Internal functions======
-    from scipy import optimize
-    def internal_func(Ls_in):
-        func_int = lambda x: sol2ls(x,cummulative=True)
-        errfunc = lambda x, y: func_int(x) - y # Distance to the target function
-        p0 = [0.] # Initial guess for the parameters
-        p1, success = optimize.leastsq(errfunc, p0[:], args=(Ls_in))
-        return  p1
-    Ls_in=np.array(Ls_in)
-    #=============================
-    if len(np.atleast_1d(Ls_in))==1:
-        return internal_func(Ls_in)[0]
+    The sols are interpolated from a (sol,Ls) table of one Mars year computed with sol2ls(),
+    and refined with one Newton step. Cumulative Ls (>360) are shifted by 668 sols for each year.
+    '''
+    global ls2sol_table
+    year=668.
+    if ls2sol_table is None:
+        # A margin of 1 sol on each side of the year keeps Ls=0 and Ls=360 inside the table
+        sol_table=np.arange(-1.,year+1.,0.25)
+        ls2sol_table=(sol_table,sol2ls(sol_table,cummulative=True))
+    sol_table,Ls_table=ls2sol_table
+
+    Ls=np.array(Ls_in).astype(float).reshape(len(np.atleast_1d(Ls_in)))
+    MY=np.floor(Ls/360.)
+    sol=np.interp(Ls-MY*360.,Ls_table,sol_table)+MY*year
+
+    # Newton refinement, using the slope dLs/dsol of the table
+    dLs=np.interp(sol-MY*year,sol_table,np.gradient(Ls_table,sol_table))
+    sol-=(sol2ls(sol,cummulative=True)-Ls)/dLs
+
+    if len(sol)==1:
+        return sol[0]
     else:
-        sol_all=[]
-        for ii in Ls_in:
-            sol_all.append(internal_func(ii)[0])
-        return   sol_all
+        return sol
@@ -1,6 +1,5 @@
 import numpy as np
 from netCDF4 import Dataset,MFDataset
-from scipy.io import FortranFile
 from amescap.FV3_utils import daily_to_average, daily_to_diurn
 import os
 
@@ -1,7 +1,6 @@
 import os
 import sys
 import subprocess
-from netCDF4 import Dataset, MFDataset
 import numpy as np
 import re
 #=========================================================================
@@ -17,6 +16,14 @@ def prYellow(skk): print("\033[93m{}\033[00m".format(skk))
 def prPurple(skk): print("\033[95m{}\033[00m".format(skk))
 def prLightPurple(skk): print("\033[94m{}\033[00m".format(skk))
 
+# Same colors, to use inside strings: f"{Yellow}text{Nclr}"
+Red="\033[91m"
+Green="\033[92m"
+Cyan="\033[96m"
+Yellow="\033[93m"
+Purple="\033[95m"
+Nclr="\033[00m"
+
 def MY_func(Ls_cont):
     '''
     This function return the Mars Year
@@ -58,6 +65,7 @@ def print_fileContent(fileNcdf):
     if not os.path.isfile(fileNcdf):
         print(fileNcdf+' not found')
     else:
+        from netCDF4 import Dataset
         f=Dataset(fileNcdf, 'r')
         print("===================DIMENSIONS==========================")
         print(list(f.dimensions.keys()))
@@ -92,16 +100,185 @@ def print_fileContent(fileNcdf):
         f.close()
         print("=====================================================")
 
-def print_varContent(fileNcdf,list_varfull,print_stat=False):
+# Size of the blocks read by read_blocks(), e.g. to compute the statistics of variables larger than the memory
+stats_block_bytes=128*1024**2
+
+def parse_slice(slice_txt):
+    '''
+    Convert a slice written as text into an index for a netcdf variable, without using eval()
+    Args:
+        slice_txt: e.g. '[6,:,30,10]', '[0:10:2,...,-1]' or '[:]'
+    Returns:
+        key: the index, e.g. (6,slice(None,None,None),30,10)
+    '''
+    txt=slice_txt.strip()
+    if txt[:1]!='[' or txt[-1:]!=']':raise ValueError('Slice %s should be in brackets, e.g. [0,:,10]'%(slice_txt))
+    key=[]
+    for item in txt[1:-1].split(','):
+        item=item.strip()
+        if item=='...':
+            key.append(Ellipsis)
+        elif ':' in item:
+            parts=item.split(':')
+            if len(parts)>3:raise ValueError('Invalid slice %s'%(slice_txt))
+            key.append(slice(*[int(ii) if ii.strip() else None for ii in parts]))
+        else:
+            key.append(int(item))
+    return tuple(key)
+
+def read_blocks(var,key=()):
+    '''
+    Read a slice of a netcdf variable in consecutive blocks along its first dimension (e.g. time), each of
+    about stats_block_bytes, so that the whole slice is never in memory.
+    Args:
+        var: a netcdf variable, e.g. f.variables['temp']
+        key: the index of the slice, e.g. (slice(None),10) or () for the whole variable
+    Returns:
+        A generator of the blocks
+    '''
+    if not isinstance(key,tuple):key=(key,)
+    ellipsis=[i for i,k in enumerate(key) if k is Ellipsis]
+    if ellipsis:
+        i=ellipsis[0]
+        key=key[:i]+(slice(None),)*(var.ndim-len(key)+1)+key[i+1:]
+    if var.ndim==0 or len(key)>var.ndim:
+        yield var[key if key else slice(None)]
+        return
+    key=key+(slice(None),)*(var.ndim-len(key))
+    if not isinstance(key[0],slice):
+        yield var[key]
+        return
+
+    steps=range(*key[0].indices(var.shape[0]))
+    #Size of one step of the first dimension in the slice
+    step_size=np.dtype(var.dtype).itemsize
+    for k,n in zip(key[1:],var.shape[1:]):
+        if isinstance(k,slice):step_size*=len(range(*k.indices(n)))
+    nt=int(np.clip(stats_block_bytes//np.maximum(step_size,1),1,None))
+    for i in range(0,len(steps),nt):
+        r=steps[i:i+nt]
+        yield var[(slice(r.start,r.stop if r.stop>=0 else None,r.step),)+key[1:]]
+
+class Stats_sketch(object):
+    '''
+    Statistics of an array computed in a single pass over its blocks: min, mean, max, standard deviation, number of NaNs
+    (and masked values) and, with percentiles=True, approximate percentiles.
+    The percentiles are estimated from the number of values in logarithmic bins, to a relative accuracy of
+    relative_accuracy (1%). Sketches with the same accuracy can be merged, e.g. to combine the statistics of several files.
+
+    Usage:
+        stats=Stats_sketch(percentiles=True)
+        for block in read_blocks(f.variables['temp']):stats.update(block)
+        print(stats.min,stats.mean,stats.max,stats.std(),stats.nan_count,stats.percentile(95))
+    '''
+    def __init__(self,relative_accuracy=0.01,percentiles=False):
+        self.gamma=(1+relative_accuracy)/(1-relative_accuracy)
+        self.percentiles=percentiles #The bins are only counted if the percentiles are requested
+        self.n=0
+        self.nan_count=0
+        self.mean=np.nan
+        self.M2=0.   #Sum of the squared differences to the mean
+        self.min=np.nan
+        self.max=np.nan
+        self.zero=0  #Number of zeros
+        self.positive={} #Number of positive (negative) values in each bin, {bin index: count}
+        self.negative={}
+
+    def update(self,block):
+        '''
+        Add the values of an array (or masked array) to the statistics
+        '''
+        values=np.asarray(np.ma.filled(np.ma.asarray(block,dtype=np.float64),np.nan)).ravel()
+        isnan=np.isnan(values)
+        nan_count=int(isnan.sum())
+        self.nan_count+=nan_count
+        if nan_count>0:values=values[~isnan]
+        if values.size==0:return
+        other=Stats_sketch.__new__(Stats_sketch)
+        other.gamma=self.gamma
+        other.percentiles=self.percentiles
+        other.n=values.size
+        other.nan_count=0
+        other.mean=values.mean()
+        delta=values-other.mean
+        other.M2=np.dot(delta,delta)
+        other.min=values.min()
+        other.max=values.max()
+        other.zero=0
+        other.positive={}
+        other.negative={}
+        if self.percentiles:
+            finite=values[np.isfinite(values)]
+            other.zero=int((finite==0).sum())
+            other.positive=self._bins(finite[finite>0])
+            other.negative=self._bins(-finite[finite<0])
+        self.merge(other)
+
+    def _bins(self,values):
+        if values.size==0:return {}
+        index=np.ceil(np.log(values)/np.log(self.gamma)).astype(np.int64)
+        offset=index.min()
+        count=np.bincount(index-offset)
+        index=np.flatnonzero(count)
+        return dict(zip((index+offset).tolist(),count[index].tolist()))
+
+    def merge(self,other):
+        '''
+        Add the statistics of another sketch, e.g. of another file
+        '''
+        self.nan_count+=other.nan_count
+        if other.n==0:return
+        if self.n==0:
+            self.mean,self.M2,self.min,self.max=other.mean,other.M2,other.min,other.max
+        else:
+            n=self.n+other.n
+            delta=other.mean-self.mean
+            self.mean=self.mean+delta*other.n/n
+            self.M2=self.M2+other.M2+delta**2*self.n*other.n/n
+            self.min=np.minimum(self.min,other.min)
+            self.max=np.maximum(self.max,other.max)
+        self.n+=other.n
+        self.zero+=other.zero
+        for bins,other_bins in [(self.positive,other.positive),(self.negative,other.negative)]:
+            for index,count in other_bins.items():bins[index]=bins.get(index,0)+count
+
+    def std(self):
+        '''
+        Return the standard deviation (as np.nanstd)
+        '''
+        return np.sqrt(self.M2/self.n) if self.n>0 else np.nan
+
+    def percentile(self,q):
+        '''
+        Return the approximate q-th percentile (0-100) of the finite values
+        '''
+        if not self.percentiles:raise ValueError('Stats_sketch was created without percentiles=True')
+        bins=[(-2*self.gamma**index/(self.gamma+1),count) for index,count in sorted(self.negative.items(),reverse=True)]+ \
+             [(0.,self.zero)]+ \
+             [(2*self.gamma**index/(self.gamma+1),count) for index,count in sorted(self.positive.items())]
+        total=sum(count for _,count in bins)
+        if total==0:return np.nan
+        rank=q/100.*(total-1)
+        cumul=0
+        for value,count in bins:
+            cumul+=count
+            if cumul>rank:return float(np.clip(value,self.min,self.max))
+        return float(self.max)
+
+def print_varContent(fileNcdf,list_varfull,print_stat=False,percentiles=None):
     '''
     Print the content of a variable inside a Netcdf file
     This test is based on the existence of a least one  00XXX.fixed.nc in the current directory.
     Args:
         fileNcdf:      full path to netcdf file
         list_varfull:  list of variable names and optional slices, e.g ['lon' ,'ps[:,10,20]']
-        print_stat:  if true, print min, mean and max instead of values
+        print_stat:  if true, print min, mean, max, standard deviation and number of NaNs instead of values
+        percentiles: list of percentiles to add to the statistics, e.g. [5,50,95] (approximate, see Stats_sketch)
     Returns:
         None (print in the terminal)
+
+    ***NOTE***
+    The statistics are computed block by block (see read_blocks()) so that variables larger than the memory can be used.
     '''
     #Define Colors for printing
     def Cyan(skk): return "\033[96m{}\033[00m".format(skk)
@@ -109,31 +286,40 @@ def print_varContent(fileNcdf,list_varfull,print_stat=False):
     if not os.path.isfile(fileNcdf):
         print(fileNcdf+' not found')
     else:
+        from netCDF4 import Dataset
 
+        if percentiles is None:percentiles=[]
+        columns=['MIN','MEAN','MAX','STD','NaNs']+['P%g'%(q) for q in percentiles]
+        line='__________________________|'+'_______________|'*len(columns)
         if print_stat:
-            print(Cyan('__________________________________________________________________________'))
-            print(Cyan('           VAR            |      MIN      |      MEAN     |      MAX      |'))
-            print(Cyan('__________________________|_______________|_______________|_______________|'))
+            print(Cyan('_'*len(line)))
+            print(Cyan('           VAR            |'+''.join(col.center(15)+'|' for col in columns)))
+            print(Cyan(line))
+        f=Dataset(fileNcdf, 'r')
         for varfull in list_varfull:
             try:
-                slice='[:]'
+                key=()
                 if '[' in varfull:
-                    varname,slice=varfull.strip().split('[');slice='['+slice
+                    varname,slice_txt=varfull.strip().split('[',1)
+                    key=parse_slice('['+slice_txt)
                 else:
                     varname=varfull.strip()
-                cmd_txt="""f.variables['"""+varname+"""']"""+slice
-                f=Dataset(fileNcdf, 'r')
-                var=eval(cmd_txt)
+                fvar=f.variables[varname]
 
                 if print_stat:
-                    Min=np.nanmin(var)
-                    Mean=np.nanmean(var)
-                    Max=np.nanmax(var)
-                    print(Cyan('%26s|%15g|%15g|%15g|'%(varfull,Min,Mean,Max)))
-                    if varname=='areo':
-                        # If variable is areo, also print the modulo
-                        print(Cyan('%17s(mod 360)|(%13g)|(%13g)|(%13g)|'%(varfull,np.nanmin(var%360),np.nanmean(var%360),np.nanmax(var%360))))
+                    stats=Stats_sketch(percentiles=bool(percentiles))
+                    stats_mod=Stats_sketch(percentiles=bool(percentiles)) # If variable is areo, also print the modulo
+                    for block in read_blocks(fvar,key):
+                        stats.update(block)
+                        if varname=='areo':stats_mod.update(block%360)
+                    for stat,txt,fmt,fmt_int in [(stats,'%26s|'%(varfull),'%15g|','%15i|'),
+                                                 (stats_mod,'%17s(mod 360)|'%(varfull),'(%13g)|','(%13i)|')]:
+                        if stat is stats_mod and varname!='areo':continue
+                        values=[stat.min,stat.mean,stat.max,stat.std()]+[stat.percentile(q) for q in percentiles]
+                        txt+=''.join(fmt%(val) for val in values[:4])+fmt_int%(stat.nan_count)+''.join(fmt%(val) for val in values[4:])
+                        print(Cyan(txt))
                 else:
+                    var=fvar[key] if key else fvar[:]
                     if varname!='areo':
                         print(Cyan(varfull+'= '))
                         print(Cyan(var))
@@ -143,20 +329,19 @@ def print_varContent(fileNcdf,list_varfull,print_stat=False):
                         for ii in var: print(ii,ii%360)
 
                     print(Cyan('______________________________________________________________________'))
-            except:
+            except Exception:
                 if print_stat:
-                    print(Red('%26s|%15s|%15s|%15s|'%(varfull,'','','')))
+                    print(Red('%26s|'%(varfull)+'%15s|'%('')*len(columns)))
                 else:
                     print(Red(varfull))
         #Last line for the table
         if print_stat:
-            print(Cyan('__________________________|_______________|_______________|_______________|'))
+            print(Cyan(line))
         f.close()
 
 
 
 
-
 def give_permission(filename):
     '''
     # NAS system only: set group permission to the file
@@ -171,6 +356,78 @@ def give_permission(filename):
     except subprocess.CalledProcessError:
         pass
 
+# Commands used to query the status of the files and to migrate them from the tape (NAS data migration facility).
+# They may be replaced, e.g. by a local stand-in script for testing, with the AMESCAP_DMLS and AMESCAP_DMGET variables
+dmls_cmd=os.environ.get('AMESCAP_DMLS','dmls')
+dmget_cmd=os.environ.get('AMESCAP_DMGET','dmget')
+tape_status_cache={}  #Status of the files already queried, e.g. {'/path/00668.atmos_average.nc':'DUL'}
+tape_staging=set()    #Files requested with dmget
+tape_available=None   #False if dmls is not available (not a NAS system)
+
+def tape_status(file_list):
+    '''
+    Relevant for use on the NASA Advanced Supercomputing (NAS) environnment only
+    Return the status of the files from a single dmls -l command. The status are kept for the rest of the run.
+    Args:
+        file_list: list of full paths to the files
+    Returns:
+        status: a dictionary {file: 3 letter status}, e.g. 'DUL', 'REG', 'MIG' (on disk) or 'OFL', 'UNM' (not on disk).
+                The status is None if it is unknown (e.g. dmls is not available)
+    '''
+    global tape_available
+    new_files=[ifile for ifile in file_list if ifile not in tape_status_cache]
+    if new_files and tape_available is not False:
+        try:
+            dmls_out=subprocess.run([dmls_cmd,'-l']+new_files,stdout=subprocess.PIPE,stderr=subprocess.DEVNULL,
+                                    universal_newlines=True).stdout
+            tape_available=True
+        except OSError: #dmls is not available
+            tape_available=False
+            dmls_out=''
+        #Each line is similar to ls -l with the status in parenthesis, e.g.
+        #-rw-r--r-- 1 user group 4259856 2023-01-01 12:00 (DUL) /path/00668.atmos_average.nc
+        found={}
+        for line in dmls_out.split('\n'):
+            fields=line.split()
+            if len(fields)>=9 and fields[7][0]=='(':found[' '.join(fields[8:])]=fields[7][1:4]
+        for ifile in new_files:
+            tape_status_cache[ifile]=found.get(ifile,found.get(os.path.basename(ifile)))
+    return {ifile:tape_status_cache.get(ifile) for ifile in file_list}
+
+def check_files_tape(file_list,abort=False,stage=True):
+    '''
+    Relevant for use on the NASA Advanced Supercomputing (NAS) environnment only
+    Check with a single dmls command if the files are present on the disk, and migrate the missing files from the tape
+    with a single dmget command. dmget runs in the background so that the files already on disk can be processed
+    while the other files are migrated.
+    Args:
+        file_list: list of full paths to the netcdf files
+        abort: boolean. If True, exit the program if some files are not on disk
+        stage: boolean. If True, request the files that are not on disk with dmget
+    Returns:
+        None (print status and abort program)
+    '''
+    status=tape_status(file_list)
+    offline=[ifile for ifile in file_list if status[ifile] is not None and status[ifile] not in ['DUL','REG','MIG']]
+    if not offline:return
+    if abort:
+        prRed('*** Error ***')
+        prRed('%i file(s) are not available on disk: %s'%(len(offline),' '.join(offline)))
+        prRed('CHECK file status with  dmls -l *.nc and run  dmget *.nc to migrate the files')
+        prRed('Exiting now... \n')
+        exit()
+    to_stage=[ifile for ifile in offline if ifile not in tape_staging]
+    if not to_stage:return #Already requested
+    prYellow('*** Warning ***')
+    prYellow('%i file(s) are not available on disk: %s'%(len(offline),' '.join(os.path.basename(ifile) for ifile in offline)))
+    if stage:
+        try:
+            subprocess.Popen([dmget_cmd]+to_stage,stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+            tape_staging.update(to_stage)
+            prYellow('Migrating the files to disk in the background with %s'%(dmget_cmd))
+        except OSError:
+            prYellow('Consider running  dmget *.nc to migrate the files')
+
 def check_file_tape(fileNcdf,abort=False):
     '''
     Relevant for use on the NASA Advanced Supercomputing (NAS) environnment only
@@ -181,6 +438,10 @@ def check_file_tape(fileNcdf,abort=False):
         exit: boolean. If True, exit the program (avoid stalling the program if file is not on disk)
     Returns:
         None (print status and abort program)
+
+    ***NOTE***
+    The status comes from the same cache as check_files_tape(): call check_files_tape() with all the files first
+    to run a single dmls command (and a single dmget) for the whole list.
     '''
     # If the filename provided is not a netcdf file, exit program right away
     if fileNcdf[-3:]!='.nc':
@@ -189,30 +450,26 @@ def check_file_tape(fileNcdf,abort=False):
         exit()
     #== Then check if the file actually exists on the system,  exit otherwise.
 
-
-    try:
-        #== NAS system only: file exists, check if it is active on disk or needs to be migrated from Lou
-        subprocess.check_call(["dmls"],shell=True,stdout=open(os.devnull, "w"),stderr=open(os.devnull, "w")) #check if dmls command is available (NAS systems only)
-        cmd_txt='dmls -l '+fileNcdf+"""| awk '{print $8,$9}'""" #get the last columns of the ls command with filename and status
-        dmls_out=subprocess.check_output(cmd_txt,shell=True).decode('utf-8')  # get 3 letter identifier from dmls -l command, convert byte to string for Python 3
-        if dmls_out[1:4] not in ['DUL','REG','MIG']: #file is OFFLINE, UNMIGRATING etc...
-            if abort :
-                prRed('*** Error ***')
-                print(dmls_out)
-                prRed(dmls_out[6:-1]+ ' is not available on disk, status is: '+dmls_out[0:5])
-                prRed('CHECK file status with  dmls -l *.nc and run  dmget *.nc to migrate the files')
-                prRed('Exiting now... \n')
-                exit()
-            else:
-                prYellow('*** Warning ***')
-                prYellow(dmls_out[6:-1]+ ' is not available on disk, status is: '+dmls_out[0:5])
-                prYellow('Consider checking file status with  dmls -l *.nc and run  dmget *.nc to migrate the files')
-                prYellow('Waiting for file to be migrated to disk, this may take a while...')
-    except subprocess.CalledProcessError: #subprocess.check_call return an eror message
+    #== NAS system only: file exists, check if it is active on disk or needs to be migrated from Lou
+    status=tape_status([fileNcdf])[fileNcdf]
+    if tape_available is False:
         if abort :
              exit()
-        else:
-            pass
+        return
+    if status is None or status in ['DUL','REG','MIG']:return
+    if abort :
+        prRed('*** Error ***')
+        prRed(fileNcdf+ ' is not available on disk, status is: ('+status+')')
+        prRed('CHECK file status with  dmls -l *.nc and run  dmget *.nc to migrate the files')
+        prRed('Exiting now... \n')
+        exit()
+    elif fileNcdf in tape_staging:
+        prYellow('Waiting for %s to be migrated to disk, this may take a while...'%(fileNcdf))
+    else:
+        prYellow('*** Warning ***')
+        prYellow(fileNcdf+ ' is not available on disk, status is: ('+status+')')
+        prYellow('Consider checking file status with  dmls -l *.nc and run  dmget *.nc to migrate the files')
+        prYellow('Waiting for file to be migrated to disk, this may take a while...')
 
 
 def get_Ncdf_path(fNcdf):
@@ -337,6 +594,39 @@ def alt_FV3path(fullpaths,alt,test_exist=True):
     if one_element:out_list=out_list[0]
     return  out_list
 
+# The paths to the raw and fixed files found by alt_FV3path(), and the arrays read from the fixed files,
+# which do not change during a run
+alt_path_cache={}
+fixed_array_cache={}
+
+def resolve_alt_path(fullpaths,alt):
+    '''
+    Same as alt_FV3path(fullpaths,alt,test_exist=True), remembering the answer for the rest of the run.
+    '''
+    key=(tuple(fullpaths) if type(fullpaths)==list else fullpaths,alt)
+    if key not in alt_path_cache:alt_path_cache[key]=alt_FV3path(fullpaths,alt,test_exist=True)
+    return alt_path_cache[key]
+
+def read_fixed_variable(name_fixed,var):
+    '''
+    Read a variable from a fixed file (e.g. 'zsurf', 'ak', 'bk'). The arrays are kept in memory so that the
+    following calls do not read the file again, unless the file is modified. The file is closed after reading
+    so that it can be opened for writing (e.g. by MarsVars).
+    Args:
+        name_fixed: full path to the fixed file
+        var: the variable name
+    Returns:
+        A copy of the array, or None if the variable is not in the file
+    '''
+    stat=os.stat(name_fixed)
+    key=(name_fixed,stat.st_mtime,stat.st_size,var)
+    if key not in fixed_array_cache:
+        from netCDF4 import Dataset
+        with Dataset(name_fixed,'r') as f:
+            if var not in f.variables.keys():return None
+            fixed_array_cache[key]=f.variables[var][:]
+    return fixed_array_cache[key].copy()
+
 def smart_reader(fNcdf,var_list,suppress_warning=False):
     """
     Smarter alternative to using var=fNcdf.variables['var'][:] when handling PROCESSED files that also check
@@ -362,8 +652,11 @@ def smart_reader(fNcdf,var_list,suppress_warning=False):
                                                         # if pk and bk are absent from 0668.atmos_average.nc, it will also check 00668.fixed.n
     *** NOTE ***
         -Only the variables' content is returned, not the attributes
+        -The arrays read from the fixed file are kept in memory for the following calls
     """
 
+    from netCDF4 import Dataset, MFDataset
+
     #This out_list is for the variable
     out_list=[]
     one_element=False
@@ -382,30 +675,34 @@ def smart_reader(fNcdf,var_list,suppress_warning=False):
         if ivar in fNcdf.variables.keys():
             out_list.append(fNcdf.variables[ivar][:])
         else:
-            full_path_try=alt_FV3path(Ncdf_path,alt='raw',test_exist=True)
-            if file_is_MF:
+            full_path_try=resolve_alt_path(Ncdf_path,alt='raw')
+            #Do not open the files that the directory catalog (MarsFiles --index) shows do not have the variable
+            if index_has_variable(full_path_try,ivar) is False:
+                f_tmp=None
+            elif file_is_MF:
                 f_tmp=MFDataset(full_path_try,'r')
             else:
                 f_tmp=Dataset(full_path_try,'r')
 
-            if ivar in f_tmp.variables.keys():
+            if f_tmp is not None and ivar in f_tmp.variables.keys():
                 out_list.append(f_tmp.variables[ivar][:])
                 if not suppress_warning: print('**Warning*** Using variable %s in %s instead of original file(s)'%(ivar,full_path_try))
                 f_tmp.close()
             else:
-                f_tmp.close()
-                full_path_try=alt_FV3path(Ncdf_path,alt='fixed',test_exist=True)
+                if f_tmp is not None:f_tmp.close()
+                full_path_try=resolve_alt_path(Ncdf_path,alt='fixed')
                 if file_is_MF:full_path_try=full_path_try[0]
 
-                f_tmp=Dataset(full_path_try,'r')
-                if ivar in f_tmp.variables.keys():
-                    out_list.append(f_tmp.variables[ivar][:])
-                    f_tmp.close()
+                if index_has_variable(full_path_try,ivar) is False:
+                    var=None
+                else:
+                    var=read_fixed_variable(full_path_try,ivar)
+                if var is not None:
+                    out_list.append(var)
                     if not suppress_warning: print('**Warning*** Using variable %s in %s instead of original file(s)'%(ivar,full_path_try))
                 else:
                     print('***ERROR*** Variable %s not found in %s, NOR in raw output or fixed file'%(ivar,full_path_try))
                     print('            >>> Assigning  %s  to NaN'%(ivar))
-                    f_tmp.close()
                     out_list.append(np.NaN)
     if one_element:out_list=out_list[0]
     return out_list
@@ -613,7 +910,7 @@ def filter_vars(fNcdf,include_list=None,giveExclude=False):
         out_list=  exclude_list
     return  out_list
 
-def find_fixedfile(filename):
+def find_fixedfile(filename,use_index=True):
     '''
     Batterson, Updated by Alex Nov 29 2022
     Args:
@@ -633,6 +930,8 @@ def find_fixedfile(filename):
             atmos_average.tileX_plevs_custom.nc     -> fixed.tileX.nc
             atmos_average_custom.tileX_plevs.nc     -> fixed.tileX.nc
 
+        If none of these exist and the directory was indexed with MarsFiles --index, the fixed file
+        with the same grid recorded in the catalog is used (e.g. for Luca_dust_MY24_dust.nc).
     '''
     filepath,fname=extract_path_basename(filename)
     #Try the 'tile' or 'standard' version of the fixed files
@@ -640,7 +939,11 @@ def find_fixedfile(filename):
         name_fixed= filepath + '/fixed.tile'+fname.split('tile')[1][0] + '.nc'
     else:
         name_fixed=filepath + '/'+ fname.split('.')[0] + '.fixed.nc'
-    #If neither is found set-up a default name
+    #If neither is found, try the catalog of the directory, then set-up a default name
+    if not os.path.exists(name_fixed) and use_index:
+        index=read_index(filepath)
+        if index is not None and index.get(fname,{}).get('fixed'):
+            name_fixed=filepath + '/' + index[fname]['fixed']
     if not  os.path.exists(name_fixed): name_fixed='FixedFileNotFound'
     return name_fixed
 
@@ -970,7 +1273,7 @@ def ak_bk_loader(fNcdf):
         ak,bk : the ak, bk values
     ***NOTE***
 
-    This routine will look for both 'ak' and 'pk'.
+    This routine will look for both 'ak' and 'pk', and raises an IOError if neither the file nor the fixed file have them.
 
     There are cases when it is convenient to load the  pk, bk once at the begining of the files in MarsVars.py,
     However the pk, bk may not be used at all in the calculation. This is the case with MarsVars.py XXXXX.atmos_average_psd.nc --add msf (which operates on the _pstd.nc file)
@@ -996,27 +1299,75 @@ def ak_bk_loader(fNcdf):
 
     else:
         try:
+            #The fixed file is only read once for all the files that share it
             name_fixed=find_fixedfile(fullpath_name)
-            f_fixed=Dataset(name_fixed, 'r', format='NETCDF4_CLASSIC')
-            allvars=f_fixed.variables.keys()
             #Check for ak firdt, then pk
-            if 'ak' in allvars:
-                ak=np.array(f_fixed.variables['ak'])
-            else:
-                ak=np.array(f_fixed.variables['pk'])
-            bk=np.array(f_fixed.variables['bk'])
-            f_fixed.close()
+            ak=read_fixed_variable(name_fixed,'ak')
+            if ak is None:ak=read_fixed_variable(name_fixed,'pk')
+            bk=read_fixed_variable(name_fixed,'bk')
+            if ak is None or bk is None:raise KeyError('pk, bk')
+            ak=np.array(ak)
+            bk=np.array(bk)
             print('pk bk in fixed file')
-        except:
-            prRed('Fixed file does not exist in '\
+        except Exception:
+            raise IOError('Fixed file does not exist in '\
                             + filepath + ' make sure the fixed '\
                             'file you are referencing matches the '\
                             'FV3 filetype (i.e. fixed.tileX.nc '\
                             'for operations on tile X)')
-            exit()
 
     return ak,bk
 
+# Variable dictionary compiled from ~/.amescap_profile, with the modification time of the profile it was read from,
+# and the models already built for a given set of variables and dimensions in the files
+variable_dict_profile=None
+variable_dict_mtime=None
+variable_dict_models={}
+
+def compile_variable_dict_amescap_profile():
+    '''
+    Parse the 'Variable dictionary' section of ~/.amescap_profile into a lookup table. The section is only parsed
+    once per process and parsed again if the profile is modified.
+    Returns:
+        entries: a list of (attribute name, default name, is_dimension, list of possible names in files), e.g.
+                 ('ucomp','ucomp',False,['U','u']) or ('dim_lat','lat',True,['lats'])
+    '''
+    global variable_dict_profile,variable_dict_mtime
+    try:
+        mtime=os.path.getmtime(os.environ['HOME']+'/.amescap_profile')
+    except OSError:
+        mtime=None #section_content_amescap_profile() reports the missing profile
+
+    if variable_dict_profile is not None and mtime==variable_dict_mtime:return variable_dict_profile
+
+    all_lines=section_content_amescap_profile('Variable dictionary')
+    entries=[]
+    #Read through all lines in the Variable dictionary section of amesgcm_profile:
+    for il in all_lines.split('\n'):
+        if il=='':continue
+        #e.g. 'X direction wind [m/s]                          (ucomp)>U,u'
+        left,right=il.split('>') #Split on either side of '>'
+
+        #If using {var}, current entry is a dimension. If using (var), it is a variable
+        if '{' in left:
+            sep1='{';sep2='}';is_dim=True
+        elif '(' in left:
+            sep1='(';sep2=')';is_dim=False
+
+        # First get 'ucomp' from  'X direction wind [m/s]      (ucomp)
+        _,tmp=left.split(sep1)
+        FV3_var=tmp.replace(sep2,'').strip() #THIS IS THE FV3 NAME OF THE CURRENT VARIABLE
+        #Then, get the list of variable on the righ-hand side, e.g.  'U,u'
+        var_list=[ii.strip() for ii in right.split(',')] #var_list IS A LIST OF POTENTIAL CORRESPONDING VARIABLES
+        #If the list is empty, e.g just [''], use the default FV3 variable presents in () or {}
+        if len(var_list)==1 and var_list[0]=='':var_list[0]=FV3_var
+        entries.append(('dim_'+FV3_var if is_dim else FV3_var,FV3_var,is_dim,var_list))
+
+    variable_dict_profile=entries
+    variable_dict_mtime=mtime
+    variable_dict_models.clear()
+    return entries
+
 def read_variable_dict_amescap_profile(f_Ncdf=None):
     '''
     Inspect a Netcdf file and return the name of the variables and dimensions based on the content of ~/.amescap_profile.
@@ -1035,71 +1386,391 @@ def read_variable_dict_amescap_profile(f_Ncdf=None):
     Ncdf Y latitude dimension    [integer]          {lat}>lats
 
     The dimensions (lon,lat,pfull,pstd) are loaded in the dictionary as model.dim_lon, model.dim_lat
+
+    The names only depend on the variables and dimensions present in the file so the result is cached for files
+    with the same content, e.g. when processing many files from the same simulation.
     '''
+    entries=compile_variable_dict_amescap_profile()
 
     if f_Ncdf is not None:
-        var_list_Ncdf=list(f_Ncdf.variables.keys())
-        dim_list_Ncdf=list(f_Ncdf.dimensions.keys())
+        var_list_Ncdf=frozenset(f_Ncdf.variables.keys())
+        dim_list_Ncdf=frozenset(f_Ncdf.dimensions.keys())
     else:
-        var_list_Ncdf=[]
-        dim_list_Ncdf=[]
-
-    all_lines=section_content_amescap_profile('Variable dictionary')
-    lines=all_lines.split('\n')
-    #Remove empty lines:
-    while("" in lines):lines.remove("")
+        var_list_Ncdf=frozenset()
+        dim_list_Ncdf=frozenset()
 
     #Initialize model
     class model(object):
         pass
     MOD=model()
 
-    #Read through all lines in the Variable dictionary section of amesgcm_profile:
-    for il in lines:
-        var_list=[]
-        #e.g. 'X direction wind [m/s]                          (ucomp)>U,u'
-        left,right=il.split('>') #Split on either side of '>'
+    key=(var_list_Ncdf,dim_list_Ncdf)
+    if key in variable_dict_models:
+        MOD.__dict__.update(variable_dict_models[key])
+        return MOD
 
-        #If using {var}, current entry is a dimension. If using (var), it is a variable
-        if '{' in left:
-            sep1='{';sep2='}';type_input='dimension'
-        elif '(' in left:
-            sep1='(';sep2=')';type_input='variable'
+    for name,FV3_var,is_dim,var_list in entries:
+        #Place the input in the appropriate varialbe () or dimension {} dictionary
+        found_list=[ivar for ivar in var_list if ivar in (dim_list_Ncdf if is_dim else var_list_Ncdf)]
+        if len(found_list)==0:
+            setattr(MOD,name,FV3_var)
+        else:
+            setattr(MOD,name,found_list[0])
+            if len(found_list)>1:
+                prYellow('''***Warning*** more than one possible %s '%s' found in file: %s'''%('dimension' if is_dim else 'variable',FV3_var,found_list))
 
-        # First get 'ucomp' from  'X direction wind [m/s]      (ucomp)
-        _,tmp=FV3_var=left.split(sep1)
-        FV3_var=tmp.replace(sep2,'').strip() #THIS IS THE FV3 NAME OF THE CURRENT VARIABLE
-        #Then, get the list of variable on the righ-hand side, e.g.  'U,u'
-        all_vars=right.split(',')
-        for ii in all_vars:
-            var_list.append(ii.strip())  #var_list IS A LIST OF POTENTIAL CORRESPONDING VARIABLES
-        #Set the attribute to the dictionary
-        #If the list is empty, e.g just [''], use the default FV3 variable presents in () or {}
-        if len(var_list)==1 and var_list[0]=='':var_list[0]=FV3_var #var_list IS A LIST OF POTENTIAL CORRESPONDING VARIABLES
-        found_list=[]
+    variable_dict_models[key]=dict(MOD.__dict__)
+    return MOD
 
-        #Place the input in the appropriate varialbe () or dimension {} dictionary
-        #print('var_list>>>',var_list)
-        if type_input=='variable':
-            for ivar in var_list:
-                if ivar in var_list_Ncdf:found_list.append(ivar)
-
-            if len(found_list)==0:
-                setattr(MOD,FV3_var,FV3_var)
-            elif  len(found_list)==1:
-                setattr(MOD,FV3_var,found_list[0])
-            else:
-                setattr(MOD,FV3_var,found_list[0])
-                prYellow('''***Warning*** more than one possible variable '%s' found in file: %s'''%(FV3_var,found_list))
-        if type_input=='dimension':
-            for ivar in var_list:
-                if ivar in dim_list_Ncdf:found_list.append(ivar)
-            if len(found_list)==0:
-                setattr(MOD,'dim_'+FV3_var,FV3_var)
-            elif  len(found_list)==1:
-                setattr(MOD,'dim_'+FV3_var,found_list[0])
+# Catalog of the netcdf files in a directory, written by MarsFiles --index, and the catalogs already loaded by the process
+index_name='.amescap_index.json'
+index_cache={}
+
+def index_entry(fullpath):
+    '''
+    Describe a netcdf file for the directory catalog.
+    Args:
+        fullpath: full path to the netcdf file
+    Returns:
+        entry: a dictionary with the file type ('fixed', 'contineous', 'diurn'), the vertical grid, the variables,
+               the dimensions and their sizes, the [first, last, length] of 'time', the [min, max] solar longitudes
+               (contineous, from 'areo'). Unreadable files have a None type.
+    '''
+    from netCDF4 import Dataset
+
+    stat=os.stat(fullpath)
+    entry={'size':stat.st_size,'mtime':stat.st_mtime,'type':None}
+    try:
+        f=Dataset(fullpath,'r')
+    except Exception:
+        return entry
+    try:
+        entry['type'],entry['interp']=FV3_file_type(f)
+        entry['variables']=list(f.variables.keys())
+        entry['dimensions']={name:len(dim) for name,dim in f.dimensions.items()}
+        entry['time']=None
+        entry['Ls']=None
+        model=read_variable_dict_amescap_profile(f)
+        if model.time in f.variables and f.variables[model.time].size>0:
+            time=np.asarray(f.variables[model.time][:],dtype=float).flatten()
+            entry['time']=[float(time[0]),float(time[-1]),int(time.size)]
+        if 'areo' in f.variables and f.variables['areo'].size>0:
+            areo=np.asarray(f.variables['areo'][:],dtype=float)
+            areo=areo.reshape(areo.shape[0],-1)[:,0] if areo.ndim>1 else areo
+            #Make the solar longitude contineous if it wraps around 360 inside the file
+            Ls=areo[0]+np.concatenate([[0],np.cumsum(np.diff(areo)%360)])
+            entry['Ls']=[float(Ls.min()),float(Ls.max())]
+    except Exception:
+        entry['type']=None
+    f.close()
+    return entry
+
+def update_index(path='.',verbose=False):
+    '''
+    Create or update the catalog of the netcdf files in a directory. Only the new files and the files that were
+    modified since the last update are opened. Each entry (see index_entry()) also gets the name of the matching
+    fixed file in 'fixed'.
+    Args:
+        path: the directory to index
+        verbose: print the files that are added or removed
+    Returns:
+        index: a dictionary {filename: entry}, see index_entry()
+    '''
+    import json
+    index_file=os.path.join(path,index_name)
+    try:
+        with open(index_file,'r') as f:
+            index=json.load(f)
+    except (OSError,ValueError):
+        index={}
+
+    changed=False
+    names=sorted(name for name in os.listdir(path) if name[-3:]=='.nc')
+    for name in names:
+        stat=os.stat(os.path.join(path,name))
+        if name in index and index[name]['size']==stat.st_size and index[name]['mtime']==stat.st_mtime:continue
+        if verbose:prCyan('Indexing %s'%(name))
+        index[name]=index_entry(os.path.join(path,name))
+        changed=True
+    for name in set(index)-set(names):
+        if verbose:prYellow('Removing %s from the index'%(name))
+        del index[name]
+        changed=True
+
+    if changed:
+        #Link each file to its fixed file: the one named after the file (see find_fixedfile()) or else,
+        #the last fixed file in the directory with the same grid
+        fixed_names=[name for name in names if index[name]['type']=='fixed']
+        for name in names:
+            entry=index[name]
+            if entry['type'] is None:continue
+            name_fixed=os.path.basename(find_fixedfile(os.path.join(path,name),use_index=False))
+            if name_fixed=='FixedFileNotFound':
+                name_fixed=None
+                for ifixed in fixed_names:
+                    shared=set(entry['dimensions'])&set(index[ifixed]['dimensions'])
+                    if shared and all(entry['dimensions'][idim]==index[ifixed]['dimensions'][idim] for idim in shared):
+                        name_fixed=ifixed
+            entry['fixed']=name_fixed
+
+    if changed or not os.path.exists(index_file):
+        #Write to a temporary file first so that other processes never read a partial catalog
+        try:
+            with open(index_file+'.%i'%(os.getpid()),'w') as f:
+                json.dump(index,f,separators=(',',':'),sort_keys=True)
+            os.replace(index_file+'.%i'%(os.getpid()),index_file)
+        except OSError:
+            if verbose:prYellow('***Warning*** could not write %s'%(index_file))
+    index_cache[os.path.abspath(path)]=(os.stat(path).st_mtime,index)
+    return index
+
+def read_index(path='.'):
+    '''
+    Return the catalog of a directory if MarsFiles --index was used in that directory, updated if files were added,
+    removed or modified since. The catalog is kept in memory for the rest of the process and only updated again when
+    the content of the directory changes.
+    Args:
+        path: the directory
+    Returns:
+        index: a dictionary {filename: entry} (see index_entry()), or None if the directory is not indexed
+    '''
+    key=os.path.abspath(path)
+    try:
+        dir_mtime=os.stat(path).st_mtime
+    except OSError:
+        return None
+    if key in index_cache and index_cache[key][0]==dir_mtime:return index_cache[key][1]
+    if not os.path.exists(os.path.join(path,index_name)):return None
+    return update_index(path)
+
+def index_query(index,file_type=None,Ls=None,var=None):
+    '''
+    Search a directory catalog.
+    Args:
+        index: a catalog returned by read_index() or update_index()
+        file_type: keep the files of that type, e.g. 'atmos_average_pstd' for 00668.atmos_average_pstd.nc or 'fixed'
+        Ls: [Ls min, Ls max], keep the files with data between these solar longitudes. Values in 0-360 match any Mars year
+        var: keep the files that contain that variable, e.g. 'zsurf'
+    Returns:
+        names: the sorted list of the matching files
+
+    ***NOTE***
+    The last fixed file in the directory is index_query(index,file_type='fixed')[-1]
+    '''
+    names=[]
+    for name in sorted(index):
+        entry=index[name]
+        if entry['type'] is None:continue
+        if file_type is not None:
+            #Remove the date, e.g. '00668.atmos_average.nc' > 'atmos_average'
+            base=name[:-3].split('.',1)[1] if name[:5].isdigit() and name[5:6]=='.' else name[:-3]
+            if base!=file_type:continue
+        if var is not None and var not in entry['variables']:continue
+        if Ls is not None:
+            if entry['Ls'] is None:continue
+            Ls_min,Ls_max=entry['Ls']
+            if max(Ls)<360.:
+                #Shift the request to the Mars years covered by the file
+                shifts=360.*np.arange(np.floor((Ls_min-max(Ls))/360.),np.ceil((Ls_max-min(Ls))/360.)+1)
             else:
-                setattr(MOD,'dim_'+FV3_var,found_list[0])
-                prYellow('''***Warning*** more than one possible dimension '%s' found in file: %s'''%(FV3_var,found_list))
+                shifts=np.zeros(1)
+            if not np.any((min(Ls)+shifts<=Ls_max)&(max(Ls)+shifts>=Ls_min)):continue
+        names.append(name)
+    return names
 
-    return MOD
+def index_has_variable(fullpath,var):
+    '''
+    Check in the directory catalog (see MarsFiles --index) if a file contains a variable, without opening the file.
+    Args:
+        fullpath: full path to the netcdf file, or list of files (the first file is checked)
+        var: the variable name, e.g. 'zsurf'
+    Returns:
+        True or False, or None if the file is not in an up-to-date catalog
+    '''
+    if type(fullpath)==list:fullpath=fullpath[0]
+    path,name=os.path.split(fullpath)
+    index=read_index(path if path else '.')
+    if index is None or name not in index or index[name]['type'] is None:return None
+    try:
+        stat=os.stat(fullpath)
+    except OSError:
+        return None
+    if index[name]['size']!=stat.st_size or index[name]['mtime']!=stat.st_mtime:return None
+    return var in index[name]['variables']
+
+class Range_dim(object):
+    '''
+    A dimension of a Range_dataset, e.g. its time dimension that spans all the files.
+    '''
+    def __init__(self,name,size,unlimited=False):
+        self.name=name
+        self._name=name
+        self.size=size
+        self._unlimited=unlimited
+
+    def __len__(self):
+        return self.size
+
+    def isunlimited(self):
+        return self._unlimited
+
+class Range_var(object):
+    '''
+    A variable of a Range_dataset. Slicing it only reads the covered time steps of the files. The other attributes
+    (long_name, units...) are the ones of the variable in the first file.
+    '''
+    def __init__(self,dataset,name):
+        self._dataset=dataset
+        self._var=dataset._datasets[0].variables[name]
+        self.name=name
+        self._name=name
+        self.dimensions=self._var.dimensions
+        self.dtype=self._var.dtype
+        self.ndim=len(self.dimensions)
+        self.shape=tuple(len(dataset.dimensions[idim]) for idim in self.dimensions)
+        self.size=int(np.prod(self.shape))
+        self._time_axis=self.dimensions.index(dataset.time_dim) if dataset.time_dim in self.dimensions else None
+
+    def __getattr__(self,attr):
+        if attr.startswith('_'):raise AttributeError(attr)
+        return getattr(self._var,attr)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def ncattrs(self):
+        return self._var.ncattrs()
+
+    def __getitem__(self,key):
+        if self._time_axis is None:return self._var[key]
+
+        #Expand the key to one entry per dimension, e.g. [0,...] > (0,slice(None),slice(None))
+        if not isinstance(key,tuple):key=(key,)
+        ellipsis=[i for i,k in enumerate(key) if k is Ellipsis]
+        if ellipsis:
+            i=ellipsis[0]
+            key=key[:i]+(slice(None),)*(self.ndim-len(key)+1)+key[i+1:]
+        key=key+(slice(None),)*(self.ndim-len(key))
+
+        t_key=key[self._time_axis]
+        steps=np.arange(self.shape[self._time_axis])[t_key]
+        one_step=np.ndim(steps)==0
+        steps=np.atleast_1d(steps)
+        file_id=self._dataset._file_id[steps]
+        local=self._dataset._local_step[steps]
+
+        #Read the consecutive time steps of the same file at once
+        breaks=np.nonzero((np.diff(file_id)!=0)|(np.diff(local)!=1))[0]+1
+        blocks=[]
+        for run in np.split(np.arange(steps.size),breaks):
+            if run.size==0:continue
+            fvar=self._dataset._datasets[file_id[run[0]]].variables[self.name]
+            blocks.append(fvar[key[:self._time_axis]+(slice(local[run[0]],local[run[-1]]+1),)+key[self._time_axis+1:]])
+        if not blocks:
+            fvar=self._dataset._datasets[0].variables[self.name]
+            return fvar[key[:self._time_axis]+(slice(0,0),)+key[self._time_axis+1:]]
+
+        #Time axis of the blocks, after the integer indices before it were removed
+        axis=self._time_axis-sum(1 for k in key[:self._time_axis] if np.ndim(k)==0 and not isinstance(k,slice))
+        var=np.ma.concatenate(blocks,axis=axis) if len(blocks)>1 else blocks[0]
+        if one_step:var=np.take(var,0,axis=axis)
+        return var
+
+class Range_dataset(object):
+    '''
+    A read-only netcdf-like view of the time steps between two solar longitudes (or two sols) in a list of files,
+    e.g. Ls 180-270 in 20 XXXXX.atmos_daily.nc files, without combining the files first.
+    Only the files that cover the range are opened and only the covered time steps are read when the variables are sliced.
+    Args:
+        file_list: list of files, sorted in time, e.g. ['/path/00000.atmos_daily.nc','/path/00668.atmos_daily.nc']
+        Ls: [Ls min, Ls max], values in 0-360 select the range in every Mars year, e.g. [330,30] for Ls 330-360 and 0-30.
+            Larger values are compared with the contineous solar longitude in the files
+        sol: [sol min, sol max], compared with the 'time' variable in the files
+    Returns:
+        A dataset with .variables, .dimensions and .close() similar to netCDF4's Dataset
+
+    ***NOTE***
+    If the directory was indexed with MarsFiles --index, the files that are out of the Ls range are not opened.
+    Raise ValueError if there is no time step in the range.
+    '''
+    def __init__(self,file_list,Ls=None,sol=None):
+        from netCDF4 import Dataset
+        if (Ls is None)==(sol is None):raise ValueError('In Range_dataset(), provide either Ls or sol')
+        bounds=np.asarray(Ls if Ls is not None else sol,dtype=float)
+
+        self._datasets=[]
+        self._files=[]
+        file_id=[]
+        local_step=[]
+        for fullpath in file_list:
+            #Skip the files that the directory catalog shows are out of the range
+            if Ls is not None and bounds[0]<=bounds[1]:
+                path,name=os.path.split(fullpath)
+                index=read_index(path if path else '.')
+                if index is not None and name in index and not index_query({name:index[name]},Ls=bounds):continue
+
+            f=Dataset(fullpath,'r')
+            model=read_variable_dict_amescap_profile(f)
+            if model.time not in f.dimensions:
+                f.close()
+                raise ValueError('In Range_dataset(), %s has no %s dimension'%(fullpath,model.time))
+            if Ls is not None:
+                areo=np.asarray(f.variables['areo'][:],dtype=float)
+                areo=areo.reshape(areo.shape[0],-1)[:,0] if areo.ndim>1 else areo
+                if bounds.max()<=360.:
+                    areo=areo%360
+                    if bounds[0]<=bounds[1]:
+                        in_range=(areo>=bounds[0])&(areo<=bounds[1])
+                    else:
+                        in_range=(areo>=bounds[0])|(areo<=bounds[1])
+                else:
+                    in_range=(areo>=bounds[0])&(areo<=bounds[1])
+            else:
+                time=np.asarray(f.variables[model.time][:],dtype=float)
+                in_range=(time>=bounds[0])&(time<=bounds[1])
+
+            steps=np.nonzero(in_range)[0]
+            if steps.size==0:
+                f.close()
+                continue
+            file_id.append(np.full(steps.size,len(self._datasets)))
+            local_step.append(steps)
+            self._datasets.append(f)
+            self._files.append(fullpath)
+            self.time_dim=model.time
+
+        if not self._datasets:
+            raise ValueError('No data between %s %g and %g in %s'%('Ls' if Ls is not None else 'sol',bounds[0],bounds[1],file_list))
+        self._file_id=np.concatenate(file_id)
+        self._local_step=np.concatenate(local_step)
+
+        f=self._datasets[0]
+        self.dimensions={}
+        for name,dim in f.dimensions.items():
+            if name==self.time_dim:
+                self.dimensions[name]=Range_dim(name,self._file_id.size,dim.isunlimited())
+            else:
+                self.dimensions[name]=Range_dim(name,len(dim),dim.isunlimited())
+        self.variables={name:Range_var(self,name) for name in f.variables}
+
+    def __getattr__(self,attr):
+        if attr.startswith('_'):raise AttributeError(attr)
+        return getattr(self._datasets[0],attr)
+
+    def ncattrs(self):
+        return self._datasets[0].ncattrs()
+
+    def filepath(self):
+        return self._files[0]
+
+    def time_windows(self):
+        '''
+        Return the [start, stop) time steps of the view read from each file, in order, e.g. to copy the data file by file.
+        '''
+        breaks=np.nonzero((np.diff(self._file_id)!=0)|(np.diff(self._local_step)!=1))[0]+1
+        starts=np.concatenate([[0],breaks])
+        stops=np.concatenate([breaks,[self._file_id.size]])
+        return list(zip(starts.tolist(),stops.tolist()))
+
+    def close(self):
+        for f in self._datasets:f.close()
@@ -1,18 +1,26 @@
 #!/usr/bin/env python
-from amescap.FV3_utils import sol2ls,ls2sol
-from amescap.Script_utils import prYellow,prRed
 import argparse #parsing arguments
-import numpy as np
 
 
 parser = argparse.ArgumentParser(description='Gives the solar longitude from a SOL or a SOL array (start stop, step), adapted from areols.py',
                                 formatter_class=argparse.RawTextHelpFormatter)
 
-parser.add_argument('sol', nargs='+',type=float,
+parser.add_argument('sol', nargs='*',type=float,
                              help='''Input is sol number, return solar longitude \n'''
                                   '''Usage: ./MarsCalendar.py 750. \n'''
                                   '''       ./MarsCalendar.py start stop step''')
 
+parser.add_argument('-f','--file', nargs='?',const='-',default=None,
+                             help='''Read the sols (or Ls with -ls) from a text file (values separated by spaces or new lines) or a .npy file \n'''
+                                  '''The values are read from the standard input if no file is provided. Results are written one per line \n'''
+                                  '''Usage: ./MarsCalendar.py -f sols.txt \n'''
+                                  '''       cat Ls.txt | ./MarsCalendar.py -f -ls > sols.txt \n'''
+                                  '''       ./MarsCalendar.py -f sols.npy -o Ls.npy \n''')
+
+parser.add_argument('-o','--output', default=None,
+                             help='''With -f, save the results in a .npy file instead of printing them \n'''
+                                  '''Usage: ./MarsCalendar.py -f sols.txt -o Ls.npy \n''')
+
 parser.add_argument('-ls','--ls', action='store_true',
                     help="""Reverse operation. Inpout is Ls, output is sol \n"""
                     """> Usage: ./MarsCalendar.py start stop step' -ls \n"""
@@ -28,7 +36,74 @@ parser.add_argument('-cum', action='store_true',
                                   '''Usage: ./MarsCalendar.py  670 -cum \n''')
 
 
+chunk_size=1000000 #number of values converted at once in the file mode
+read_size=8*1024**2 #size in bytes of the blocks read from a text file
+
+def read_chunks(fileIn):
+    '''
+    Generator returning the values of a text or .npy file as 1D arrays of about chunk_size elements
+    Args:
+        fileIn: path to a text or a .npy file, or '-' for the standard input
+    '''
+    if fileIn.endswith('.npy'):
+        data=np.load(fileIn,mmap_mode='r').reshape(-1)
+        for i in range(0,len(data),chunk_size):
+            yield np.asarray(data[i:i+chunk_size],dtype=float)
+        return
+
+    f=sys.stdin if fileIn=='-' else open(fileIn,'r')
+    tail=''
+    while True:
+        block=f.read(read_size)
+        if not block:break
+        block=tail+block
+        #Hold the last value, which may continue in the next block
+        cut=max(block.rfind(' '),block.rfind('\n'),block.rfind('\t'),block.rfind(','))
+        tail=block[cut+1:]
+        values=block[:cut+1].replace(',',' ').split()
+        if values:yield np.array(values,dtype=float)
+    if tail.strip():yield np.array(tail.replace(',',' ').split(),dtype=float)
+    if f is not sys.stdin:f.close()
+
+def convert_file(fileIn,fileOut,to_sol,cum,my):
+    '''
+    Convert all the values of a file, chunk by chunk
+    Args:
+        fileIn:  path to a text or a .npy file, or '-' for the standard input
+        fileOut: path to a .npy file for the results, or None to print them to the standard output
+        to_sol:  if True, convert Ls to sols, otherwise sols to Ls
+        cum:     for sols to Ls, return cumulative Ls
+        my:      Mars Year, for Ls to sols add 668 sols per year
+    '''
+    if fileIn!='-' and not os.path.exists(fileIn):
+        prRed('File %s not found'%(fileIn))
+        exit()
+    results=[]
+    for values in read_chunks(fileIn):
+        if to_sol:
+            result=np.atleast_1d(ls2sol(values))+my*668.
+        else:
+            result=sol2ls(values,cummulative=cum)
+        if fileOut:
+            results.append(result)
+        else:
+            #Format the whole chunk at once
+            sys.stdout.write(('%.6f\n'*len(result))%tuple(result))
+    if fileOut:
+        result=np.concatenate(results) if results else np.array([])
+        #np.save() appends .npy to the names without it
+        if not fileOut.endswith('.npy'):fileOut+='.npy'
+        np.save(fileOut,result)
+        prCyan(fileOut+' was created')
+
 if __name__ == '__main__':
+    # Handle --help and the syntax errors before importing the scientific modules so that they return quickly
+    parser.parse_args()
+    import sys
+    import os
+    import numpy as np
+    from amescap.FV3_utils import sol2ls,ls2sol
+    from amescap.Script_utils import prYellow,prRed,prCyan
 
 
     #Load in Mars YEAR (if any, default is zero) and cummulative Ls
@@ -36,9 +111,17 @@ if __name__ == '__main__':
     cum=False
     if parser.parse_args().cum:cum=True
 
+    #Bulk conversion from a file or the standard input
+    if parser.parse_args().file:
+        convert_file(parser.parse_args().file,parser.parse_args().output,parser.parse_args().ls,cum,my)
+        exit()
+
     data_input=np.asarray(parser.parse_args().sol).astype(float)
 
-    if len(data_input)==1:
+    if len(data_input)==0:
+        prRed('No input: enter [sol/ls] or [start stop step], or use -f to read from a file')
+        exit()
+    elif len(data_input)==1:
         in_array=data_input
     elif len(data_input)==3:
         in_array=np.arange(data_input[0],data_input[1],data_input[2]) #start stop step
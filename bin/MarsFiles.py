@@ -10,16 +10,8 @@ import re           # string matching module to handle time_of_day_XX
 import glob
 import shutil
 import subprocess   # run command
-import numpy as np
-from netCDF4 import Dataset
 import warnings     # suppress certain errors when dealing with NaN arrays
 
-# ==========
-from amescap.Ncdf_wrapper import Ncdf, Fort
-from amescap.FV3_utils import tshift, daily_to_average, daily_to_diurn, get_trend_2D
-from amescap.Script_utils import prYellow, prCyan, prRed, find_tod_in_diurn, FV3_file_type, filter_vars, regrid_Ncfile, get_longname_units,extract_path_basename
-# ==========
-
 # ======================================================
 #                  ARGUMENT PARSER
 # ======================================================
@@ -46,8 +38,9 @@ parser.add_argument('-c', '--combine', action='store_true',
 
 parser.add_argument('-split', '--split', nargs='+',
                     help="""Extract values between min and max solar longitudes 0-360 [°]\n"""
-                    """  This assumes all values in the file are from only one Mars Year. \n"""
+                    """  Values in 0-360 are selected in every Mars Year, larger values in contineous solar longitude. \n"""
                     """> Usage: MarsFiles.py 00668.atmos_average.nc --split 0 90 \n"""
+                    """>        MarsFiles.py *.atmos_daily.nc --split 180 270 (from several files, without combining them first)\n"""
                     """ \n""")
 
 parser.add_argument('-t', '--tshift', nargs='?', const=999, type=str,
@@ -131,6 +124,21 @@ parser.add_argument('-za', '--zonal_avg', action='store_true',
                     """> Usage: MarsFiles.py *.atmos_diurn.nc -za \n"""
                     """ \n""")
 
+parser.add_argument('-pyr', '--pyramid', type=str,
+                    help="""Write coarsened copies of a file for quick-look plots, averaging blocks of NxN grid points (area-weighted). \n"""
+                    """> Usage: MarsFiles.py 00668.atmos_average.nc --pyramid 2,4,8 \n"""
+                    """  This will produce 00668.atmos_average.c2.nc, 00668.atmos_average.c4.nc and 00668.atmos_average.c8.nc \n"""
+                    """  Use MarsPlot.py Custom.in --pyramid to plot from the coarsest file that is still finer than the panels \n"""
+                    """ \n""")
+
+parser.add_argument('-idx', '--index', nargs='*',
+                    help="""Create or update the catalog of the netcdf files in a directory (type, variables, time and Ls ranges, fixed file). \n"""
+                    """  The catalog is used by CAP to find files without opening them and is updated when files are added or modified. \n"""
+                    """> Usage: MarsFiles.py . --index                    (index the current directory and list the files) \n"""
+                    """>        MarsFiles.py . --index 200 260 atmos_daily (list the atmos_daily files with data between Ls 200 and 260) \n"""
+                    """>        MarsFiles.py . --index zsurf              (list the files with zsurf) \n"""
+                    """ \n""")
+
 parser.add_argument('-include', '--include', nargs='+',
                     help="""For data reduction, filtering, time-shifting, only include the listed variables. Dimensions and 1D variables are always included. \n"""
                     """> Usage: MarsFiles.py *.atmos_daily.nc -ba --include ps ts ucomp   \n"""
@@ -143,6 +151,20 @@ parser.add_argument('-e', '--ext', type=str, default=None,
 parser.add_argument('--debug',  action='store_true',
                     help='Debug flag: release the exceptions')
 
+# Handle --help and the syntax errors before importing the scientific modules so that they return quickly
+if __name__ == '__main__':
+    parser.parse_args()
+
+import numpy as np
+from netCDF4 import Dataset
+
+# ==========
+from amescap.Ncdf_wrapper import Ncdf, Fort
+from amescap.FV3_utils import tshift, daily_to_average, daily_to_diurn, get_trend_2D, coarsen_lat_lon
+from amescap.Script_utils import prYellow, prCyan, prRed, find_tod_in_diurn, FV3_file_type, filter_vars, regrid_Ncfile, get_longname_units,extract_path_basename
+from amescap.Script_utils import update_index, index_query, Range_dataset
+# ==========
+
 # Use ncks or internal method to concatenate files
 # cat_method='ncks'
 cat_method = 'internal'
@@ -286,38 +308,25 @@ def main():
             exit()
 
         # Add path unless full path is provided
-        if not ('/' in file_list[0]):
-            fullnameIN = path2data + '/' + file_list[0]
-        else:
-            fullnameIN = file_list[0]
-
+        histlist = []
+        for filei in file_list:
+            if not ('/' in filei):
+                histlist.append(path2data + '/' + filei)
+            else:
+                histlist.append(filei)
+        fullnameIN = histlist[0]
 
-        fNcdf = Dataset(fullnameIN, 'r', format='NETCDF4_CLASSIC')
+        # Only the time steps between Ls min and Ls max are read from the files
+        try:
+            fNcdf = Range_dataset(histlist, Ls=bounds)
+        except ValueError as error:
+            prRed('Warning, requested Ls min = %g and Ls max= %g are out of file range: %s'%(bounds[0],bounds[1],error))
+            exit()
         var_list = filter_vars(
             fNcdf, parser.parse_args().include)  # Get all variables
 
-        time_in = fNcdf.variables['time'][:]
-
-        #===Read areo variable===
-        f_type,_=FV3_file_type(fNcdf)
-
-        if f_type=='diurn': #size is areo (133,24,1)
-            areo_in = np.squeeze(fNcdf.variables['areo'][:,0,:])%360
-        else:               #size is areo (133,1)
-            areo_in = np.squeeze(fNcdf.variables['areo'][:])%360
-
-
-        imin=np.argmin(np.abs(bounds[0]-areo_in))
-        imax=np.argmin(np.abs(bounds[1]-areo_in))
-
-        if imin==imax:
-            prRed('Warning, requested Ls min = %g and Ls max= %g are out of file range Ls(%.1f-%.1f)'%(bounds[0],bounds[1],areo_in[0],areo_in[-1]))
-            exit()
-
-        time_out=time_in[imin:imax]
-        prCyan(time_in)
-        prCyan(time_out)
-        len_sols=time_out[-1]-time_out[0]
+        time_out = fNcdf.variables['time'][:]
+        prCyan('%i time steps, sols %g-%g'%(len(time_out),time_out[0],time_out[-1]))
 
         fpath,fname=extract_path_basename(fullnameIN)
 
@@ -335,10 +344,14 @@ def main():
 
             if 'time' in varNcf.dimensions and ivar!='time':
                 prCyan("Processing: %s ..." % (ivar))
-                var_out = varNcf[imin:imax,...]
                 longname_txt, units_txt = get_longname_units(fNcdf, ivar)
-                Log.log_variable(
-                    ivar, var_out, varNcf.dimensions, longname_txt, units_txt)
+                # Copy the time steps file by file
+                for imin, imax in fNcdf.time_windows():
+                    if imin == 0:
+                        Log.log_variable(
+                            ivar, varNcf[imin:imax,...], varNcf.dimensions, longname_txt, units_txt)
+                    else:
+                        Log.var_dict[ivar][imin:imax,...] = varNcf[imin:imax,...]
 
             else:
                 if ivar in ['pfull', 'lat', 'lon', 'phalf', 'pk', 'bk', 'pstd', 'zstd', 'zagl']:
@@ -1065,6 +1078,127 @@ def main():
                         prCyan("Copying variable: %s..." % (ivar))
                         fnew.copy_Ncvar(fdaily.variables[ivar])
             fnew.close()
+
+    # ===========================================================================
+    # ===================  Coarsened files for quick-look plots  ================
+    # ===========================================================================
+
+    elif parser.parse_args().pyramid:
+        factors = [int(n) for n in parser.parse_args().pyramid.split(',')]
+
+        for filei in file_list:
+            # Add path unless full path is provided
+            if not ('/' in filei):
+                fullnameIN = path2data + '/' + filei
+            else:
+                fullnameIN = filei
+
+            fNcdf = Dataset(fullnameIN, 'r', format='NETCDF4_CLASSIC')
+            var_list = filter_vars(
+                fNcdf, parser.parse_args().include)  # Get all variables
+
+            lat_in = fNcdf.variables['lat'][:]
+            lon_in = fNcdf.variables['lon'][:]
+
+            for n in factors:
+                if n < 2 or len(lat_in) % n != 0 or len(lon_in) % n != 0:
+                    prYellow('*** Warning *** %i is not a factor of the grid size (%i lat x %i lon), skipping %s.c%i.nc' % (
+                        n, len(lat_in), len(lon_in), os.path.basename(fullnameIN)[:-3], n))
+                    continue
+                fullnameOUT = fullnameIN[:-3]+'.c%i' % (n)+'.nc'
+
+                # Append extension, if any:
+                if parser.parse_args().ext:
+                    fullnameOUT = fullnameOUT[:-3] + \
+                        '_'+parser.parse_args().ext+'.nc'
+
+                # Define a netcdf object from the netcdf wrapper module
+                fnew = Ncdf(fullnameOUT)
+                # Copy all dimensions but 'lat' and 'lon' from the old file to the new file
+                fnew.copy_all_dims_from_Ncfile(fNcdf, exclude_dim=['lat', 'lon'])
+
+                # The coarse cells are centered on the blocks of cells
+                fnew.add_dim_with_content('lat', lat_in.reshape(-1, n).mean(axis=1),
+                                          longname_txt="latitude", units_txt="degrees_N", cart_txt='Y')
+                fnew.add_dim_with_content('lon', lon_in.reshape(-1, n).mean(axis=1),
+                                          longname_txt="longitude", units_txt="degrees_E", cart_txt='X')
+
+                # Loop over all variables in the file
+                for ivar in var_list:
+                    varNcf = fNcdf.variables[ivar]
+                    longname_txt, units_txt = get_longname_units(fNcdf, ivar)
+                    dims = varNcf.dimensions
+                    if ivar in ['lat', 'lon', 'grid_xt_bnds', 'grid_yt_bnds']:
+                        pass
+                    elif 'lat' in dims or 'lon' in dims:
+                        prCyan("Coarsening (x%i): %s ..." % (n, ivar))
+                        lat_axis = dims.index('lat') if 'lat' in dims else None
+                        lon_axis = dims.index('lon') if 'lon' in dims else None
+                        if ivar == 'area':
+                            # Cell areas are added, not averaged
+                            var_out = coarsen_lat_lon(varNcf[:], lat_in, n, lat_axis, lon_axis,
+                                                      area_weighted=False)*n**(2-[lat_axis, lon_axis].count(None))
+                        else:
+                            var_out = coarsen_lat_lon(
+                                varNcf[:], lat_in, n, lat_axis, lon_axis)
+                        fnew.log_variable(ivar, var_out, dims,
+                                          longname_txt, units_txt)
+                    elif ivar in ['pfull', 'phalf', 'pk', 'bk', 'pstd', 'zstd', 'zagl']:
+                        prCyan("Copying axis: %s..." % (ivar))
+                        fnew.copy_Ncaxis_with_content(fNcdf.variables[ivar])
+                    else:
+                        prCyan("Copying variable: %s..." % (ivar))
+                        fnew.copy_Ncvar(fNcdf.variables[ivar])
+                fnew.close()
+            fNcdf.close()
+    # ===========================================================================
+    # ===================  Catalog of the files in a directory  =================
+    # ===========================================================================
+    elif parser.parse_args().index is not None:
+        # Sort the query: two numbers for an Ls range, a file type or a variable name
+        Ls_range = None
+        words = []
+        for item in parser.parse_args().index:
+            try:
+                words.append(float(item))
+            except ValueError:
+                words.append(item)
+        numbers = [item for item in words if type(item) == float]
+        if len(numbers) not in [0, 2]:
+            prRed('Requires two values: ls_min ls_max')
+            exit()
+        if numbers:
+            Ls_range = numbers
+
+        # Index the directories, or the directories of the files
+        paths = []
+        for filei in file_list:
+            path = filei if os.path.isdir(filei) else os.path.dirname(filei)
+            path = os.path.abspath(path if path else path2data)
+            if path not in paths:
+                paths.append(path)
+
+        for path in paths:
+            prCyan('Indexing %s ...' % (path))
+            index = update_index(path, verbose=True)
+            file_type = None
+            var = None
+            for item in words:
+                if type(item) == float:
+                    continue
+                if index_query(index, file_type=item):
+                    file_type = item
+                else:
+                    var = item
+            names = index_query(index, file_type=file_type, Ls=Ls_range, var=var)
+            for name in names:
+                entry = index[name]
+                Ls_txt = '' if entry['Ls'] is None else 'Ls %.1f-%.1f' % (entry['Ls'][0], entry['Ls'][1])
+                time_txt = '' if entry['time'] is None else 'time %g-%g (%i)' % tuple(entry['time'])
+                print('%-40s %-10s %-6s %-28s %-18s %s' % (name, entry['type'], entry['interp'],
+                                                          time_txt, Ls_txt, entry['fixed'] or ''))
+            prCyan('%i/%i files' % (len(names), len([name for name in index if index[name]['type'] is not None])))
+
     else:
         prRed("""Error: no action requested: use 'MarsFiles *nc --fv3 --combine, --tshift, --bin_average, --bin_diurn etc ...'""")
 
@@ -2,14 +2,7 @@
 
 #Load generic Python Modules
 import argparse   # parse arguments
-import numpy as np
-import xarray as xr
-from netCDF4 import Dataset
 import os
-from amescap.Script_utils import prPurple,prCyan,prLightPurple,prRed,read_variable_dict_amescap_profile,prYellow,filter_vars,get_longname_units
-from amescap.FV3_utils import daily_to_average, daily_to_diurn,layers_mid_point_to_boundary
-from amescap.Ncdf_wrapper import Ncdf, Fort
-xr.set_options(keep_attrs=True)
 
 #---
 # MarsFormat.py
@@ -30,6 +23,18 @@ parser.add_argument('-t', '--type', type=str, default='legacy',
                     """>  Usage: MarsFormat.py ****.nc \n"""
                     """          MarsFormat.py ****.nc -t openmars \n""")
 
+# Handle --help and the syntax errors before importing the scientific modules so that they return quickly
+if __name__ == '__main__':
+    parser.parse_args()
+
+import numpy as np
+import xarray as xr
+from netCDF4 import Dataset
+from amescap.Script_utils import prPurple,prCyan,prLightPurple,prRed,read_variable_dict_amescap_profile,prYellow,filter_vars,get_longname_units
+from amescap.FV3_utils import daily_to_average, daily_to_diurn,layers_mid_point_to_boundary
+from amescap.Ncdf_wrapper import Ncdf, Fort
+xr.set_options(keep_attrs=True)
+
 
 # ===========================
 path2data = os.getcwd()
@@ -8,35 +8,6 @@ import sys        # system command
 import time       # monitor interpolation time
 import re         # string matching module to handle time_of_day_XX
 
-# ==========
-from amescap.FV3_utils import fms_press_calc, fms_Z_calc, vinterp, find_n, polar2XYZ, interp_KDTree, axis_interp
-from amescap.Script_utils import check_file_tape, prYellow, prRed, prCyan, prGreen, prPurple, print_fileContent
-from amescap.Script_utils import read_variable_dict_amescap_profile
-from amescap.Script_utils import section_content_amescap_profile, find_tod_in_diurn, filter_vars, find_fixedfile, ak_bk_loader
-from amescap.Ncdf_wrapper import Ncdf
-# ==========
-
-# Attempt to import specific scientic modules that may or may not
-# be included in the default Python installation on NAS.
-try:
-    import matplotlib
-    matplotlib.use('Agg') # Force matplotlib NOT to use any Xwindows backend
-    import numpy as np
-    from netCDF4 import Dataset, MFDataset
-
-except ImportError as error_msg:
-    prYellow("Error while importing modules")
-    prYellow('You are using Python version '+str(sys.version_info[0:3]))
-    prYellow('Please source your virtual environment, e.g.:')
-    prCyan('    source envPython3.7/bin/activate.csh \n')
-    print("Error was: " + error_msg.message)
-    exit()
-except Exception as exception:
-    # Output unexpected Exceptions
-    print(exception, False)
-    print(exception.__class__.__name__ + ": " + exception.message)
-    exit()
-
 # ======================================================
 #                  ARGUMENT PARSER
 # ======================================================
@@ -74,6 +45,37 @@ parser.add_argument('-g', '--grid', action='store_true',
 parser.add_argument('--debug',  action='store_true',
                     help='Debug flag: release the exceptions.')
 
+# Handle --help and the syntax errors before importing the scientific modules so that they return quickly
+if __name__ == '__main__':
+    parser.parse_args()
+
+# ==========
+from amescap.FV3_utils import fms_press_calc, fms_Z_calc, vinterp, find_n, polar2XYZ, interp_KDTree, axis_interp
+from amescap.Script_utils import check_file_tape, check_files_tape, prYellow, prRed, prCyan, prGreen, prPurple, print_fileContent
+from amescap.Script_utils import read_variable_dict_amescap_profile
+from amescap.Script_utils import section_content_amescap_profile, find_tod_in_diurn, filter_vars, find_fixedfile, ak_bk_loader
+from amescap.Ncdf_wrapper import Ncdf
+# ==========
+
+# Attempt to import specific scientic modules that may or may not
+# be included in the default Python installation on NAS.
+try:
+    import numpy as np
+    from netCDF4 import Dataset, MFDataset
+
+except ImportError as error_msg:
+    prYellow("Error while importing modules")
+    prYellow('You are using Python version '+str(sys.version_info[0:3]))
+    prYellow('Please source your virtual environment, e.g.:')
+    prCyan('    source envPython3.7/bin/activate.csh \n')
+    print("Error was: " + error_msg.message)
+    exit()
+except Exception as exception:
+    # Output unexpected Exceptions
+    print(exception, False)
+    print(exception.__class__.__name__ + ": " + exception.message)
+    exit()
+
 
 # =====================================================================
 # =====================================================================
@@ -186,6 +188,10 @@ def main():
         print(*lev_in)
         exit()
 
+    # Check the status of all the files on tape at once, migrating them to disk
+    # in the background if needed (Lou only)
+    check_files_tape(file_list)
+
     # For all the files:
     for ifile in file_list:
         # First check if file is present on the disk (Lou only)
@@ -206,7 +212,11 @@ def main():
         # Load pk, bk, and ps for 3D pressure field calculation.
         # Read the pk and bk for each file in case the vertical resolution has changed.
         model=read_variable_dict_amescap_profile(fNcdf)
-        ak, bk = ak_bk_loader(fNcdf)
+        try:
+            ak, bk = ak_bk_loader(fNcdf)
+        except IOError as exception:
+            prRed(str(exception))
+            exit()
 
         ps = np.array(fNcdf.variables[model.ps])
 
@@ -5,43 +5,18 @@ filterwarnings('ignore', category = DeprecationWarning)
 
 # Load generic Python modules
 import argparse   # parse arguments
+import glob       # find the coarsened files
+import atexit     # close the shared datasets at exit
+import contextlib # capture the output of parallel pages
+import hashlib    # identify the pages in the render cache
+import io         # capture the output of parallel pages
 import os         # access operating systems function
+import pickle     # send the PDF pages back from the parallel workers
 import subprocess # run command
 import sys        # system command
-
-# ==========
-from amescap.Script_utils import check_file_tape, prYellow, prRed, prCyan, prGreen, prPurple
-from amescap.Script_utils import section_content_amescap_profile, print_fileContent, print_varContent, FV3_file_type, find_tod_in_diurn
-from amescap.Script_utils import wbr_cmap, rjw_cmap, dkass_temp_cmap, dkass_dust_cmap
-from amescap.FV3_utils import lon360_to_180, lon180_to_360, UT_LTtxt, area_weights_deg,shiftgrid_180_to_360,shiftgrid_360_to_180
-from amescap.FV3_utils import add_cyclic, azimuth2cart, mollweide2cart, robin2cart, ortho2cart
-# ==========
-
-# Attempt to import specific scientic modules that may or may not
-# be included in the default Python installation on NAS.
-try:
-    import matplotlib
-    matplotlib.use('Agg')  # Force matplotlib NOT to use any Xwindows backend
-    import matplotlib.pyplot as plt
-    import numpy as np
-    from matplotlib.ticker import (
-        LogFormatter, NullFormatter, LogFormatterSciNotation, MultipleLocator)  # Format ticks
-    from netCDF4 import Dataset, MFDataset
-    from numpy import sqrt, exp, max, mean, min, log, log10, sin, cos, abs
-    from matplotlib.colors import LogNorm
-    from matplotlib.ticker import LogFormatter
-
-except ImportError as error_msg:
-    prYellow("Error while importing modules")
-    prYellow('You are using Python version '+str(sys.version_info[0:3]))
-    prYellow('Please source your virtual environment, e.g.:')
-    prCyan('    source envPython3.7/bin/activate.csh \n')
-    print("Error was: " + error_msg.message)
-    exit()
-except Exception as exception:
-    # Output unexpected Exceptions.
-    print(exception.__class__.__name__ + ": ", exception)
-    exit()
+from collections import OrderedDict
+from collections.abc import Mapping
+from multiprocessing import Pool
 
 degr = u"\N{DEGREE SIGN}"
 global current_version
@@ -64,7 +39,8 @@ parser.add_argument('-i', '--inspect_file', default=None,
                     """> Usage: MarsPlot -i 00000.atmos_daily.nc\n"""
                     """Options: use --dump (variable content) and --stat (min, mean,max) jointly with --inspect \n"""
                     """>  MarsPlot -i 00000.atmos_daily.nc -dump pfull 'temp[6,:,30,10]'  (quotes '' necessary for browsing dimensions)\n"""
-                    """>  MarsPlot -i 00000.atmos_daily.nc -stat 'ucomp[5,:,:,:]' 'vcomp[5,:,:,:]'\n""")
+                    """>  MarsPlot -i 00000.atmos_daily.nc -stat 'ucomp[5,:,:,:]' 'vcomp[5,:,:,:]'\n"""
+                    """>  MarsPlot -i 00000.atmos_daily.nc -stat temp -pct 5 50 95  (also print approximate percentiles)\n""")
 
 # These two options are to be used jointly with --inspect
 parser.add_argument('--dump', '-dump', nargs='+', default=None,
@@ -73,11 +49,19 @@ parser.add_argument('--dump', '-dump', nargs='+', default=None,
 parser.add_argument('--stat', '-stat', nargs='+', default=None,
                     help=argparse.SUPPRESS)
 
+parser.add_argument('--pct', '-pct', nargs='+', type=float, default=None,
+                    help=argparse.SUPPRESS)
+
 parser.add_argument('-d', '--date', nargs='+', default=None,
                     help='Specify the files to use. Default is the last file created. \n'
                     '> Usage: MarsPlot Custom.in -d 700     (one file) \n'
                     '         MarsPlot Custom.in -d 350 700 (start file end file)')
 
+parser.add_argument('-ls', '--Ls', nargs=2, type=float, default=None,
+                    help='Only use the time steps between two solar longitudes in the files selected with -d, without combining the files. \n'
+                    'Values in 0-360 select the range in every Mars year. Without -d, all the files in the directory are used. \n'
+                    '> Usage: MarsPlot Custom.in -d 0 2000 -ls 180 270 \n')
+
 parser.add_argument('--template', '-template', action='store_true',
                     help="""Generate a template (Custom.in) for creating the plots.\n """
                     """(Use '--temp' to create a Custom.in file without these instructions)\n""")
@@ -97,7 +81,7 @@ parser.add_argument('-sy', '--stack_year', action='store_true', default=False,
 parser.add_argument("-o", "--output", default="pdf",
                     choices=['pdf', 'eps', 'png'],
                     help='Output file format.\n'
-                    'Default is PDF if ghostscript (gs) is available and PNG otherwise\n'
+                    'Default is PDF (all the pages in a single file)\n'
                     '> Usage: MarsPlot Custom.in -o png \n'
                     '       : MarsPlot Custom.in -o png -pw 500 (set pixel width to 500, default is 2000)\n')
 
@@ -107,14 +91,101 @@ parser.add_argument('-vert', '--vertical', action='store_true', default=False,
 parser.add_argument("-pw", "--pwidth", default=2000, type=float,
                     help=argparse.SUPPRESS)
 
+parser.add_argument('-rast', '--rasterize', action='store_true', default=False,
+                    help='Rasterize the filled contours in PDF and EPS outputs (the axes and labels remain vector graphics). \n'
+                    'Use with very high resolution data to reduce the size of the files. \n'
+                    '> Usage: MarsPlot Custom.in -rast \n')
+
+parser.add_argument('-pyr', '--pyramid', action='store_true', default=False,
+                    help='Plot from the coarsened files made by MarsFiles --pyramid (e.g. 00668.atmos_average.c4.nc) when available. \n'
+                    'The coarsest files that still have one grid point per pixel of the panel are used. \n'
+                    '> Usage: MarsPlot Custom.in -pyr \n')
+
 parser.add_argument('-dir', '--directory', default=os.getcwd(),
                     help='Target directory if input files are not in current directory. \n'
                     '> Usage: MarsPlot Custom.in [other options] -dir /u/akling/FV3/verona/c192L28_dliftA/history')
 
 
+parser.add_argument('-jobs', '--jobs', type=int, default=1,
+                    help='Number of processes used to plot the pages in parallel. \n'
+                    '> Usage: MarsPlot Custom.in -jobs 8 \n')
+
+parser.add_argument('-cache', '--cache', action='store_true', default=False,
+                    help='Reuse the pages from the previous run (saved in .MarsPlot_cache/ in the output directory) \n'
+                    'if their template block, the options and the files they read are unchanged. \n'
+                    'The entries not used by the run are removed. The cache files are pickles: \n'
+                    'only use this option with an output directory you trust. \n'
+                    '> Usage: MarsPlot Custom.in -cache \n')
+
 parser.add_argument('--debug',  action='store_true',
                     help='Debug flag: do not bypass errors')
 
+# Handle --help and the syntax errors before importing the scientific modules so that they return quickly
+if __name__ == '__main__':
+    parser.parse_args()
+
+# ==========
+from amescap.Script_utils import check_file_tape, check_files_tape, prYellow, prRed, prCyan, prGreen, prPurple
+from amescap.Script_utils import section_content_amescap_profile, print_fileContent, print_varContent, FV3_file_type, find_tod_in_diurn
+from amescap.Script_utils import read_index, index_query, Range_dataset
+from amescap.Script_utils import wbr_cmap, rjw_cmap, dkass_temp_cmap, dkass_dust_cmap
+from amescap.FV3_utils import lon360_to_180, lon180_to_360, UT_LTtxt, area_weights_deg,shiftgrid_180_to_360,shiftgrid_360_to_180
+from amescap.FV3_utils import add_cyclic, azimuth2cart, mollweide2cart, robin2cart, projection_grid
+# ==========
+
+# Attempt to import specific scientic modules that may or may not
+# be included in the default Python installation on NAS.
+try:
+    import numpy as np
+    from netCDF4 import Dataset, MFDataset
+    from numpy import sqrt, exp, max, mean, min, log, log10, sin, cos, abs
+
+except ImportError as error_msg:
+    prYellow("Error while importing modules")
+    prYellow('You are using Python version '+str(sys.version_info[0:3]))
+    prYellow('Please source your virtual environment, e.g.:')
+    prCyan('    source envPython3.7/bin/activate.csh \n')
+    print("Error was: " + error_msg.message)
+    exit()
+except Exception as exception:
+    # Output unexpected Exceptions.
+    print(exception.__class__.__name__ + ": ", exception)
+    exit()
+
+
+def import_matplotlib():
+    '''
+    Import matplotlib and define the tick formatters. This is done by main() before plotting
+    rather than at start up so that MarsPlot -i and MarsPlot --template do not load matplotlib.
+    '''
+    global matplotlib, plt, LogFormatter, NullFormatter, LogFormatterSciNotation, MultipleLocator
+    global LogNorm, PdfPages, CustomTicker
+    try:
+        import matplotlib
+        matplotlib.use('Agg')  # Force matplotlib NOT to use any Xwindows backend
+        import matplotlib.pyplot as plt
+        from matplotlib.ticker import (
+            LogFormatter, NullFormatter, LogFormatterSciNotation, MultipleLocator)  # Format ticks
+        from matplotlib.colors import LogNorm
+        from matplotlib.backends.backend_pdf import PdfPages
+    except ImportError as error_msg:
+        prYellow("Error while importing matplotlib")
+        prYellow('Please source your virtual environment, e.g.:')
+        prCyan('    source envPython3.7/bin/activate.csh \n')
+        print("Error was: " + str(error_msg))
+        exit()
+
+    class CustomTicker(LogFormatterSciNotation):
+        def __call__(self, x, pos=None):
+            if x < 0:
+                return LogFormatterSciNotation.__call__(self, x, pos=None)
+            else:
+                return "{x:g}".format(x=x)
+
+    # Found at the module level when the figures are pickled (see --jobs)
+    CustomTicker.__qualname__ = 'CustomTicker'
+
+
 # ======================================================
 #                  MAIN PROGRAM
 # ======================================================
@@ -188,7 +259,7 @@ def main():
         elif parser.parse_args().stat:
             # Print variable stats
             print_varContent(parser.parse_args().inspect_file,
-                             parser.parse_args().stat, True)
+                             parser.parse_args().stat, True, parser.parse_args().pct)
         else:
             # Show information for all variables
             print_fileContent(parser.parse_args().inspect_file)
@@ -199,6 +270,9 @@ def main():
 
     # Gather simulation information from template or inline argument
     else:
+        read_profile_settings()
+        import_matplotlib()
+
         # Option 2, case A: Use Custom.in for everything
         if parser.parse_args().custom_file:
             print('Reading '+parser.parse_args().custom_file.name)
@@ -222,9 +296,12 @@ def main():
 
         else: # If no date is provided, default to last 'fixed' file created in directory
             bound = get_Ncdf_num()
-            # If one or multiple 'fixed' files are found, use last created
+            # If one or multiple 'fixed' files are found, use last created, or all of them with --Ls
             if bound is not None:
-                bound = bound[-1]
+                if parser.parse_args().Ls:
+                    bound = [bound[0], bound[-1]]
+                else:
+                    bound = bound[-1]
         # -----
 
         # Initialization
@@ -238,59 +315,11 @@ def main():
             nfiles = 1
 
         #print('MarsPlot is running...')
-        # Make a plots/ folder in the current directory if it does not exist
-        dir_plot_present = os.path.exists(output_path+'/'+'plots')
-        if not dir_plot_present:
-            os.makedirs(output_path+'/'+'plots')
-
-        fig_list = list() # List of figures
-
-        # ============ Do plots ============
-        global i_list
-        for i_list in range(0, len(objectList)):
-
-            status = objectList[i_list].plot_type + \
-                ' :'+objectList[i_list].varfull
-            # Display the status of the figure in progress
-            progress(i_list, len(objectList), status, None)
-
-            objectList[i_list].do_plot()
-
-            if objectList[i_list].success and out_format == 'pdf' and not debug:
-                sys.stdout.write("\033[F")
-                # If successful, flush the previous output
-                sys.stdout.write("\033[K")
-
-            status = objectList[i_list].plot_type+' :' + \
-                objectList[i_list].varfull+objectList[i_list].fdim_txt
-            progress(i_list, len(objectList), status,
-                     objectList[i_list].success)
-            # Add the figure to the list of figures (fig_list)
-            # Only for the last panel on a page
-            if objectList[i_list].subID == objectList[i_list].nPan:
-                if i_list < len(objectList)-1 and not objectList[i_list+1].addLine:
-                    fig_list.append(objectList[i_list].fig_name)
-                # Last subplot
-                if i_list == len(objectList)-1:
-                    fig_list.append(objectList[i_list].fig_name)
-
-        progress(100, 100, 'Done')  # 100% complete
-
-        # ============ Make Multipage PDF ============
-        if out_format == "pdf" and len(fig_list) > 0:
-            print('Merging figures...')
-            #print("Plotting figures:",fig_list)
-            # Debug file (masked). Use to redirect output from ghostscript
-            debug_filename = output_path+'/.debug_MCMC_plots.txt'
-            fdump = open(debug_filename, 'w')
-
-            # Construct list of figures
-            all_fig = ' '
-            for figID in fig_list:
-                # Add outer quotes(" ") to deal with whitespace in Windows, e.g. '"/Users/my folder/Diagnostics.pdf"'
-                figID = '"'+figID+'"'
-                all_fig += figID+' '
-
+        global output_pdf, pdf_pages
+        output_pdf = None
+        pdf_pages  = None # Opened when the first page is saved
+        if out_format == "pdf":
+            # The pages are added to a single PDF as they are plotted
             # Output name for the PDF
             try:
                 if parser.parse_args().do:
@@ -306,58 +335,90 @@ def main():
 
             # Default name is Custom.in -> output Diagnostics.pdf
             if basename == 'Custom':
-                output_pdf = fig_name = output_path+'/'+'Diagnostics.pdf'
+                output_pdf = output_path+'/'+'Diagnostics.pdf'
             # Default name is Custom_XX.in -> output Diagnostics_XX.pdf
             elif basename[0:7] == "Custom_":
-                output_pdf = fig_name = output_path+'/Diagnostics_' + \
+                output_pdf = output_path+'/Diagnostics_' + \
                     basename[7:9]+'.pdf'  # Match input file name
             # Input file name is different, use it
             else:
-                output_pdf = fig_name = output_path+'/' + \
+                output_pdf = output_path+'/' + \
                     basename+'.pdf'  # Match input file name
+        else:
+            # Make a plots/ folder in the current directory if it does not exist
+            if not os.path.exists(output_path+'/'+'plots'):
+                os.makedirs(output_path+'/'+'plots')
 
-            # Also add outer quotes to the output PDF
-            output_pdf = '"'+output_pdf+'"'
-            # Command to make a multipage PDF out of the the individual figures using ghostscript.
-            # Remove the temporary files when done
-            cmd_txt = 'gs -sDEVICE=pdfwrite -dNOPAUSE -dBATCH -dSAFER -dEPSCrop -sOutputFile=' + \
-                output_pdf+' '+all_fig
+        fig_list = list() # List of figures
 
-            # On NAS, the ghostscript has been renamed 'gs.bin'. If the above fail, try:
-            try:
-                subprocess.check_call(
-                    cmd_txt, shell=True, stdout=fdump, stderr=fdump)
-            except subprocess.CalledProcessError:
-                cmd_txt = 'gs.bin -sDEVICE=pdfwrite -dNOPAUSE -dBATCH -dSAFER -dEPSCrop -sOutputFile=' + \
-                    output_pdf+' '+all_fig
-            # ================
+        # Everything but the template that changes the pages, used by the render cache
+        global render_settings
+        options = vars(parser.parse_args()).copy()
+        for opt in ['custom_file', 'jobs', 'cache', 'debug']:
+            options.pop(opt)
+        render_settings = repr([current_version, sorted(options.items()), content_txt,
+                                input_paths, None if Ncdf_num is None else list(Ncdf_num)])
 
-            try:
-                # Test the ghostscript and remove commands, exit otherwise
-                subprocess.check_call(
-                    cmd_txt, shell=True, stdout=fdump, stderr=fdump)
-                # Execute the commands now
-                # Run ghostscript to merge the PDF
-                subprocess.call(cmd_txt, shell=True,
-                                stdout=fdump, stderr=fdump)
-                cmd_txt = 'rm -f '+all_fig
-                # Remove temporary PDF figures
-                subprocess.call(cmd_txt, shell=True,
-                                stdout=fdump, stderr=fdump)
-                cmd_txt = 'rm -f '+'"'+debug_filename+'"'
-                subprocess.call(cmd_txt, shell=True)  # Remove debug file
-                # If the plot directory was not present initially, remove the one we just created
-                if not dir_plot_present:
-                    cmd_txt = 'rm -r '+'"'+output_path+'"'+'/plots'
-                    subprocess.call(cmd_txt, shell=True)
-                give_permission(output_pdf)
-                print(output_pdf + ' was generated')
-
-            except subprocess.CalledProcessError:
-                print(
-                    "ERROR with ghostscript when merging PDF, please try alternative formats.")
-                if debug:
-                    raise
+        # Read the slices shared by several figures once. The pages reused
+        # from the render cache are not planned.
+        plan_reads(objectList, [i for page in group_pages(objectList)
+                                if load_cached_page(page_key(page)) is None for i in page])
+
+        # ============ Do plots ============
+        global i_list
+        if parser.parse_args().jobs > 1:
+            fig_list = render_pages(objectList, parser.parse_args().jobs)
+        else:
+            for page in group_pages(objectList):
+                # Reuse the page if nothing changed since the last run
+                key   = page_key(page)
+                entry = load_cached_page(key)
+                if entry is not None:
+                    fig = objectList[page[-1]]
+                    fig_list.append(restore_page(page, entry, create_name(figure_root_name(fig))))
+                    continue
+                files_read.clear()
+
+                for i_list in page:
+
+                    status = objectList[i_list].plot_type + \
+                        ' :'+objectList[i_list].varfull
+                    # Display the status of the figure in progress
+                    progress(i_list, len(objectList), status, None)
+
+                    objectList[i_list].do_plot()
+
+                    if objectList[i_list].success and out_format == 'pdf' and not debug:
+                        sys.stdout.write("\033[F")
+                        # If successful, flush the previous output
+                        sys.stdout.write("\033[K")
+
+                    status = objectList[i_list].plot_type+' :' + \
+                        objectList[i_list].varfull+objectList[i_list].fdim_txt
+                    progress(i_list, len(objectList), status,
+                             objectList[i_list].success)
+                    # Add the figure to the list of figures (fig_list)
+                    # Only for the last panel on a page
+                    if objectList[i_list].subID == objectList[i_list].nPan:
+                        if i_list < len(objectList)-1 and not objectList[i_list+1].addLine:
+                            fig_list.append(objectList[i_list].fig_name)
+                        # Last subplot
+                        if i_list == len(objectList)-1:
+                            fig_list.append(objectList[i_list].fig_name)
+
+                fig = None
+                if out_format == "pdf" and parser.parse_args().cache:
+                    fig = pickle.dumps(plt.gcf())
+                store_cached_page(key, page, files_read, fig)
+        prune_render_cache()
+
+        progress(100, 100, 'Done')  # 100% complete
+
+        # ============ Close Multipage PDF ============
+        if pdf_pages is not None:
+            pdf_pages.close()
+            give_permission('"'+output_pdf+'"')
+            print('"'+output_pdf+'"' + ' was generated')
 
 # ======================================================
 #                  DATA OPERATION UTILITIES
@@ -365,19 +426,24 @@ def main():
 
 # USER PREFERENCES - AXIS FORMATTING
 
-content_txt = section_content_amescap_profile('MarsPlot.py Settings')
-exec(content_txt)  # Load all variables in that section
+def read_profile_settings():
+    '''
+    Load the 'MarsPlot.py Settings' section of ~/.amescap_profile. This is done by main() before plotting
+    rather than at start up so that MarsPlot -h and MarsPlot -i do not parse the profile.
+    '''
+    global content_txt, add_sol_time_axis, lon_coord_type, include_NaNs
 
-global add_sol_time_axis, lon_coord_type, include_NaNs
+    content_txt = section_content_amescap_profile('MarsPlot.py Settings')
+    exec(content_txt, globals())  # Load all variables in that section
 
-# Whether to include sol in addition to Ls on time axis (default = Ls only):
-add_sol_time_axis = eval('np.array(add_sol_to_time_axis)')
+    # Whether to include sol in addition to Ls on time axis (default = Ls only):
+    add_sol_time_axis = eval('np.array(add_sol_to_time_axis)')
 
-# Defines which longitude coordinates to use (-180-180 v 0-360; default = 0-360):
-lon_coord_type = eval('np.array(lon_coordinate)')
+    # Defines which longitude coordinates to use (-180-180 v 0-360; default = 0-360):
+    lon_coord_type = eval('np.array(lon_coordinate)')
 
-# Defines whether means include NaNs ('True', np.mean) or ignore NaNs ('False', like np.nanmean). Default = False:
-include_NaNs = eval('np.array(show_NaN_in_slice)')
+    # Defines whether means include NaNs ('True', np.mean) or ignore NaNs ('False', like np.nanmean). Default = False:
+    include_NaNs = eval('np.array(show_NaN_in_slice)')
 
 
 def mean_func(arr, axis):
@@ -387,6 +453,142 @@ def mean_func(arr, axis):
     else:
         return np.nanmean(arr, axis=axis)
 
+
+# Maximum size of the blocks of time steps read at once by read_NCDF_2D (bytes)
+time_block_bytes = 128*1024**2
+
+
+def read_time_blocks(fvar, ti, index, shape):
+    '''
+    Read a variable by blocks of time steps.
+    Args:
+        fvar:   the variable, e.g. f.variables['temp']
+        ti:     integer or 1D array, the time indices
+        index:  tuple, the indices of the other dimensions, e.g. (zi, lati, loni)
+        shape:  tuple, the shape of one time step, e.g. (len(zi), len(lati), len(loni))
+    Returns:
+        A generator of the blocks fvar[ti_block, zi, lati, loni] with shape (len(ti_block),)+shape
+        and a size of about time_block_bytes
+    '''
+    ti = np.atleast_1d(ti)
+    step = int(np.prod(shape))*np.dtype(fvar.dtype).itemsize
+    nt = int(np.clip(time_block_bytes//np.maximum(step, 1), 1, None))
+    if isinstance(fvar, PooledVariable) and fvar.planned():
+        # Record the whole request once and return zeros (see plan_reads())
+        fvar.plan((ti,)+tuple(index))
+        for t0 in range(0, len(ti), nt):
+            yield np.zeros((len(ti[t0:t0+nt]),)+tuple(shape), dtype=fvar.dtype)
+        return
+    for t0 in range(0, len(ti), nt):
+        tb = ti[t0:t0+nt]
+        key = (tb,)+tuple(index)
+        # Do not keep the blocks in the array cache
+        block = fvar.read(key, cache=False) if isinstance(fvar, PooledVariable) else fvar[key]
+        yield block.reshape((len(tb),)+tuple(shape))
+
+
+def has_mask(arr):
+    '''
+    Return True for a masked array with a mask (as opposed to nomask).
+    '''
+    return np.ma.isMaskedArray(arr) and arr.mask is not np.ma.nomask
+
+
+def reduce_time_blocks(read_blocks, reduce, average):
+    '''
+    Reduce a variable block of time steps by block of time steps so that only one block is in memory.
+    The result is identical to reducing the whole variable: mean_func(reduce(var), axis=0) or reduce(var).
+    Args:
+        read_blocks:    function returning a generator of the time blocks (see read_time_blocks)
+        reduce:         function applied to each block, reducing the dimensions other than time
+                        e.g. lambda var: mean_func(var, axis=3)
+        average:        if True, average the reduced blocks over time. Otherwise, concatenate them.
+    Returns:
+        The reduced variable
+
+    ***NOTE***
+    The time average accumulates the time steps one at a time in the precision of the data,
+    like np.mean and np.nanmean do, and counts the valid (not masked or, if include_NaNs is False,
+    not NaN) values. The last step reproduces the division done by mean_func(), which depends on
+    whether the variable is a masked array and on whether it has a mask. Netcdf4 returns a mask only
+    if some values are masked, so if a masked block is read after blocks without a mask,
+    the blocks are read again with a mask, as the whole variable would have been.
+    '''
+    force_mask = False
+    while True:
+        restart   = False
+        raw_mask  = False  # Some of the blocks read have a mask
+        is_ma     = False  # The reduced blocks are masked arrays
+        red_mask  = False  # Some of the reduced blocks have a mask
+        parts     = []     # Reduced blocks to concatenate
+        acc       = None   # Sum of the valid values
+        n_unmask  = None   # Number of values not masked
+        n_valid   = None   # Number of values used in the average
+        nt        = 0
+        for block in read_blocks():
+            if has_mask(block):
+                if not raw_mask and nt > 0 and not force_mask:
+                    restart = True
+                    break
+                raw_mask = True
+            elif force_mask and np.ma.isMaskedArray(block):
+                block = np.ma.masked_array(block, mask=np.ma.getmaskarray(block))
+            block = reduce(block)
+            nt += block.shape[0]
+            if planning and average:
+                # The blocks are zeros (see plan_reads()), the first one gives the shape of the result
+                parts.append(block)
+                break
+            is_ma = is_ma or np.ma.isMaskedArray(block)
+            red_mask = red_mask or has_mask(block)
+            if not average or parts or block[0].size < 2 or block.dtype.kind != 'f':
+                # Concatenate or, for small or non float data, average in memory
+                parts.append(block)
+                continue
+            data = np.ma.getdata(block)
+            mask = np.ma.getmaskarray(block)
+            for t in range(0, block.shape[0]):
+                unmask = ~mask[t]
+                valid = unmask if include_NaNs else unmask & ~np.isnan(data[t])
+                if acc is None:
+                    acc = np.where(valid, data[t], 0).astype(data.dtype)
+                    n_unmask = unmask.astype(np.intp)
+                    n_valid = valid.astype(np.intp)
+                else:
+                    acc += np.where(valid, data[t], 0)
+                    n_unmask += unmask
+                    n_valid += valid
+        if restart:
+            force_mask = True
+            continue
+        break
+
+    if parts:
+        if is_ma:
+            var = np.ma.concatenate(parts, axis=0)
+            if not red_mask:
+                var.mask = np.ma.nomask
+        else:
+            var = np.concatenate(parts, axis=0)
+        return mean_func(var, axis=0) if average else var
+
+    # Same operations as np.mean and np.nanmean on the reduced array
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if include_NaNs:
+            if red_mask:
+                return np.ma.masked_array(acc, mask=(n_unmask == 0))*1./n_unmask
+            acc = np.true_divide(acc, nt, out=acc, casting='unsafe')
+            return np.ma.masked_array(acc) if is_ma else acc
+        if red_mask:
+            tot = np.ma.masked_array(acc, mask=(n_unmask == 0))
+            cnt = np.ma.masked_array(n_valid, mask=(n_unmask == 0))
+            return np.true_divide(tot, cnt, out=tot, casting='unsafe')
+        if is_ma:
+            tot = np.ma.masked_array(acc)
+            cnt = np.ma.masked_array(n_valid)
+            return np.true_divide(tot, cnt, out=tot, casting='unsafe')
+        return np.true_divide(acc, n_valid, out=acc, casting='unsafe')
+
 # def shift_data(lon, data):
 #     '''
 #     This function shifts the longitude and data from 0/360 to -180/+180.
@@ -858,6 +1060,8 @@ def read_axis_options(axis_options_txt):
         custom_line3:   string, projection (e.g. 'ortho -125,45')
     '''
     list_txt = axis_options_txt.split(':')[1].split('|')
+    # The decimate toggle is read by read_decimate_option()
+    list_txt = [txt for txt in list_txt if txt.split('=')[0].strip() != 'decimate']
     # Xaxis: get bounds
     txt = list_txt[0].split('=')[1].replace('[', '').replace(']', '')
     Xaxis = []
@@ -896,6 +1100,49 @@ def read_axis_options(axis_options_txt):
     return Xaxis, Yaxis, custom_line1, custom_line2, custom_line3
 
 
+def read_decimate_option(axis_options_txt):
+    '''
+    Return the decimate toggle of a 2D plot.
+    Args:
+        axis_options_txt: One line string = 'Axis Options  : lon = [5,8] | lat = [None,None] | cmap = jet | scale= lin | decimate = off'
+    Returns:
+        decimate:         False if 'decimate = off' is set, True otherwise
+    '''
+    for txt in axis_options_txt.split(':')[1].split('|'):
+        if txt.split('=')[0].strip() == 'decimate':
+            return txt.split('=')[1].strip().lower() not in ['off', 'false', 'none']
+    return True
+
+
+def block_mean(coord, var, n, axis):
+    '''
+    Average the data in blocks of n points along one axis, ignoring or including
+    the NaNs as specified by show_NaN_in_slice in amescap_profile (see mean_func).
+    Args:
+        coord:  1D array, the coordinate along that axis
+        var:    2D array, NaNs for missing values
+        n:      integer, the number of points in each block (the last block may be smaller)
+        axis:   the axis of var to average
+    Returns:
+        coord:  the coordinate averaged in each block
+        var:    the data averaged in each block, NaN if the block has no valid data
+                (or, if the NaNs are included, any NaN)
+    '''
+    idx = np.arange(0, len(coord), n)
+    npts = np.diff(np.append(idx, len(coord)))
+    coord = np.add.reduceat(np.asarray(coord, dtype=float), idx)/npts
+    if include_NaNs:
+        shape = [1]*np.ndim(var)
+        shape[axis] = -1
+        return coord, np.add.reduceat(var, idx, axis=axis)/npts.reshape(shape)
+    valid = np.isfinite(var)
+    total = np.add.reduceat(np.where(valid, var, 0.), idx, axis=axis)
+    count = np.add.reduceat(valid.astype(int), idx, axis=axis)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var = total/count
+    return coord, var
+
+
 def split_varfull(varfull):
     '''
     Split the 'varfull' object into its component parts.
@@ -1273,6 +1520,9 @@ def make_template():
         customFileIN.write(lh+"""   'proj'  projection  Cylindrical: 'cart' (Cartesian), 'robin' (Robinson), 'moll' (Mollweide), \n""")
         customFileIN.write(lh+"""                       Azithumal: 'Npole lat' (North Pole), 'Spole lat' (South Pole),\n""")
         customFileIN.write(lh+"""                       'ortho lon,lat' (Orthographic). \n""")
+        customFileIN.write(lh+"""   'decimate'          'on' (default) averages the 2D data to the resolution of the page (see -pw), \n""")
+        customFileIN.write(lh+"""                       'off' contours the data at full resolution and never rasterizes (see -rast). \n""")
+        customFileIN.write(lh+"""                       e.g. Axis Options : Ls = [None,None] | lat = [None,None] | cmap = jet | scale = lin | decimate = off \n""")
         customFileIN.write(lh+"""\n""")
         customFileIN.write(lh+"""===================== FILES FROM MULTIPLE SIMULATIONS =====================\n""")
         customFileIN.write(lh+"""Under <<< Simulations >>>, there are numbered lines ('N>') for you to use to indicate the \n""")
@@ -1582,8 +1832,12 @@ def get_Ncdf_num():
     Returns:
         Ncdf_num: a sorted array of sols
     '''
-    list_dir = os.listdir(input_paths[0]) # e.g. '00350.fixed.nc' or '00000.fixed.nc'
-    avail_fixed = [k for k in list_dir if '.fixed.nc' in k]
+    index = read_index(input_paths[0]) # Use the catalog of the directory if there is one (see MarsFiles --index)
+    if index is not None:
+        avail_fixed = [k for k in index_query(index, file_type='fixed') if k[0:5].isdigit()]
+    else:
+        list_dir = os.listdir(input_paths[0]) # e.g. '00350.fixed.nc' or '00000.fixed.nc'
+        avail_fixed = [k for k in list_dir if '.fixed.nc' in k]
     # Remove .fixed.nc (returning '00350' or '00000')
     list_num = [item[0:5] for item in avail_fixed]
     # Transform to array (returning [0, 350])
@@ -1621,11 +1875,12 @@ def select_range(Ncdf_num, bound):
     return Ncdf_num
 
 
-def create_name(root_name):
+def create_name(root_name, taken=()):
     '''
     Modify desired file name if a file with that name already exists.
     Args:
         root_name:  desired name for the file (e.g."/path/custom.in" or "/path/figure.png")
+        taken:      names not created yet but already given to another file
     Returns:
         new_name:   new name if the file already exists (e.g. "/path/custom_01.in" or "/path/figure_01.png")
     '''
@@ -1636,15 +1891,37 @@ def create_name(root_name):
     # Initialization
     new_name = root_name
     # If example.png already exists, create example_01.png
-    if os.path.isfile(new_name):
+    if os.path.isfile(new_name) or new_name in taken:
         new_name = root_name[0:-(len_ext+1)]+'_%02d' % (n)+'.'+ext
     # If example_01.png already exists, create example_02.png etc.
-    while os.path.isfile(root_name[0:-(len_ext+1)]+'_%02d' % (n)+'.'+ext):
+    while os.path.isfile(root_name[0:-(len_ext+1)]+'_%02d' % (n)+'.'+ext) or \
+            root_name[0:-(len_ext+1)]+'_%02d' % (n)+'.'+ext in taken:
         n = n+1
         new_name = root_name[0:-(len_ext+1)]+'_%02d' % (n)+'.'+ext
     return new_name
 
 
+def figure_root_name(fig):
+    '''
+    Return the name of the figure saved by the last panel of a page, before create_name() is applied.
+    Args:
+        fig:        a figure object, the last panel on the page
+    Returns:
+        root_name:  the file name (e.g. "/path/plots/atmos_average.temp.png" or "/path/plots/multi_panel.png")
+    '''
+    if fig.subID == 1:  # 1 plot
+        if not '[' in fig.varfull:
+            # Add split '{' in case 'varfull' contains layer. Does not do anything else.
+            sensitive_name = fig.varfull.split('{')[0].strip()
+            # If 'varfull' is a complex expression
+        else:
+            sensitive_name = 'expression_' + \
+                get_list_varfull(fig.varfull)[0].split('{')[0].strip()
+    else:  # Multipanel
+        sensitive_name = 'multi_panel'
+    return output_path+'/plots/'+sensitive_name+'.'+out_format
+
+
 def path_to_template(custom_name):
     '''
     Modify desired file name if a file with that name already exists.
@@ -1708,6 +1985,641 @@ def progress(k, Nmax, txt='', success=True):
         sys.stdout.flush()
 
 
+def save_page(fig_name, fig=None):
+    '''
+    Save a page. PNG and EPS pages are saved in plots/, PDF pages are added to
+    the multipage PDF (opened at the first page) with no intermediate file.
+    Args:
+        fig_name:   the name of the figure (e.g. "/path/plots/multi_panel.png")
+        fig:        the figure to save, default is the current figure
+    Returns:
+        None
+    '''
+    global pdf_pages
+    if fig is None:
+        fig = plt.gcf()
+    if out_format == "pdf":
+        # output_pdf is None in the workers of render_pages(), the figure is sent back instead
+        if output_pdf is not None:
+            if pdf_pages is None:
+                pdf_pages = PdfPages(output_pdf)
+            pdf_pages.savefig(fig, dpi=my_dpi)
+    else:
+        fig.savefig(fig_name, dpi=my_dpi)
+        print("Saved:" + fig_name)
+
+
+def group_pages(objectList):
+    '''
+    Group the figures by page. The panels of a 'HOLD ON' block and the
+    lines added with 'ADD LINE' are on the same page.
+    Args:
+        objectList: list of figure objects
+    Returns:
+        pages:      list of the indices of the figures on each page (e.g. [[0], [1, 2, 3], [4]])
+    '''
+    pages = []
+    page = []
+    for i in range(0, len(objectList)):
+        page.append(i)
+        if objectList[i].subID == objectList[i].nPan:
+            if i == len(objectList)-1 or not objectList[i+1].addLine:
+                pages.append(page)
+                page = []
+    if page:
+        pages.append(page)
+    return pages
+
+
+def init_render_worker():
+    '''
+    Drop the datasets inherited from the main process so that each worker
+    opens its own handles. The arrays already read are kept. The PDF pages
+    are sent back to the main process, which writes the multipage PDF.
+    '''
+    global output_pdf, pdf_pages
+    dataset_pool.clear()
+    output_pdf = None
+    pdf_pages  = None
+
+
+def render_page(page):
+    '''
+    Plot one page in a worker process.
+    Args:
+        page:       list of the indices of the figures on the page
+    Returns:
+        status:     list of (success, fdim_txt) for each figure
+        fig_name:   the name of the saved figure, None if not saved
+        output:     the messages printed while plotting
+        fig:        the pickled figure for PDF outputs, None otherwise
+        files:      the files read for the page
+    '''
+    global i_list
+    output = io.StringIO()
+    status = []
+    files_read.clear()
+    with contextlib.redirect_stdout(output):
+        for i_list in page:
+            objectList[i_list].do_plot()
+            status.append((objectList[i_list].success, objectList[i_list].fdim_txt))
+    fig_name = getattr(objectList[page[-1]], 'fig_name', None)
+    fig = None
+    if out_format == "pdf" and fig_name is not None:
+        fig = pickle.dumps(plt.gcf())
+    plt.close('all')
+    return status, fig_name, output.getvalue(), fig, set(files_read)
+
+
+def render_pages(objectList, jobs):
+    '''
+    Plot the pages in parallel. The file names are given in advance in
+    the order of the template so they are the same as in serial mode.
+    Args:
+        objectList: list of figure objects
+        jobs:       number of processes
+    Returns:
+        fig_list:   list of the saved figures, in the order of the template
+    '''
+    pages = group_pages(objectList)
+    taken = []
+    for page in pages:
+        fig = objectList[page[-1]]
+        if fig.subID == fig.nPan:
+            fig.page_name = create_name(figure_root_name(fig), taken)
+            taken.append(fig.page_name)
+
+    # Only the pages that changed since the last run are plotted
+    keys    = [page_key(page) for page in pages]
+    entries = [load_cached_page(key) for key in keys]
+    todo    = [page for page, entry in zip(pages, entries) if entry is None]
+
+    fig_list = list()
+    with Pool(jobs, initializer=init_render_worker) as pool:
+        # imap returns the pages in order, as soon as they are plotted
+        results = pool.imap(render_page, todo)
+        for page, key, entry in zip(pages, keys, entries):
+            if entry is not None:
+                fig_list.append(restore_page(page, entry, objectList[page[-1]].page_name))
+                continue
+            status, fig_name, output, fig, files = next(results)
+            for i, (success, fdim_txt) in zip(page, status):
+                objectList[i].success = success
+                objectList[i].fdim_txt = fdim_txt
+                progress(i, len(objectList), objectList[i].plot_type+' :' +
+                         objectList[i].varfull+fdim_txt, success)
+            sys.stdout.write(output)
+            if fig is not None:
+                page_fig = pickle.loads(fig)
+                save_page(fig_name, page_fig)
+                plt.close(page_fig)
+            if fig_name is not None:
+                objectList[page[-1]].fig_name = fig_name
+                fig_list.append(fig_name)
+                store_cached_page(key, page, files, fig)
+    return fig_list
+
+
+# ======================================================
+#                    RENDER CACHE
+# ======================================================
+# With -cache, a page is reused from the previous run if the figure options
+# (read from the template), the settings (see render_settings in main()) and
+# the size and modification time of each file it reads are unchanged.
+# The entries are pickles and are loaded as trusted input: the cache must
+# only be used in an output directory written by the user.
+files_read = set()  # Files read by prep_file() for the current page
+pages_used = set()  # Keys of the pages of the current run
+
+
+def page_key(page):
+    '''
+    Return the hash identifying a page in the render cache.
+    Args:
+        page:   list of the indices of the figures on the page
+    Returns:
+        key:    the hash of the settings and of the options of the figures on the page
+    '''
+    # Attributes set while plotting
+    exclude = ['success', 'fdim_txt', 'fig_name', 'page_name', 'pyramid']
+    content = [render_settings]
+    for i in page:
+        content.append(sorted((k, v) for k, v in vars(objectList[i]).items() if k not in exclude))
+    content.append([objectList[i].__class__.__name__ for i in page])
+    return hashlib.sha1(repr(content).encode()).hexdigest()
+
+
+def file_stats(files):
+    '''
+    Return the (path, size, modification time) of each file, sorted by path.
+    '''
+    stats = []
+    for name in sorted(files):
+        st = os.stat(name)
+        stats.append((name, st.st_size, st.st_mtime_ns))
+    return stats
+
+
+def load_cached_page(key):
+    '''
+    Return the cache entry of a page, or None if the page needs to be plotted
+    (cache not requested, no entry or one of the files read has changed).
+    '''
+    if not parser.parse_args().cache:
+        return None
+    pages_used.add(key)
+    cache_file = output_path+'/.MarsPlot_cache/'+key+'.pkl'
+    if not os.path.isfile(cache_file):
+        return None
+    try:
+        with open(cache_file, 'rb') as fid:
+            entry = pickle.load(fid)
+        if file_stats([st[0] for st in entry['files']]) != entry['files']:
+            return None
+    except Exception:
+        # Corrupted entry or a file was removed
+        return None
+    return entry
+
+
+def store_cached_page(key, page, files, fig=None):
+    '''
+    Save a page in the render cache. Only the pages plotted without error are saved.
+    Args:
+        key:    the hash of the page, from page_key()
+        page:   list of the indices of the figures on the page
+        files:  the files read for the page
+        fig:    the pickled figure (PDF outputs), for PNG and EPS the saved figure is used
+    '''
+    if not parser.parse_args().cache or not all(objectList[i].success for i in page):
+        return
+    fig_name = getattr(objectList[page[-1]], 'fig_name', None)
+    if fig is None:
+        if fig_name is None or not os.path.isfile(fig_name):
+            return
+        with open(fig_name, 'rb') as fid:
+            fig = fid.read()
+    entry = {'files': file_stats(files),
+             'status': [(objectList[i].success, objectList[i].fdim_txt) for i in page],
+             'fig': fig}
+    cache_dir = output_path+'/.MarsPlot_cache'
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    with open(cache_dir+'/'+key+'.pkl', 'wb') as fid:
+        pickle.dump(entry, fid)
+
+
+def prune_render_cache():
+    '''
+    Remove the cache entries not used by the current run
+    (e.g. left by an earlier version of the template).
+    '''
+    cache_dir = output_path+'/.MarsPlot_cache'
+    if not parser.parse_args().cache or not os.path.isdir(cache_dir):
+        return
+    for name in os.listdir(cache_dir):
+        if name.endswith('.pkl') and name[:-4] not in pages_used:
+            os.remove(cache_dir+'/'+name)
+
+
+def restore_page(page, entry, fig_name):
+    '''
+    Output a page from the render cache.
+    Args:
+        page:       list of the indices of the figures on the page
+        entry:      the cache entry, from load_cached_page()
+        fig_name:   the name of the figure
+    Returns:
+        fig_name:   the name of the figure
+    '''
+    for i, (success, fdim_txt) in zip(page, entry['status']):
+        objectList[i].success = success
+        objectList[i].fdim_txt = fdim_txt
+        progress(i, len(objectList), objectList[i].plot_type+' :' +
+                 objectList[i].varfull+fdim_txt+' (unchanged)', success)
+    if out_format == "pdf":
+        fig = pickle.loads(entry['fig'])
+        save_page(fig_name, fig)
+        plt.close(fig)
+    else:
+        with open(fig_name, 'wb') as fid:
+            fid.write(entry['fig'])
+        print("Saved:" + fig_name)
+    objectList[page[-1]].fig_name = fig_name
+    return fig_name
+
+
+# ======================================================
+#               DATASET POOL AND ARRAY CACHE
+# ======================================================
+# The datasets opened by prep_file() are kept open for the whole run and
+# shared by all the figures, keyed by (simuID, file_type, sol list).
+# The coordinates and slices read through them are kept in a LRU cache
+# bounded by array_cache_max_bytes.
+dataset_pool = {}
+array_cache = OrderedDict()
+array_cache_bytes = 0
+array_cache_max_bytes = 512*1024**2
+# Reads planned by plan_reads(): the indices requested by the figures for each
+# (pool_key, variable), and the [start, stop) bounds of the blocks merging the
+# overlapping requests, read once before plotting
+planning = False
+planned_reads = {}
+planned_blocks = {}
+
+
+def index_key(key):
+    '''
+    Return a hashable version of the index used to slice a variable,
+    e.g. [ti, zi, lati, loni] with integers, slices and index arrays.
+    '''
+    if not isinstance(key, tuple):
+        key = (key,)
+    out = []
+    for k in key:
+        if isinstance(k, slice):
+            out.append(('slice', k.start, k.stop, k.step))
+        elif k is Ellipsis:
+            out.append('...')
+        elif isinstance(k, (int, np.integer)):
+            out.append(int(k))
+        else:
+            k = np.asarray(k)
+            out.append((k.dtype.str, k.shape, k.tobytes()))
+    return tuple(out)
+
+
+def cache_get(key, copy=True):
+    '''
+    Return a copy of a cached array (so the callers may modify it) or None.
+    Use copy=False to get the cached array itself (read only).
+    '''
+    if key not in array_cache:
+        return None
+    array_cache.move_to_end(key)
+    if copy:
+        return array_cache[key].copy()
+    return array_cache[key]
+
+
+def orthogonal_index(arr, key):
+    '''
+    Slice an array the way netCDF4 slices a variable, i.e. the index arrays
+    apply to each dimension independently: arr[[0,1],:,[2,3]] has shape (2,:,2).
+    '''
+    if not isinstance(key, tuple):
+        key = (key,)
+    ellipsis = [i for i, k in enumerate(key) if k is Ellipsis]
+    if ellipsis:
+        i = ellipsis[0]
+        key = key[:i] + (slice(None),)*(arr.ndim-len(key)+1) + key[i+1:]
+    axis = 0
+    for k in key:
+        if isinstance(k, slice) and k == slice(None):
+            axis += 1
+            continue
+        arr = arr[(slice(None),)*axis + (k,)]
+        if isinstance(k, (slice, list, np.ndarray)):
+            axis += 1
+    return arr
+
+
+def expand_key(key, ndim):
+    '''
+    Return a key with one index per dimension, e.g. (0, Ellipsis) -> (0, :, :, :)
+    '''
+    if not isinstance(key, tuple):
+        key = (key,)
+    ellipsis = [i for i, k in enumerate(key) if k is Ellipsis]
+    if ellipsis:
+        i = ellipsis[0]
+        key = key[:i] + (slice(None),)*(ndim-len(key)+1) + key[i+1:]
+    return key + (slice(None),)*(ndim-len(key))
+
+
+def index_ranges(key, shape):
+    '''
+    Return the indices read along each dimension by a key, e.g. [ti, zi, lati, loni],
+    as a list of 1D arrays, or None for the keys not handled (e.g. boolean masks).
+    '''
+    key = expand_key(key, len(shape))
+    if len(key) != len(shape):
+        return None
+    ranges = []
+    for k, n in zip(key, shape):
+        if isinstance(k, slice):
+            idx = np.arange(*k.indices(n))
+        else:
+            idx = np.asarray(k)
+            if idx.dtype.kind not in 'iu' or idx.ndim > 1:
+                return None
+            idx = np.where(idx < 0, idx+n, idx).reshape(-1)
+        ranges.append(idx)
+    return ranges
+
+
+def box_index(key, ranges, start):
+    '''
+    Translate a key into the indices of a block starting at start,
+    keeping the integers as integers so that the same dimensions are dropped.
+    '''
+    key = expand_key(key, len(ranges))
+    return tuple(int(idx[0]-i0) if isinstance(k, (int, np.integer)) else idx-i0
+                 for k, idx, i0 in zip(key, ranges, start))
+
+
+def merge_requests(requests):
+    '''
+    Group the requests (lists of index ranges, see index_ranges()) that overlap,
+    directly or through other requests.
+    Returns:
+        groups: list of lists of requests
+    '''
+    groups = []
+    for ranges in requests:
+        merged = [ranges]
+        for group in groups[:]:
+            if any(all(np.intersect1d(idx0, idx).size > 0 for idx0, idx in zip(ranges0, ranges))
+                   for ranges0 in group):
+                merged += group
+                groups.remove(group)
+        groups.append(merged)
+    return groups
+
+
+def cache_put(key, arr):
+    '''
+    Add an array to the cache, evicting the least recently used arrays
+    if the cache exceeds array_cache_max_bytes.
+    '''
+    global array_cache_bytes
+    nbytes = np.asarray(arr).nbytes
+    if np.ma.isMaskedArray(arr) and arr.mask is not np.ma.nomask:
+        nbytes += np.asarray(arr.mask).nbytes
+    if nbytes > array_cache_max_bytes:
+        return
+    array_cache[key] = arr.copy()
+    array_cache_bytes += nbytes
+    while array_cache_bytes > array_cache_max_bytes:
+        _, old = array_cache.popitem(last=False)
+        array_cache_bytes -= np.asarray(old).nbytes
+        if np.ma.isMaskedArray(old) and old.mask is not np.ma.nomask:
+            array_cache_bytes -= np.asarray(old.mask).nbytes
+
+
+class PooledVariable(object):
+    '''
+    A variable of a pooled dataset. Slices are read through the array cache,
+    the other attributes (dimensions, shape, units...) are the ones of the variable.
+    '''
+    def __init__(self, pool_key, name, var):
+        self._pool_key = pool_key
+        self._name = name
+        self._var = var
+
+    def __getattr__(self, attr):
+        return getattr(self._var, attr)
+
+    def __getitem__(self, key):
+        return self.read(key)
+
+    def read(self, key, cache=True):
+        '''
+        Read a slice. With cache=False, a slice that is not in the cache is read
+        from the file without being added to the cache (e.g. the blocks of time steps).
+        While planning, the slices are recorded and zeros are returned (see plan_reads()).
+        '''
+        var_key = (self._pool_key, self._name)
+        if self.planned():
+            ranges = self.plan(key)
+            if ranges is not None:
+                shape = [len(idx) for k, idx in zip(expand_key(key, len(ranges)), ranges)
+                         if not isinstance(k, (int, np.integer))]
+                return np.ma.masked_array(np.zeros(shape, dtype=self._var.dtype))
+        if var_key in planned_blocks:
+            # Block read by plan_reads() that contains the slice
+            ranges = index_ranges(key, self._var.shape)
+            for i, (start, stop) in enumerate(planned_blocks[var_key] if ranges is not None else []):
+                if all(idx.size == 0 or (idx.min() >= i0 and idx.max() < i1)
+                       for idx, i0, i1 in zip(ranges, start, stop)):
+                    block = cache_get(var_key+('block', i), copy=False)
+                    if block is not None:
+                        return orthogonal_index(block, box_index(key, ranges, start)).copy()
+        if not cache:
+            return self._var[key]
+        cache_key = var_key + (index_key(key),)
+        arr = cache_get(cache_key)
+        if arr is None:
+            arr = self._var[key]
+            cache_put(cache_key, arr)
+        return arr
+
+    def planned(self):
+        '''
+        Return True if the slices read from this variable are being planned.
+        '''
+        return planning and (self._pool_key, self._name) in planned_reads
+
+    def plan(self, key):
+        '''
+        Record a slice requested while planning.
+        Returns:
+            the index ranges of the slice, None if the key is not handled (see index_ranges())
+        '''
+        ranges = index_ranges(key, self._var.shape)
+        if ranges is not None:
+            planned_reads[(self._pool_key, self._name)].append(ranges)
+        return ranges
+
+
+class PooledVariables(Mapping):
+    '''
+    The f.variables dictionary of a pooled dataset.
+    '''
+    def __init__(self, pool_key, variables):
+        self._pool_key = pool_key
+        self._variables = variables
+
+    def __getitem__(self, name):
+        return PooledVariable(self._pool_key, name, self._variables[name])
+
+    def __iter__(self):
+        return iter(self._variables)
+
+    def __len__(self):
+        return len(self._variables)
+
+
+class PooledDataset(object):
+    '''
+    A Dataset or MFDataset shared by all the figures. close() does nothing:
+    the datasets are closed once by close_dataset_pool() at exit.
+    '''
+    def __init__(self, pool_key, f, file_list):
+        self._f = f
+        self.pool_key = pool_key
+        self.file_list = file_list
+        self.variables = PooledVariables(pool_key, f.variables)
+
+    def __getattr__(self, attr):
+        return getattr(self._f, attr)
+
+    def close(self):
+        pass
+
+
+def close_dataset_pool():
+    '''
+    Close all the datasets opened during the run and empty the array cache.
+    '''
+    global array_cache_bytes
+    for f in dataset_pool.values():
+        try:
+            f._f.close()
+        except Exception:
+            pass
+    dataset_pool.clear()
+    array_cache.clear()
+    array_cache_bytes = 0
+    planned_reads.clear()
+    planned_blocks.clear()
+
+
+atexit.register(close_dataset_pool)
+
+
+def plan_reads(objectList, indices=None):
+    '''
+    Plan the reads of the figures before plotting:
+    1. Collect the variables named by the figures, including the operands of the '[]' expressions.
+    2. Run the data loaders of the figures without reading these variables: the slices
+       they request are recorded and zeros are returned (see PooledVariable.read()).
+    3. Merge the overlapping requests for each variable of each file, and read each
+       merged block once, file by file and in the order of the variables, so that the
+       figures get their slices from memory. The disjoint requests (e.g. one time step
+       per figure) and the blocks larger than array_cache_max_bytes/4 are read by the figures.
+    With -jobs, the blocks are read before the processes are started and shared with them.
+    Args:
+        objectList: list of figure objects
+        indices:    the indices of the figures to plan (default: all)
+    Returns:
+        None
+    '''
+    global planning
+    if indices is None:
+        indices = range(len(objectList))
+    for i in indices:
+        obj = objectList[i]
+        for varfull in [obj.varfull, getattr(obj, 'varfull2', None)]:
+            if not varfull:
+                continue
+            varfull = remove_whitespace(varfull)
+            if '[' in varfull:
+                varfull_list = get_list_varfull(varfull)
+            else:
+                varfull_list = [varfull]
+            # Trim the '{lev=5.}' part, the slices are set by the figures
+            varfull_list = [v.split('{')[0] for v in varfull_list]
+            reads = [split_varfull(v) for v in varfull_list]
+            # Coarsened files read with --pyramid
+            if isinstance(obj, Fig_2D) and obj.pyramid_factor() > 1:
+                reads = [(sol_array, filetype+'.c%i' % (obj.pyramid_factor()), var, simuID)
+                         for sol_array, filetype, var, simuID in reads]
+            for sol_array, filetype, var, simuID in reads:
+                try:
+                    f, _, _, _ = prep_file(var, filetype, simuID, sol_array)
+                except Exception:
+                    # Missing files or variables are reported by the figures
+                    continue
+                planned_reads.setdefault((f.pool_key, var), [])
+
+    # Record the slices requested by the figures
+    planning = True
+    try:
+        for i in indices:
+            obj = objectList[i]
+            # The data loaders set some attributes of the figures
+            saved = dict(vars(obj))
+            for varfull in [obj.varfull, getattr(obj, 'varfull2', None)]:
+                if not varfull:
+                    continue
+                try:
+                    with contextlib.redirect_stdout(io.StringIO()), np.errstate(all='ignore'):
+                        if isinstance(obj, Fig_2D):
+                            obj.data_loader_2D(varfull, obj.plot_type)
+                        else:
+                            obj.data_loader_1D(varfull, obj.plot_type)
+                except Exception:
+                    # The errors are reported by the figures
+                    pass
+            obj.__dict__.clear()
+            obj.__dict__.update(saved)
+    finally:
+        planning = False
+
+    # Merge the overlapping requests
+    for var_key, requests in planned_reads.items():
+        fvar = dataset_pool[var_key[0]].variables[var_key[1]]
+        itemsize = np.dtype(fvar.dtype).itemsize
+        blocks = []
+        for group in merge_requests([r for r in requests if all(idx.size > 0 for idx in r)]):
+            if len(group) < 2:
+                continue
+            start = [np.min([r[d].min() for r in group]) for d in range(len(fvar.shape))]
+            stop = [np.max([r[d].max() for r in group])+1 for d in range(len(fvar.shape))]
+            if np.prod(np.subtract(stop, start))*itemsize <= array_cache_max_bytes//4:
+                blocks.append((start, stop))
+        if blocks:
+            planned_blocks[var_key] = sorted(blocks)
+    planned_reads.clear()
+
+    # Read the blocks, file by file
+    for var_key in sorted(planned_blocks, key=str):
+        fvar = dataset_pool[var_key[0]].variables[var_key[1]]
+        for i, (start, stop) in enumerate(planned_blocks[var_key]):
+            cache_put(var_key+('block', i), fvar._var[tuple(slice(i0, i1) for i0, i1 in zip(start, stop))])
+
+
 def prep_file(var_name, file_type, simuID, sol_array):
     '''
     Open the file as a Dataset or MFDataset object depending on its status on tape (Lou)
@@ -1720,11 +2632,54 @@ def prep_file(var_name, file_type, simuID, sol_array):
         sol_array:  Date in file name (e.g. [3340,4008])
 
     Returns:
-        f: Dataset or MFDataset object
+        f: Dataset or MFDataset object, shared with the other figures (see PooledDataset)
         var_info: longname and units
         dim_info: dimensions e.g. ('time', 'lat','lon')
         dims:    shape of the array e.g. [133,48,96]
     '''
+    # Reuse the dataset if it was already opened for another figure
+    file_list, pool_key = get_file_list(file_type, simuID, sol_array)
+    if pool_key not in dataset_pool:
+        # One dmls command for all the files (Lou only)
+        check_files_tape(file_list)
+        f = None
+        if parser.parse_args().Ls:
+            # Only read the time steps in the Ls range from the files (fixed files have no time dimension)
+            f_first = Dataset(file_list[0], 'r')
+            f_type, _ = FV3_file_type(f_first)
+            f_first.close()
+            if f_type != 'fixed':
+                f = Range_dataset(file_list, Ls=parser.parse_args().Ls)
+        if f is None:
+            # We know the files exist on tape, now open it with MFDataset if an aggregation dimension is detected
+            try:
+                f = MFDataset(file_list, 'r')
+            except IOError:
+                # This IOError should be: 'master dataset ***.nc does not have a aggregation dimension'
+                # Use Dataset otherwise
+                f = Dataset(file_list[0], 'r')
+        dataset_pool[pool_key] = PooledDataset(pool_key, f, file_list)
+    f = dataset_pool[pool_key]
+    files_read.update(f.file_list)
+
+    var_info = getattr(f.variables[var_name], 'long_name', '') + \
+        ' [' + getattr(f.variables[var_name], 'units', '')+']'
+    dim_info = f.variables[var_name].dimensions
+    dims = f.variables[var_name].shape
+    return f, var_info, dim_info, dims
+
+
+def get_file_list(file_type, simuID, sol_array):
+    '''
+    Return the list of files for a file type, a simulation and a date (see prep_file).
+    Args:
+        file_type:  MGCM output file type (e.g. 'average' for atmos_average_pstd)
+        simuID:     Simulation ID number (e.g. 2 for 2nd simulation)
+        sol_array:  Date in file name (e.g. [3340,4008])
+    Returns:
+        file_list:  list of files (e.g. ['/path/03340.atmos_average.nc','/path/04008.atmos_average.nc'])
+        pool_key:   key of the dataset in dataset_pool
+    '''
     global input_paths
     # global variable that holds the different sol numbers (e.g. [1500,2400])
     global Ncdf_num
@@ -1740,8 +2695,10 @@ def prep_file(var_name, file_type, simuID, sol_array):
         # Two options here: First a file number is explicitly provided in varfull, (e.g. 00668.atmos_average.nc)
         if sol_array != [None]:
             Sol_num_current = sol_array
-        elif Ncdf_num != None:
+        elif Ncdf_num is not None:
             Sol_num_current = Ncdf_num
+    pool_key = (simuID, file_type, file_has_sol_number,
+                tuple(np.atleast_1d(Sol_num_current).tolist()))
     # Create a list of files (even if only one file is provided)
     nfiles = len(Sol_num_current)
     file_list = [None]*nfiles  # Initialize the list
@@ -1753,28 +2710,25 @@ def prep_file(var_name, file_type, simuID, sol_array):
                 '/%05d.' % (Sol_num_current[i])+file_type+'.nc'
         else:  # No sol number
             file_list[i] = input_paths[simuID]+'/'+file_type+'.nc'
-        check_file_tape(file_list[i], abort=False)
-    # We know the files exist on tape, now open it with MFDataset if an aggregation dimension is detected
-    try:
-        f = MFDataset(file_list, 'r')
-    except IOError:
-        # This IOError should be: 'master dataset ***.nc does not have a aggregation dimension'
-        # Use Dataset otherwise
-        f = Dataset(file_list[0], 'r')
-
-    var_info = getattr(f.variables[var_name], 'long_name', '') + \
-        ' [' + getattr(f.variables[var_name], 'units', '')+']'
-    dim_info = f.variables[var_name].dimensions
-    dims = f.variables[var_name].shape
-    return f, var_info, dim_info, dims
+    return file_list, pool_key
 
 
-class CustomTicker(LogFormatterSciNotation):
-    def __call__(self, x, pos=None):
-        if x < 0:
-            return LogFormatterSciNotation.__call__(self, x, pos=None)
-        else:
-            return "{x:g}".format(x=x)
+def pyramid_factors(file_type, simuID, sol_array):
+    '''
+    Return the coarsening factors of the files made by MarsFiles --pyramid for a file type,
+    e.g. [2,4] if 00668.atmos_average.c2.nc and 00668.atmos_average.c4.nc exist.
+    For a list of files, only the factors available for all the files are returned.
+    '''
+    file_list, _ = get_file_list(file_type, simuID, sol_array)
+    factors = None
+    for name in file_list:
+        found = set()
+        for coarse_name in glob.glob(name[:-3]+'.c*.nc'):
+            n = coarse_name[len(name)-3+2:-3]  # e.g. '4' in '00668.atmos_average.c4.nc'
+            if n.isdigit():
+                found.add(int(n))
+        factors = found if factors is None else factors & found
+    return sorted(factors)
 
 
 # ======================================================
@@ -1815,6 +2769,7 @@ class Fig_2D(object):
         self.success   = False
         self.addLine   = False
         self.vert_unit = ''  # m or Pa
+        self.page_name = None  # Name of the saved figure, set only when plotting in parallel
 
         # Axis options
         self.Xlim = None
@@ -1822,6 +2777,8 @@ class Fig_2D(object):
         self.axis_opt1 = 'jet'
         self.axis_opt2 = 'lin' # Linear or logscale
         self.axis_opt3 = None  # place holder for projections
+        self.decimate  = True  # Average the data to the resolution of the panel
+        self.pyramid   = None  # Coarsening factor of the files read with --pyramid, set by pyramid_factor()
 
     def make_template(self, plot_txt, fdim1_txt, fdim2_txt, Xaxis_txt, Yaxis_txt):
         customFileIN.write(
@@ -1850,8 +2807,10 @@ class Fig_2D(object):
         self.fdim2    = rT('float') # 5
         self.varfull2 = rT('char')  # 6
         self.contour2 = rT('float') # 7
+        axis_options_txt = customFileIN.readline()
         self.Xlim, self.Ylim, self.axis_opt1, self.axis_opt2, self.axis_opt3 = read_axis_options(
-            customFileIN.readline()) # 8
+            axis_options_txt) # 8
+        self.decimate = read_decimate_option(axis_options_txt)
 
         # Various sanity checks
         if self.range and len(np.atleast_1d(self.range)) == 1:
@@ -1908,6 +2867,9 @@ class Fig_2D(object):
         return xdata, ydata, var, var_info
 
     def read_NCDF_2D(self, var_name, file_type, simuID, sol_array, plot_type, fdim1, fdim2, ftod):
+        # Read the coarsened files, if requested with --pyramid
+        if self.pyramid_factor() > 1:
+            file_type += '.c%i' % (self.pyramid_factor())
         f, var_info, dim_info, dims = prep_file(
             var_name, file_type, simuID, sol_array)
 
@@ -1971,27 +2933,37 @@ class Fig_2D(object):
             if add_fdim:
                 self.fdim_txt += temp_txt
 
-            # Extract data and close file
+            # Extract data by blocks of time steps and close file
             # If 'diurn', do the time of day average first.
             if f_type == 'diurn':
-                var = f.variables[var_name][ti, todi, lati, loni].reshape(len(np.atleast_1d(ti)), len(np.atleast_1d(todi)),
-                                                                          len(np.atleast_1d(lati)), len(np.atleast_1d(loni)))
-                var = mean_func(var, axis=1)
+                index = (todi, lati, loni)
             else:
-                var = f.variables[var_name][ti, lati, loni].reshape(
-                    len(np.atleast_1d(ti)), len(np.atleast_1d(lati)), len(np.atleast_1d(loni)))
+                index = (lati, loni)
+            shape = tuple(len(np.atleast_1d(i)) for i in index)
+            read_blocks = lambda: read_time_blocks(f.variables[var_name], ti, index, shape)
+
+            def reduce(var):
+                if f_type == 'diurn':
+                    var = mean_func(var, axis=1)
+                if plot_type == '2D_time_lat':
+                    return mean_func(var, axis=2)
+                if plot_type == '2D_lon_time':
+                    w = area_weights_deg(var.shape, lat[lati])
+                    return np.average(var, weights=w, axis=1)
+                return var
+
+            # Time average for '2D_lon_lat'
+            var = reduce_time_blocks(read_blocks, reduce, average=(plot_type == '2D_lon_lat'))
             f.close()
-            w = area_weights_deg(var.shape, lat[lati])
 
             # Return data
             if plot_type == '2D_lon_lat':
-                # Time average
-                return lon, lat, mean_func(var, axis=0), var_info
+                return lon, lat, var, var_info
             if plot_type == '2D_time_lat':
                 # Transpose, X dimension must be in last column of variable
-                return t_stack, lat, mean_func(var, axis=2).T, var_info
+                return t_stack, lat, var.T, var_info
             if plot_type == '2D_lon_time':
-                return lon, t_stack, np.average(var, weights=w, axis=1), var_info
+                return lon, t_stack, var, var_info
 
         # ====== time, level, lat, lon =======
         if (dim_info   == ('time', 'pfull', 'lat', 'lon')
@@ -2090,28 +3062,15 @@ class Fig_2D(object):
                 if add_fdim:
                     self.fdim_txt += temp_txt
 
-            # If 'diurn' do the time of day average first.
-            if f_type == 'diurn':
-                var = f.variables[var_name][ti, todi, zi, lati, loni].reshape(len(np.atleast_1d(ti)), len(np.atleast_1d(todi)),
-                                                                              len(np.atleast_1d(zi)), len(np.atleast_1d(lati)), len(np.atleast_1d(loni)))
-                var = mean_func(var, axis=1)
-            elif var_thin == True:
+            #(u'time', u'pfull', u'lat', u'lon')
+            if var_thin == True:
                 var = f.variables[var_name][zi, lati, loni].reshape(len(np.atleast_1d(zi)),
                                                                     len(np.atleast_1d(
                                                                         lati)),
                                                                     len(np.atleast_1d(loni)))
-            else:
-                var = f.variables[var_name][ti, zi, lati, loni].reshape(len(np.atleast_1d(ti)),
-                                                                        len(np.atleast_1d(
-                                                                            zi)),
-                                                                        len(np.atleast_1d(
-                                                                            lati)),
-                                                                        len(np.atleast_1d(loni)))
-            f.close()
-            w = area_weights_deg(var.shape, lat[lati])
+                f.close()
+                w = area_weights_deg(var.shape, lat[lati])
 
-            #(u'time', u'pfull', u'lat', u'lon')
-            if var_thin == True:
                 if plot_type == '2D_lon_lat':
                     return lon,   lat,  mean_func(var, axis=0), var_info
                 if plot_type == '2D_lat_lev':
@@ -2119,20 +3078,51 @@ class Fig_2D(object):
                 if plot_type == '2D_lon_lev':
                     return lon, levs,    mean_func(var, weights=w, axis=1), var_info
             else:
+                # Extract data by blocks of time steps and close file
+                # If 'diurn' do the time of day average first.
+                if f_type == 'diurn':
+                    index = (todi, zi, lati, loni)
+                else:
+                    index = (zi, lati, loni)
+                shape = tuple(len(np.atleast_1d(i)) for i in index)
+                read_blocks = lambda: read_time_blocks(f.variables[var_name], ti, index, shape)
+
+                def reduce(var):
+                    if f_type == 'diurn':
+                        var = mean_func(var, axis=1)
+                    w = area_weights_deg(var.shape, lat[lati])
+                    if plot_type == '2D_lon_lat':
+                        return mean_func(var, axis=1)
+                    if plot_type == '2D_time_lat':
+                        return mean_func(mean_func(var, axis=1), axis=2)
+                    if plot_type == '2D_lat_lev':
+                        return mean_func(var, axis=3)
+                    if plot_type == '2D_lon_lev':
+                        return np.average(var, weights=w, axis=2)
+                    if plot_type == '2D_time_lev':
+                        return mean_func(np.average(var, weights=w, axis=2), axis=2)
+                    if plot_type == '2D_lon_time':
+                        return mean_func(np.average(var, weights=w, axis=2), axis=1)
+
+                # Time average for '2D_lon_lat', '2D_lat_lev' and '2D_lon_lev'
+                var = reduce_time_blocks(read_blocks, reduce,
+                                         average=plot_type in ['2D_lon_lat', '2D_lat_lev', '2D_lon_lev'])
+                f.close()
+
                 if plot_type == '2D_lon_lat':
-                    return lon,   lat,  mean_func(mean_func(var, axis=1), axis=0), var_info
+                    return lon,   lat,  var, var_info
                 if plot_type == '2D_time_lat':
                     # transpose
-                    return t_stack, lat,  mean_func(mean_func(var, axis=1), axis=2).T, var_info
+                    return t_stack, lat,  var.T, var_info
                 if plot_type == '2D_lat_lev':
-                    return lat, levs,    mean_func(mean_func(var, axis=3), axis=0), var_info
+                    return lat, levs,    var, var_info
                 if plot_type == '2D_lon_lev':
-                    return lon, levs,    mean_func(np.average(var, weights=w, axis=2), axis=0), var_info
+                    return lon, levs,    var, var_info
                 if plot_type == '2D_time_lev':
                     # transpose
-                    return t_stack, levs, mean_func(np.average(var, weights=w, axis=2), axis=2).T, var_info
+                    return t_stack, levs, var.T, var_info
                 if plot_type == '2D_lon_time':
-                    return lon, t_stack, mean_func(np.average(var, weights=w, axis=2), axis=1), var_info
+                    return lon, t_stack, var, var_info
 
     def plot_dimensions(self):
         prYellow(f'{self.ax.get_position()}')
@@ -2235,22 +3225,12 @@ class Fig_2D(object):
     def fig_save(self):
         # Save the figure
         if self.subID == self.nPan:  # Last subplot
-            if self.subID == 1:  # 1 plot
-                if not '[' in self.varfull:
-                    # Add split '{' in case 'varfull' contains layer. Does not do anything else.
-                    sensitive_name = self.varfull.split('{')[0].strip()
-                    # If 'varfull' is a complex expression
-                else:
-                    sensitive_name = 'expression_' + \
-                        get_list_varfull(self.varfull)[0].split('{')[0].strip()
-            else:  # Multipanel
-                sensitive_name = 'multi_panel'
             plt.tight_layout()
-            self.fig_name = output_path+'/plots/'+sensitive_name+'.'+out_format
-            self.fig_name = create_name(self.fig_name)
-            plt.savefig(self.fig_name, dpi=my_dpi)
-            if out_format != "pdf":
-                print("Saved:" + self.fig_name)
+            if self.page_name is None:
+                self.fig_name = create_name(figure_root_name(self))
+            else:  # Name given in advance by render_pages()
+                self.fig_name = self.page_name
+            save_page(self.fig_name)
 
     def filled_contour(self, xdata, ydata, var):
         cmap = self.axis_opt1
@@ -2266,14 +3246,132 @@ class Fig_2D(object):
 
         norm, levs = self.return_norm_levs()
 
+        if self.decimate:
+            xdata, ydata, var = self.decimate_data(xdata, ydata, var)
+
         if self.range:
-            plt.contourf(xdata, ydata, var, levs,
-                         extend='both', cmap=cmap, norm=norm)
+            cs = plt.contourf(xdata, ydata, var, levs,
+                              extend='both', cmap=cmap, norm=norm)
         else:
-            plt.contourf(xdata, ydata, var, levels, cmap=cmap, norm=norm)
+            cs = plt.contourf(xdata, ydata, var, levels, cmap=cmap, norm=norm)
+
+        if self.decimate and parser.parse_args().rasterize and out_format in ['pdf', 'eps']:
+            # Bitmap inside the vector page
+            if hasattr(cs, 'set_rasterized'):
+                cs.set_rasterized(True)
+            else:
+                for col in cs.collections:
+                    col.set_rasterized(True)
 
         self.make_colorbar(levs)
 
+    def panel_pixels(self):
+        '''
+        Return the number of pixels of the panel on the page (see --pwidth) along X and Y.
+        '''
+        if self.layout is None:
+            out = fig_layout(self.subID, self.nPan, vertical_page)
+        else:
+            out = np.append(self.layout, self.subID)
+        return int(width_inch*my_dpi/out[1]), int(height_inch*my_dpi/out[0])
+
+    def pyramid_factor(self):
+        '''
+        Return the coarsening factor of the files to read with --pyramid (e.g. 4 for 00668.atmos_average.c4.nc)
+        or 1 to read the original files. The coarsest files available for all the variables of the panel
+        with at least one grid point per pixel along the longitude and latitude axes of the plot are used.
+        ***NOTE***
+        The coarse cells are area-weighted averages so the files are used only if the plot shows or averages
+        the whole longitude and latitude dimensions: panels selecting a longitude or a latitude
+        (e.g. a 2D_lat_lev plot at Lon +/-180 = 45), zooming with a polar or orthographic projection
+        or overwriting the dimensions with '{}' read the original files.
+        '''
+        if self.pyramid is not None:
+            return self.pyramid
+        self.pyramid = 1
+        if not parser.parse_args().pyramid:
+            return self.pyramid
+
+        def averaged(fdim):
+            # None and 'all' (-99999) are the global averages of the dimension
+            return fdim is None or (np.array(fdim).size == 1 and np.array(fdim) == -99999)
+
+        nx, ny = self.panel_pixels()
+        # Zoom on the X and Y axes
+        zoom_lon_x = 360./(self.Xlim[1]-self.Xlim[0]) if self.Xlim else 1.
+        zoom_lat_x = 180./(self.Xlim[1]-self.Xlim[0]) if self.Xlim else 1.
+        zoom_lat_y = 180./(self.Ylim[1]-self.Ylim[0]) if self.Ylim else 1.
+        # Number of longitudes and latitudes needed, 0 if the dimension is averaged
+        if self.plot_type == '2D_lon_lat' and self.axis_opt3 in ['cart', 'robin', 'moll']:
+            need_lon, need_lat = nx*zoom_lon_x, ny*zoom_lat_y
+        elif self.plot_type == '2D_lat_lev' and averaged(self.fdim2):
+            need_lon, need_lat = 0, nx*zoom_lat_x
+        elif self.plot_type == '2D_time_lat' and averaged(self.fdim1):
+            need_lon, need_lat = 0, ny*zoom_lat_y
+        elif self.plot_type == '2D_lon_lev' and averaged(self.fdim2):
+            need_lon, need_lat = nx*zoom_lon_x, 0
+        elif self.plot_type == '2D_lon_time' and averaged(self.fdim1):
+            need_lon, need_lat = nx*zoom_lon_x, 0
+        elif self.plot_type == '2D_time_lev' and averaged(self.fdim1) and averaged(self.fdim2):
+            need_lon, need_lat = 0, 0
+        else:
+            return self.pyramid
+
+        # Variables of the panel, including the operands of the '[]' expressions
+        reads = []
+        for varfull in [self.varfull, self.varfull2]:
+            if not varfull:
+                continue
+            varfull = remove_whitespace(varfull)
+            if '{' in varfull:
+                return self.pyramid
+            varfull_list = get_list_varfull(varfull) if '[' in varfull else [varfull]
+            reads += [split_varfull(v) for v in varfull_list]
+
+        try:
+            factors = None
+            for sol_array, filetype, var, simuID in reads:
+                found = set(pyramid_factors(filetype, simuID, sol_array))
+                factors = found if factors is None else factors & found
+            for n in sorted(factors, reverse=True):
+                for sol_array, filetype, var, simuID in reads:
+                    f, _, _, _ = prep_file(var, filetype+'.c%i' % (n), simuID, sol_array)
+                    if (len(f.variables['lon'][:]) < need_lon
+                            or len(f.variables['lat'][:]) < need_lat):
+                        break
+                else:
+                    self.pyramid = n
+                    break
+        except Exception:
+            # Missing files or variables: read the original files
+            self.pyramid = 1
+        return self.pyramid
+
+    def decimate_data(self, xdata, ydata, var):
+        '''
+        Block-average the data to the resolution of the panel on the page (see --pwidth).
+        Only the dimensions with at least twice as many points as pixels are averaged.
+        Args:
+            xdata:  1D array, X axis
+            ydata:  1D array, Y axis
+            var:    2D array, shape (len(ydata), len(xdata))
+        Returns:
+            xdata, ydata, var: the averaged axes and data
+        '''
+        nx, ny = self.panel_pixels()
+        xdata = np.asarray(xdata)
+        ydata = np.asarray(ydata)
+        if np.ndim(xdata) != 1 or np.ndim(ydata) != 1 or np.ndim(var) != 2:
+            return xdata, ydata, var
+        if len(xdata)//nx < 2 and len(ydata)//ny < 2:
+            return xdata, ydata, var
+        var = np.ma.filled(np.ma.asarray(var, dtype=float), np.nan)
+        if len(xdata)//nx >= 2:
+            xdata, var = block_mean(xdata, var, len(xdata)//nx, 1)
+        if len(ydata)//ny >= 2:
+            ydata, var = block_mean(ydata, var, len(ydata)//ny, 0)
+        return xdata, ydata, var
+
     def solid_contour(self, xdata, ydata, var, contours):
         # Prevent error message when drawing contours
         np.seterr(divide='ignore', invalid='ignore')
@@ -2408,22 +3506,20 @@ class Fig_2D_lon_lat(Fig_2D):
                 # ---------------------------------------------------------------
 
                 if projfull == 'robin':
-                    LON, LAT = np.meshgrid(lon_shift, lat)
-                    X, Y = robin2cart(LAT, LON)
+                    X, Y = projection_grid('robin', lat, lon_shift)
 
                     # Add meridans and parallelss
-                    for mer in np.arange(-180, 180, 30):
-                        xg, yg = robin2cart(lat, lat*0+mer)
-                        plt.plot(xg, yg, ':k', lw=0.5)
+                    xg, yg = projection_grid('robin', lat, np.arange(-180, 180, 30))
+                    plt.plot(xg, yg, ':k', lw=0.5)
                     # Label every other meridian
                     for mer in np.arange(-180, 181, 90):
                         xl, yl = robin2cart(lat.min(), mer)
                         lab_txt = format_lon_lat(mer, 'lon')
                         plt.text(xl, yl, lab_txt, fontsize=label_size-self.nPan*label_factor,
                                  verticalalignment='top', horizontalalignment='center')
+                    xg, yg = projection_grid('robin', np.arange(-60, 90, 30), lon_shift)
+                    plt.plot(xg.T, yg.T, ':k', lw=0.5)
                     for par in np.arange(-60, 90, 30):
-                        xg, yg = robin2cart(lon_shift*0+par, lon_shift)
-                        plt.plot(xg, yg, ':k', lw=0.5)
                         xl, yl = robin2cart(par, 180)
                         lab_txt = format_lon_lat(par, 'lat')
                         plt.text(xl, yl, lab_txt, fontsize=label_size -
@@ -2431,12 +3527,10 @@ class Fig_2D_lon_lat(Fig_2D):
                 # ---------------------------------------------------------------
 
                 if projfull == 'moll':
-                    LON, LAT = np.meshgrid(lon_shift, lat)
-                    X, Y = mollweide2cart(LAT, LON)
+                    X, Y = projection_grid('moll', lat, lon_shift)
                     # Add meridans and parallelss
-                    for mer in np.arange(-180, 180, 30):
-                        xg, yg = mollweide2cart(lat, lat*0+mer)
-                        plt.plot(xg, yg, ':k', lw=0.5)
+                    xg, yg = projection_grid('moll', lat, np.arange(-180, 180, 30))
+                    plt.plot(xg, yg, ':k', lw=0.5)
                     # Label every other meridian
                     for mer in [-180, 0, 180]:
                         xl, yl = mollweide2cart(lat.min(), mer)
@@ -2444,11 +3538,11 @@ class Fig_2D_lon_lat(Fig_2D):
                         plt.text(xl, yl, lab_txt, fontsize=label_size-self.nPan*label_factor,
                                  verticalalignment='top', horizontalalignment='center')
 
+                    xg, yg = projection_grid('moll', np.arange(-60, 90, 30), lon_shift)
+                    plt.plot(xg.T, yg.T, ':k', lw=0.5)
                     for par in np.arange(-60, 90, 30):
-                        xg, yg = mollweide2cart(lon_shift*0+par, lon_shift)
                         xl, yl = mollweide2cart(par, 180)
                         lab_txt = format_lon_lat(par, 'lat')
-                        plt.plot(xg, yg, ':k', lw=0.5)
                         plt.text(xl, yl, lab_txt, fontsize=label_size -
                                  self.nPan*label_factor)
 
@@ -2475,13 +3569,11 @@ class Fig_2D_lon_lat(Fig_2D):
                     var = var[lat_bi:, :]
                     if add_topo:
                         zsurf = zsurf[lat_bi:, :]
-                    LON, LAT = np.meshgrid(lon_shift, lat)
-                    X, Y = azimuth2cart(LAT, LON, 90, 0)
+                    X, Y = projection_grid('azimuth', lat, lon_shift, 90, 0)
 
                     # Add meridans and parallels
-                    for mer in np.arange(-180, 180, 30):
-                        xg, yg = azimuth2cart(lat, lat*0+mer, 90)
-                        plt.plot(xg, yg, ':k', lw=0.5)
+                    xg, yg = projection_grid('azimuth', lat, np.arange(-180, 180, 30), 90)
+                    plt.plot(xg, yg, ':k', lw=0.5)
                     # Skip 190W to leave room for the Title
                     for mer in np.arange(-150, 180, 30):
                         # Place label 3 degrees south of the bounding latitude
@@ -2490,9 +3582,9 @@ class Fig_2D_lon_lat(Fig_2D):
                         plt.text(xl, yl, lab_txt, fontsize=label_size-self.nPan*label_factor,
                                  verticalalignment='top', horizontalalignment='center')
                     # Parallels start from 80N, every 10 degrees
+                    xg, yg = projection_grid('azimuth', np.arange(80, lat.min(), -10), lon_shift, 90)
+                    plt.plot(xg.T, yg.T, ':k', lw=0.5)
                     for par in np.arange(80, lat.min(), -10):
-                        xg, yg = azimuth2cart(lon_shift*0+par, lon_shift, 90)
-                        plt.plot(xg, yg, ':k', lw=0.5)
                         xl, yl = azimuth2cart(par, 180, 90)
                         lab_txt = format_lon_lat(par, 'lat')
                         plt.text(xl, yl, lab_txt, fontsize=5)
@@ -2505,12 +3597,10 @@ class Fig_2D_lon_lat(Fig_2D):
                     var = var[:lat_bi, :]
                     if add_topo:
                         zsurf = zsurf[:lat_bi, :]
-                    LON, LAT = np.meshgrid(lon_shift, lat)
-                    X, Y = azimuth2cart(LAT, LON, -90, 0)
+                    X, Y = projection_grid('azimuth', lat, lon_shift, -90, 0)
                     # Add meridans and parallels
-                    for mer in np.arange(-180, 180, 30):
-                        xg, yg = azimuth2cart(lat, lat*0+mer, -90)
-                        plt.plot(xg, yg, ':k', lw=0.5)
+                    xg, yg = projection_grid('azimuth', lat, np.arange(-180, 180, 30), -90)
+                    plt.plot(xg, yg, ':k', lw=0.5)
                     # Skip zero to leave room for the Title
                     for mer in np.append(np.arange(-180, 0, 30), np.arange(30, 180, 30)):
                         # Place label 3 degrees north of the bounding latitude
@@ -2519,9 +3609,9 @@ class Fig_2D_lon_lat(Fig_2D):
                         plt.text(xl, yl, lab_txt, fontsize=label_size-self.nPan*label_factor,
                                  verticalalignment='top', horizontalalignment='center')
                     # Parallels start from 80S, every 10 degrees
+                    xg, yg = projection_grid('azimuth', np.arange(-80, lat.max(), 10), lon_shift, -90)
+                    plt.plot(xg.T, yg.T, ':k', lw=0.5)
                     for par in np.arange(-80, lat.max(), 10):
-                        xg, yg = azimuth2cart(lon_shift*0+par, lon_shift, -90)
-                        plt.plot(xg, yg, ':k', lw=0.5)
                         xl, yl = azimuth2cart(par, 180, -90)
                         lab_txt = format_lon_lat(par, 'lat')
                         plt.text(xl, yl, lab_txt, fontsize=5)
@@ -2532,21 +3622,18 @@ class Fig_2D_lon_lat(Fig_2D):
                     if not(lon_lat_custom is None):
                         lon_p = lon_lat_custom[0]
                         lat_p = lon_lat_custom[1]  # Bounding lat
-                    LON, LAT = np.meshgrid(lon_shift, lat)
-                    X, Y, MASK = ortho2cart(LAT, LON, lat_p, lon_p)
+                    X, Y, MASK = projection_grid('ortho', lat, lon_shift, lat_p, lon_p)
                     # Mask opposite side of the planet
                     var = var*MASK
                     if add_topo:
                         zsurf = zsurf*MASK
                     # Add meridans and parallels
-                    for mer in np.arange(-180, 180, 30):
-                        xg, yg, maskg = ortho2cart(
-                            lat, lat*0+mer, lat_p, lon_p)
-                        plt.plot(xg*maskg, yg, ':k', lw=0.5)
-                    for par in np.arange(-60, 90, 30):
-                        xg, yg, maskg = ortho2cart(
-                            lon_shift*0+par, lon_shift, lat_p, lon_p)
-                        plt.plot(xg*maskg, yg, ':k', lw=0.5)
+                    xg, yg, maskg = projection_grid(
+                        'ortho', lat, np.arange(-180, 180, 30), lat_p, lon_p)
+                    plt.plot(xg*maskg, yg, ':k', lw=0.5)
+                    xg, yg, maskg = projection_grid(
+                        'ortho', np.arange(-60, 90, 30), lon_shift, lat_p, lon_p)
+                    plt.plot((xg*maskg).T, yg.T, ':k', lw=0.5)
 
                 if self.range:
                     plt.contourf(X, Y, var, levs, extend='both',
@@ -2570,12 +3657,10 @@ class Fig_2D_lon_lat(Fig_2D):
                     lon_shift, var2 = shift_data(lon, var2)
 
                     if projfull == 'robin':
-                        LON, LAT = np.meshgrid(lon_shift, lat)
-                        X, Y = robin2cart(LAT, LON)
+                        X, Y = projection_grid('robin', lat, lon_shift)
 
                     if projfull == 'moll':
-                        LON, LAT = np.meshgrid(lon_shift, lat)
-                        X, Y = mollweide2cart(LAT, LON)
+                        X, Y = projection_grid('moll', lat, lon_shift)
 
                     if projfull[0:5] in ['Npole', 'Spole', 'ortho']:
                         # Common to all azithumal projections
@@ -2596,8 +3681,7 @@ class Fig_2D_lon_lat(Fig_2D):
                         lat_bi, _ = get_lat_index(lat_b, lat)
                         lat = lat[lat_bi:]
                         var2 = var2[lat_bi:, :]
-                        LON, LAT = np.meshgrid(lon_shift, lat)
-                        X, Y = azimuth2cart(LAT, LON, 90, 0)
+                        X, Y = projection_grid('azimuth', lat, lon_shift, 90, 0)
                     if projfull[0:5] == 'Spole':
                         lat_b = -60
                         if not(lon_lat_custom is None):
@@ -2605,8 +3689,7 @@ class Fig_2D_lon_lat(Fig_2D):
                         lat_bi, _ = get_lat_index(lat_b, lat)
                         lat = lat[:lat_bi]
                         var2 = var2[:lat_bi, :]
-                        LON, LAT = np.meshgrid(lon_shift, lat)
-                        X, Y = azimuth2cart(LAT, LON, -90, 0)
+                        X, Y = projection_grid('azimuth', lat, lon_shift, -90, 0)
 
                     if projfull[0:5] == 'ortho':
                         # Initialization
@@ -2614,8 +3697,7 @@ class Fig_2D_lon_lat(Fig_2D):
                         if not(lon_lat_custom is None):
                             lon_p = lon_lat_custom[0]
                             lat_p = lon_lat_custom[1]  # Bounding lat
-                        LON, LAT = np.meshgrid(lon_shift, lat)
-                        X, Y, MASK = ortho2cart(LAT, LON, lat_p, lon_p)
+                        X, Y, MASK = projection_grid('ortho', lat, lon_shift, lat_p, lon_p)
                         # Mask opposite side of the planet
                         var2 = var2*MASK
 
@@ -2981,6 +4063,7 @@ class Fig_1D(object):
         self.fdim_txt = ''
         self.success = False
         self.vert_unit = ''  # m or Pa
+        self.page_name = None  # Name of the saved figure, set only when plotting in parallel
         # Axis options
 
         self.Dlim = None  # Dimension limit
@@ -3461,28 +4544,16 @@ class Fig_1D(object):
 
         # Save the figure
         if self.subID == self.nPan:  # Last subplot
-            if self.subID == 1:      # If 1 plot
-                if not '[' in self.varfull:
-                    # Add split '{' if 'varfull' contains layer. Does not do anything otherwise
-                    sensitive_name = self.varfull.split('{')[0].strip()
-                else:
-                    sensitive_name = 'expression_' + \
-                        get_list_varfull(self.varfull)[0].split('{')[0].strip()
-            else:  # Multipanel
-                sensitive_name = 'multi_panel'
-
-            self.fig_name = output_path+'/plots/'+sensitive_name+'.'+out_format
-            self.fig_name = create_name(self.fig_name)
+            if self.page_name is None:
+                self.fig_name = create_name(figure_root_name(self))
+            else:  # Name given in advance by render_pages()
+                self.fig_name = self.page_name
 
             if i_list < len(objectList)-1 and not objectList[i_list+1].addLine:
-                plt.savefig(self.fig_name, dpi=my_dpi)
-                if out_format != "pdf":
-                    print("Saved:" + self.fig_name)
+                save_page(self.fig_name)
             # Last subplot
             if i_list == len(objectList)-1:
-                plt.savefig(self.fig_name, dpi=my_dpi)
-                if out_format != "pdf":
-                    print("Saved:" + self.fig_name)
+                save_page(self.fig_name)
 
     def do_plot(self):
         # Create figure
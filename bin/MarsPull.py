@@ -9,6 +9,11 @@ The executable requires:
     * ``[-ls --ls]``        the desired solar longitude(s), OR
     * ``[-f --filename]``   the name(s) of the desired file(s)
 
+and optionally accepts:
+    * ``[-j --jobs]``       the number of simultaneous downloads
+    * ``[-c --convert]``    the MGCM-like file types to convert to
+    * ``[-rm --remove]``    delete the raw files once converted
+
 Third-party Requirements:
     * ``numpy``
     * ``sys``
@@ -24,8 +29,13 @@ from amescap.Script_utils import (Yellow, Cyan, Yellow, Nclr, Green, Cyan)
 import sys          # System commands
 import argparse     # Parse arguments
 import os           # Access operating system functions
+import time         # Wait between retries
+import subprocess   # Run MarsFiles
 import requests     # Download data from website
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock, Thread
+from queue import Queue
 
 # ======================================================================
 #                           ARGUMENT PARSER
@@ -76,6 +86,37 @@ parser.add_argument("-f", "--filename", nargs="+", type=str,
     )
 )
 
+parser.add_argument("-j", "--jobs", type=int, default=4,
+    help=(
+        f"Number of files downloaded simultaneously (default is 4). "
+        f"Interrupted\ndownloads are resumed from the ``.part`` files "
+        f"left in the directory\n"
+        f"{Green}Usage:\n"
+        f"> MarsPull.py -id INERTCLDS -ls 0. 90. -j 8"
+        f"{Nclr}\n\n"
+    )
+)
+
+parser.add_argument("-c", "--convert", nargs="+", type=str,
+    help=(
+        f"Convert the files to MGCM-like ``fixed``, ``average``, "
+        f"``daily`` and/or ``diurn``\nfiles (as ``MarsFiles.py --fv3``) "
+        f"while the next files are downloading\n"
+        f"{Green}Usage:\n"
+        f"> MarsPull.py -id INERTCLDS -ls 0. 90. -c fixed,average,daily"
+        f"{Nclr}\n\n"
+    )
+)
+
+parser.add_argument("-rm", "--remove", action="store_true",
+    help=(
+        f"With ``--convert``, delete each raw file once it is converted\n"
+        f"{Green}Usage:\n"
+        f"> MarsPull.py -id INERTCLDS -ls 0. 90. -c average -rm"
+        f"{Nclr}\n\n"
+    )
+)
+
 parser.add_argument("--debug", action="store_true",
     help = (f"Debug flag: do not bypass errors.\n\n"))
 
@@ -121,7 +162,61 @@ ls_N = np.array([
     227, 233, 240, 246, 253, 259, 266, 272, 279, 285, 291, 297, 304,
     310, 316, 321, 327, 333, 338, 344, 349, 354, 0])
 
-def download(file_name, simulation_id):
+# The URL may be pointed to a local server (e.g., for testing) with the
+# AMESCAP_MCMC_URL environment variable
+BASE_URL = os.environ.get(
+    "AMESCAP_MCMC_URL",
+    "https://data.nas.nasa.gov/legacygcm/download_data_legacygcm.php?"
+    "file=/legacygcmdata")
+
+CHUNK_SIZE = 1024*1024  # Size of the chunks written to disk (bytes)
+MAX_RETRIES = 5         # Number of attempts per file
+BACKOFF = 2.            # Wait 2, 4, 8... seconds between attempts
+TIMEOUT = (30, 300)     # Connect and read timeouts (seconds)
+
+
+class Progress:
+    """
+    Progress bar shared by the download threads.
+    """
+
+    def __init__(self, num_files):
+        self.num_files = num_files
+        self.done = 0
+        self.downloaded = 0
+        self.lock = Lock()
+
+    def update(self, nbytes=0, done=0):
+        with self.lock:
+            self.downloaded += nbytes
+            self.done += done
+            status = int(50*self.done/self.num_files)
+            sys.stdout.write(f"\r[{'#'*status}{'.'*(50-status)}] "
+                             f"{self.done}/{self.num_files} file(s), "
+                             f"{self.downloaded/1024**2:.1f} Mb")
+            sys.stdout.flush()
+
+
+def new_session(jobs=1):
+    """
+    Creates an HTTP session whose connections are reused by all the
+    downloads.
+
+    :param jobs: The number of threads sharing the session.
+    :type jobs: int
+
+    :return: a ``requests.Session``
+    """
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                            pool_maxsize=max(jobs, 1))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def download(file_name, simulation_id, session=None, progress=None):
     """
     Downloads a file from the MCMC Legacy GCM directory on the NAS Data
     Portal (data.nas.nasa.gov).
@@ -133,59 +228,226 @@ def download(file_name, simulation_id):
     ``[-f --filename]`` or determined based on the user-specified solar
     longitude ``[-ls --ls]``.
 
+    The data is written to ``file_name.part``, which is renamed once
+    its size matches the size announced by the server. An interrupted
+    transfer is resumed from the end of the ``.part`` file with an HTTP
+    Range request, and failed attempts are retried ``MAX_RETRIES``
+    times with an exponential backoff.
+
     :param simulation_id: The simulation identifier, i.e., the name of
         the directory to query from:
         https://data.nas.nasa.gov/mcmc/data_legacygcm.php
     :type simulation_id: str
     :param file_name: The name of the file to download.
     :type file_name: str
+    :param session: The HTTP session to use (a new one if None).
+    :type session: requests.Session
+    :param progress: The progress bar to update (None to not report).
+    :type progress: Progress
 
-    :raises: file-not-found error.
+    :raises: FileNotFoundError if the file does not exist on the server,
+        IOError if the download still fails after ``MAX_RETRIES``
+        attempts.
 
-    :return: downloads & saves the requested file(s) to the current
-        directory.
+    :return: the path to the downloaded file.
     """
 
-    baseURL = (f"https://data.nas.nasa.gov/legacygcm/download_data_legacygcm."
-               f"php?file=/legacygcmdata/{simulation_id}/")
-
-    URL = baseURL + file_name
+    URL = f"{BASE_URL}/{simulation_id}/{file_name}"
 
     filename = SAVEDIR + file_name
+    partname = filename + ".part"
+
+    if os.path.exists(filename):
+        # Already downloaded (incomplete downloads are .part files)
+        if progress:
+            progress.update(done=1)
+        return filename
+
+    if session is None:
+        session = new_session()
+
+    for attempt in range(MAX_RETRIES):
+        offset = os.path.getsize(partname) if os.path.exists(partname) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            with session.get(URL, stream=True, headers=headers,
+                             timeout=TIMEOUT) as rsp:
+                if rsp.status_code == 404:
+                    raise FileNotFoundError(
+                        f"{file_name} not found! Error code: "
+                        f"{rsp.status_code}")
+                if rsp.status_code == 416:
+                    # The .part file does not match the remote file
+                    os.remove(partname)
+                    continue
+                rsp.raise_for_status()
+
+                if rsp.status_code == 206:
+                    # Resume: total size is in "bytes first-last/total"
+                    mode = "ab"
+                    total_size = rsp.headers.get("content-range",
+                                                 "").split("/")[-1]
+                else:
+                    # The server sent the whole file
+                    mode = "wb"
+                    offset = 0
+                    total_size = rsp.headers.get("content-length")
+                total_size = (int(total_size)
+                              if total_size and total_size.isdigit()
+                              else None)
+
+                with open(partname, mode) as f:
+                    for chunk in rsp.iter_content(chunk_size=CHUNK_SIZE):
+                        f.write(chunk)
+                        if progress:
+                            progress.update(nbytes=len(chunk))
+
+            size = os.path.getsize(partname)
+            if total_size is not None and size != total_size:
+                raise IOError(f"{file_name} is incomplete ({size} of "
+                              f"{total_size} bytes)")
+            os.replace(partname, filename)
+            if progress:
+                progress.update(done=1)
+            return filename
+
+        except (requests.RequestException, IOError) as err:
+            if isinstance(err, FileNotFoundError):
+                raise
+            if attempt == MAX_RETRIES-1:
+                raise IOError(f"{file_name} failed after {MAX_RETRIES} "
+                              f"attempts: {err}")
+            time.sleep(BACKOFF * 2**attempt)
+
+
+def download_all(file_list, simulation_id, jobs=1, debug=False,
+                 on_complete=None):
+    """
+    Downloads several files from the same simulation, ``jobs`` at a
+    time, over a shared HTTP session.
 
-    # Use a context manager to make an HTTP request and file
-    rsp = requests.get(URL, stream = True)
+    :param file_list: The names of the files to download.
+    :type file_list: list
+    :param simulation_id: The simulation identifier.
+    :type simulation_id: str
+    :param jobs: The number of simultaneous downloads.
+    :type jobs: int
+    :param debug: If True, stop at the first error.
+    :type debug: bool
+    :param on_complete: Function called by the download thread with the
+        path to each downloaded file.
+    :type on_complete: function
+
+    :return: the names of the files that could not be downloaded.
+    """
 
-    # Get the total size, in bytes, from the response header
-    total_size = rsp.headers.get("content-length")
+    def fetch(file_name):
+        filename = download(file_name, simulation_id, session, progress)
+        if on_complete:
+            on_complete(filename)
+
+    jobs = max(min(jobs, len(file_list)), 1)
+    session = new_session(jobs)
+    progress = Progress(len(file_list))
+    failed = []
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(fetch, file_name): file_name
+                   for file_name in file_list}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except (FileNotFoundError, IOError) as err:
+                if debug:
+                    # Do not start the queued downloads, the pool
+                    # only waits for the ones in progress
+                    for pending in futures:
+                        pending.cancel()
+                    raise
+                sys.stdout.write("\n")
+                print(f"{Yellow}ERROR {err}{Nclr}")
+                failed.append(futures[future])
+    sys.stdout.write("\n")
+    session.close()
+    return failed
+
+def convert(filename, type_list, remove=False):
+    """
+    Converts a downloaded Legacy GCM file to MGCM-like files in the
+    same directory: fort.11 files with ``Fort``, and the
+    ``LegacyGCM_*.nc`` files with ``MarsFiles.py --fv3``.
+
+    :param filename: The path to the Legacy GCM file.
+    :type filename: str
+    :param type_list: The MGCM-like file types (``fixed``,
+        ``average``, ``daily``, ``diurn``).
+    :type type_list: list
+    :param remove: If True, delete the Legacy GCM file once converted.
+    :type remove: bool
+
+    :raises: RuntimeError if the conversion fails.
+    """
 
-    if rsp.status_code == 404:
-        print(f"{Yellow}ERROR File not found! Error code: "
-              f"{rsp.status_code}{Nclr}")
-        exit()
+    if filename.endswith(".nc"):
+        marsfiles = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                 "MarsFiles.py")
+        p = subprocess.run([sys.executable, marsfiles, filename,
+                            "-fv3"] + type_list,
+                           cwd=os.path.dirname(filename))
+        if p.returncode != 0:
+            raise RuntimeError(f"MarsFiles.py failed on {filename}")
     else:
-        # Download the data and show a progress bar
-        print(f"{Cyan}Downloading {file_name}...{Nclr}")
-        with open(filename, "wb") as f:
-            downloaded = 0
-            if total_size:
-                # Convert total_size from str to int
-                total_size = int(total_size)
-                # Define the size of the chunk to iterate over (Mb)
-                chunk_size = max(int(total_size/1000), 1024*1024)
-
-            # Iterate over every chunk and calculate % of total_size
-            for chunk in rsp.iter_content(chunk_size=chunk_size):
-                downloaded += len(chunk)
-                f.write(chunk)
-
-                # Calculate current %
-                status = int(50*downloaded/total_size)
-
-                # Print progress to console then flush console
-                sys.stdout.write(f"\r[{'#'*status}{'.'*(50-status)}]")
-                sys.stdout.flush()
-        sys.stdout.write("\n")
+        from amescap.Ncdf_wrapper import Fort
+        f = Fort(filename)
+        if "fixed" in type_list:
+            f.write_to_fixed()
+        if "average" in type_list:
+            f.write_to_average()
+        if "daily" in type_list:
+            f.write_to_daily()
+        if "diurn" in type_list:
+            f.write_to_diurn()
+    if remove:
+        os.remove(filename)
+
+
+def start_converter(type_list, remove=False, maxsize=1):
+    """
+    Starts a thread converting the files put in a queue, one at a
+    time, so the conversion of a file overlaps with the downloads of
+    the next ones. The queue holds at most ``maxsize`` files, after
+    which the downloads wait for the conversion to catch up.
+
+    :param type_list: The MGCM-like file types.
+    :type type_list: list
+    :param remove: If True, delete the Legacy GCM files once converted.
+    :type remove: bool
+    :param maxsize: The number of downloaded files waiting to be
+        converted.
+    :type maxsize: int
+
+    :return: the queue (put None to stop the thread), the thread, and
+        the list to which the names of the failed files are appended.
+    """
+
+    queue = Queue(maxsize=max(maxsize, 1))
+    failed = []
+
+    def worker():
+        while True:
+            filename = queue.get()
+            if filename is None:
+                break
+            try:
+                convert(filename, type_list, remove)
+            except Exception as err:
+                print(f"{Yellow}ERROR Conversion of {filename} failed: "
+                      f"{err}{Nclr}")
+                failed.append(os.path.basename(filename))
+
+    thread = Thread(target=worker)
+    thread.start()
+    return queue, thread, failed
+
 
 # ======================================================================
 #                           MAIN PROGRAM
@@ -221,26 +483,19 @@ def main():
                 i_end += 1
 
         num_files = np.arange(i_start, i_end+1)
-        print(f"{Cyan}Saving {len(num_files)} file(s) to {SAVEDIR}{Nclr}")
 
+        file_list = []
         for n in num_files:
             if simulation_id == "ACTIVECLDS_NCDF":
                 # For netCDF files
-                file_name = (f"LegacyGCM_Ls{ls_0[n]:03d}_Ls{ls_N[n]:03d}.nc")
+                file_list.append(f"LegacyGCM_Ls{ls_0[n]:03d}_Ls{ls_N[n]:03d}.nc")
             else:
                 # For fort.11 files
-                file_name = (f"fort.11_{(670 + n):04d}")
-            
-            # Trigger the file download
-            download(file_name, simulation_id)
+                file_list.append(f"fort.11_{(670 + n):04d}")
 
     elif parser.parse_args().filename:
         # If the user input an ID and a file name
-        file_name_in = np.asarray(parser.parse_args().filename)
-        print(f"{Cyan}Saving {len(file_name_in)} file(s) to {SAVEDIR}{Nclr}")
-        for file_name in file_name_in:
-            # Trigger the file download
-            download(file_name, simulation_id)
+        file_list = list(parser.parse_args().filename)
     else:
         # If the user did not specify Ls or a file name
         print(f"{Yellow}ERROR No file requested. Use ``[-ls --ls]`` or "
@@ -248,6 +503,43 @@ def main():
                  "to download.{Nclr}")
         exit()
 
+    # Start the conversion of the files as they are downloaded
+    on_complete = None
+    if parser.parse_args().convert:
+        type_list = ",".join(parser.parse_args().convert).split(",")
+        type_list = [t for t in type_list if t]
+        for t in type_list:
+            if t not in ["fixed", "average", "daily", "diurn"]:
+                print(f"{Yellow}ERROR {t} is not available, select "
+                      f"'fixed', 'average', 'daily', or 'diurn'{Nclr}")
+                exit()
+        queue, converter, failed_convert = start_converter(
+            type_list, parser.parse_args().remove,
+            maxsize=parser.parse_args().jobs)
+        on_complete = queue.put
+
+    # Trigger the file downloads
+    print(f"{Cyan}Saving {len(file_list)} file(s) to {SAVEDIR}{Nclr}")
+    try:
+        failed = download_all(file_list, simulation_id,
+                              jobs=parser.parse_args().jobs,
+                              debug=parser.parse_args().debug,
+                              on_complete=on_complete)
+    finally:
+        if on_complete:
+            # Wait for the last conversions
+            queue.put(None)
+            converter.join()
+
+    if failed:
+        print(f"{Yellow}ERROR {len(failed)} file(s) could not be "
+              f"downloaded: {' '.join(failed)}{Nclr}")
+    if on_complete and failed_convert:
+        print(f"{Yellow}ERROR {len(failed_convert)} file(s) could not be "
+              f"converted: {' '.join(failed_convert)}{Nclr}")
+    if failed or (on_complete and failed_convert):
+        exit(1)
+
 # ======================================================================
 #                           END OF PROGRAM
 # ======================================================================
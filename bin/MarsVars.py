@@ -2,38 +2,15 @@
 
 # Load generic Python Modules
 import argparse   # parse arguments
+import contextlib # redirect the outputs of the parallel processes
+import io         # capture the outputs of the parallel processes
 import os         # access operating systems function
 import subprocess # run command
 import sys        # system command
+import tempfile   # temporary files of the parallel processes
 import warnings   # suppress certain errors when dealing with NaN arrays
-
-from amescap.FV3_utils import fms_press_calc, fms_Z_calc, dvar_dh, cart_to_azimut_TR
-from amescap.FV3_utils import mass_stream, zonal_detrend, spherical_div, spherical_curl, frontogenesis
-from amescap.Script_utils import check_file_tape, prYellow, prRed, prCyan, prGreen, prPurple, print_fileContent
-from amescap.Script_utils import FV3_file_type, filter_vars, find_fixedfile, get_longname_units, ak_bk_loader
-from amescap.Ncdf_wrapper import Ncdf
-
-# Attempt to import specific scientic modules that may or may not
-# be included in the default Python installation on NAS.
-try:
-    import matplotlib
-    matplotlib.use('Agg')  # Force matplotlib not to use any Xwindows backend.
-    import numpy as np
-    from netCDF4 import Dataset, MFDataset
-
-except ImportError as error_msg:
-    prYellow("Error while importing modules")
-    prYellow('You are using Python version '+str(sys.version_info[0:3]))
-    prYellow('Please source your virtual environment, e.g.:')
-    prCyan('    source envPython3.7/bin/activate.csh \n')
-    print("Error was: " + error_msg.message)
-    exit()
-
-except Exception as exception:
-    # Output unexpected Exceptions
-    print(exception, False)
-    print(exception.__class__.__name__ + ": " + exception.message)
-    exit()
+from functools import partial
+from multiprocessing import Pool
 
 # ======================================================
 #                  ARGUMENT PARSER
@@ -142,9 +119,52 @@ parser.add_argument('-unit', '--unit', type=str, default=None,
 parser.add_argument('-multiply', '--multiply', type=float,
                     default=None, help=argparse.SUPPRESS)               # To be used jointly with --edit
 
+parser.add_argument('-chunk', '--chunk', type=int, default=None,
+                    help="""Process the file by blocks of N timesteps to limit the memory usage. \n"""
+                    """Applies to -add, -zdiff and -col. \n"""
+                    """> Usage: MarsVars ****.atmos_diurn.nc -add Ri -chunk 10 \n"""
+                    """ \n""")
+
+parser.add_argument('-jobs', '--jobs', type=int, default=1,
+                    help="""Number of processes. With several files, the files are processed in parallel. \n"""
+                    """With one file, the independent variables requested with -add are computed in parallel. \n"""
+                    """> Usage: MarsVars *.atmos_average_pstd.nc -add msf rho theta -jobs 8 \n"""
+                    """ \n""")
+
 parser.add_argument('--debug',  action='store_true',
                     help='Debug flag: release the exception')
 
+# Handle --help and the syntax errors before importing the scientific modules so that they return quickly
+if __name__ == '__main__':
+    parser.parse_args()
+
+from amescap.FV3_utils import fms_press_calc, fms_Z_calc, dvar_dh, cart_to_azimut_TR
+from amescap.FV3_utils import mass_stream, zonal_detrend, spherical_div, spherical_curl, frontogenesis
+from amescap.Script_utils import check_file_tape, check_files_tape, prYellow, prRed, prCyan, prGreen, prPurple, print_fileContent
+from amescap.Script_utils import FV3_file_type, filter_vars, find_fixedfile, get_longname_units, ak_bk_loader
+from amescap.Ncdf_wrapper import Ncdf
+
+# Attempt to import specific scientic modules that may or may not
+# be included in the default Python installation on NAS.
+try:
+    import numpy as np
+    from netCDF4 import Dataset, MFDataset
+
+except ImportError as error_msg:
+    prYellow("Error while importing modules")
+    prYellow('You are using Python version '+str(sys.version_info[0:3]))
+    prYellow('Please source your virtual environment, e.g.:')
+    prCyan('    source envPython3.7/bin/activate.csh \n')
+    print("Error was: " + error_msg.message)
+    exit()
+
+except Exception as exception:
+    # Output unexpected Exceptions
+    print(exception, False)
+    print(exception.__class__.__name__ + ": " + exception.message)
+    exit()
+
+
 # =====================================================================
 # This is a list of the supported variables for --add (short name, longname, units)
 # =====================================================================
@@ -231,8 +251,10 @@ def compute_p_3D(ps, ak, bk, shape_out):
     as (1, lev, lat, lon) not (lev, lat, lon)
     """
     p_3D = fms_press_calc(ps, ak, bk, lev_type='full')
+    # Restore the singleton dimensions removed by fms_press_calc (e.g. time = 1)
+    p_3D = p_3D.reshape((len(ak)-1,)+ps.shape)
     # p_3D [lev, tim, lat, lon] ->[tim, lev, lat, lon]
-    p_3D = p_3D.transpose(lev_T)
+    p_3D = p_3D.transpose(lev_T_out)
     return p_3D.reshape(shape_out)
 
 # =====================================================================
@@ -348,8 +370,9 @@ def compute_zfull(ps, ak, bk, temp):
     Returns the altitude of the layer midpoints AGL in [m].
     """
     dim_out = temp.shape
-    zfull = fms_Z_calc(ps, ak, bk, temp.transpose(
-        lev_T), topo=0., lev_type='full')  # (lev, time, tod, lat, lon)
+    # temp [tim, tod, lev, lat, lon] -> [lev, tim, tod, lat, lon]
+    zfull = fms_Z_calc(ps, ak, bk, np.moveaxis(temp, -3, 0),
+                       topo=0., lev_type='full')  # (lev, time, tod, lat, lon)
     # p_3D [lev, tim, lat, lon] -> [tim, lev, lat, lon]
     # temp [tim, tod, lev, lat, lon, lev] -> [lev, time, tod,lat, lon]
     zfull = zfull.transpose(lev_T_out)
@@ -362,8 +385,8 @@ def compute_zhalf(ps, ak, bk, temp):
     """
     dim_out = temp.shape
     # temp: [tim, lev, lat, lon, lev] ->[lev, time,  lat,  lon]
-    zhalf = fms_Z_calc(ps, ak, bk, temp.transpose(
-        lev_T), topo=0., lev_type='half')
+    zhalf = fms_Z_calc(ps, ak, bk, np.moveaxis(temp, -3, 0),
+                       topo=0., lev_type='half')
     # p_3D [lev+1, tim, lat, lon] ->[tim, lev+1, lat, lon]
     zhalf = zhalf.transpose(lev_T_out)
     return zhalf
@@ -456,9 +479,11 @@ def compute_DP_3D(ps, ak, bk, shape_out):
     Returns the thickness of a layer in [Pa].
     """
     p_half3D = fms_press_calc(ps, ak, bk, lev_type='half')  # [lev, tim, lat, lon]
+    # Restore the singleton dimensions removed by fms_press_calc (e.g. time = 1)
+    p_half3D = p_half3D.reshape((len(ak),)+ps.shape)
     DP_3D = p_half3D[1:, ..., ] - p_half3D[0:-1, ...]
     # p_3D [lev, tim, lat, lon] ->[tim, lev, lat, lon]
-    DP_3D = DP_3D.transpose(lev_T)
+    DP_3D = DP_3D.transpose(lev_T_out)
     out = DP_3D.reshape(shape_out)
     return out
 
@@ -467,12 +492,13 @@ def compute_DZ_3D(ps, ak, bk, temp, shape_out):
     """
     Returns the layer thickness in [Pa].
     """
-    z_half3D = fms_Z_calc(ps, ak, bk, temp.transpose(
-        lev_T), topo=0., lev_type='half')
+    # temp [tim, tod, lev, lat, lon] -> [lev, tim, tod, lat, lon]
+    z_half3D = fms_Z_calc(ps, ak, bk, np.moveaxis(temp, -3, 0),
+                          topo=0., lev_type='half')
     # Note the reversed order: Z decreases with increasing levels
     DZ_3D = z_half3D[0:-1, ...]-z_half3D[1:, ..., ]
     # DZ_3D [lev, tim, lat, lon] ->[tim, lev, lat, lon]
-    DZ_3D = DZ_3D.transpose(lev_T)
+    DZ_3D = DZ_3D.transpose(lev_T_out)
     out = DZ_3D.reshape(shape_out)
     return out
 
@@ -520,15 +546,585 @@ def compute_WMFF(MF, rho, lev, interp_type):
         # computation does not need the above multiplier.
         return -1/rho*darr_dz
 
+# =====================================================================
+def compute_p_3D_pstd(pstd, lev_axis, shape_out):
+    """
+    Returns the pressure field of a file interpolated to standard pressure,
+    as a broadcastable array, e.g. (1, lev, 1, 1).
+    """
+    reshape_shape = [1 for i in range(0, len(shape_out))]  # (0 1 2 3)
+    reshape_shape[lev_axis] = len(pstd)                   # e.g [1, 28, 1, 1]
+    return pstd.reshape(reshape_shape)
+
+# =====================================================================
+def compute_Ri(N, ucomp, vcomp, zfull):
+    """
+    Returns the Richardson number.
+    """
+    du_dz = dvar_dh(ucomp.transpose(lev_T),
+                    zfull.transpose(lev_T)).transpose(lev_T)
+    dv_dz = dvar_dh(vcomp.transpose(lev_T),
+                    zfull.transpose(lev_T)).transpose(lev_T)
+    return N**2/(du_dz**2+dv_dz**2)
+
+# =====================================================================
+def compute_msf(vcomp, lat, lev, f_type, interp_type):
+    """
+    Returns the mass stream function in [1.e8 x kg/s].
+    """
+    if f_type == 'diurn':
+        # [lev, lat, time, tod, lon] -> [time, tod, lev, lat, lon]
+        # (0 1 2 3 4) -> (2 3 0 1 4) -> (2 3 0 1 4)
+        return mass_stream(vcomp.transpose([2, 3, 0, 1, 4]), lat, lev,
+                           type=interp_type).transpose([2, 3, 0, 1, 4])
+    else:
+        # [time, lev, lat, lon] -> [lev, lat, lon, time]  ->  [time, lev, lat, lon]
+        # (0 1 2 3) -> (1 2 3 0) -> (3 0 1 2)
+        return mass_stream(vcomp.transpose([1, 2, 3, 0]), lat, lev,
+                           type=interp_type).transpose([3, 0, 1, 2])
+
+# =====================================================================
+def time_blocks(fileNC, chunk=None):
+    """
+    Returns the slices used to process a file by blocks of 'chunk' timesteps
+    along the time axis, or one slice over the whole file if chunk is None.
+
+    *** NOTE***
+    fms_press_calc() handles a surface pressure with a leading dimension of
+    length 1 like a scalar, so the blocks include at least 2 timesteps: the
+    last block is merged with the previous one if needed.
+    """
+    if not chunk or 'time' not in fileNC.dimensions.keys():
+        return [slice(None)]
+    nt = len(fileNC.dimensions['time'])
+    chunk = max(chunk, 2)
+    starts = list(range(0, nt, chunk))
+    if len(starts) > 1 and nt-starts[-1] < 2:
+        starts.pop()
+    return [slice(t0, t1) for t0, t1 in zip(starts, starts[1:]+[nt])]
+
+# =====================================================================
+def read_block(fileNC, varname, time_slice=slice(None)):
+    """
+    Returns the content of a variable over a block of the time axis.
+    Variables without a time dimension are returned whole.
+    """
+    var_Ncdf = fileNC.variables[varname]
+    if 'time' in var_Ncdf.dimensions[0:1]:
+        return var_Ncdf[time_slice]
+    return var_Ncdf[:]
+
+# =====================================================================
+def read_first_available(fileNC, var_list, time_slice=slice(None)):
+    """
+    Returns the content of the first variable of var_list found in the file,
+    e.g. ['dst_mass_micro', 'dst_mass'].
+    """
+    for ivar in var_list:
+        if ivar in fileNC.variables.keys():
+            return read_block(fileNC, ivar, time_slice)
+    raise KeyError('none of %s found in file' % (var_list))
+
+# =====================================================================
+# =====================================================================
+# =====================================================================
+
+# =====================================================================
+# Recipes for the variables in VAR and the intermediate fields they require.
+# Each entry is [inputs, function]: the inputs are resolved and passed to the
+# function in the same order. An input is computed from its own recipe if it
+# has one and is not already in the file, and is read from the file otherwise.
+# Recipes that depend on the vertical grid are given as a dictionary keyed by
+# interp_type, with 'default' for the grids not listed.
+# 'fileNC', 'f_type', 'interp_type' and 'lev_axis' are set for each file,
+# 'time_slice' and 'shape_out' for each block of the time axis.
+# =====================================================================
+RECIPES = {
+    # ~~~~~~~~~~~~~~~~~~~~~~ Intermediate fields ~~~~~~~~~~~~~~~~~~~~~~~
+    'lev':          [['fileNC', 'interp_type'],
+                     lambda f, interp_type: f.variables[interp_type][:]],
+    'ak_bk':        {'pfull': [['fileNC'], ak_bk_loader]},
+    'p_3D':         {'pfull': [['ps', 'ak_bk', 'shape_out'],
+                               lambda ps, ak_bk, shape_out: compute_p_3D(ps, ak_bk[0], ak_bk[1], shape_out)],
+                     'pstd': [['lev', 'lev_axis', 'shape_out'], compute_p_3D_pstd],
+                     # 'zstd' and 'zagl' require 'pfull3D' to be added before the interpolation
+                     'default': [['fileNC', 'time_slice'],
+                                 lambda f, tslice: read_first_available(f, ['pfull3D'], tslice)]},
+    'wind_polar':   [['ucomp', 'vcomp'],
+                     lambda u, v: cart_to_azimut_TR(u, v, mode='from')],
+    'q_dst':        [['fileNC', 'time_slice'],
+                     lambda f, tslice: read_first_available(f, ['dst_mass_micro', 'dst_mass'], tslice)],
+    'n_dst':        [['fileNC', 'time_slice'],
+                     lambda f, tslice: read_first_available(f, ['dst_num_micro', 'dst_num'], tslice)],
+    'q_ice':        [['fileNC', 'time_slice'],
+                     lambda f, tslice: read_first_available(f, ['ice_mass_micro', 'ice_mass'], tslice)],
+
+    # ~~~~~~~~~~~~~~~~~~~~~~ Non-interpolated files ~~~~~~~~~~~~~~~~~~~~
+    'dzTau':        [['q_dst', 'temp', 'lev', 'f_type'],
+                     lambda q, temp, lev, f_type: compute_xzTau(q, temp, lev, C_dst, f_type)],
+    'izTau':        [['q_ice', 'temp', 'lev', 'f_type'],
+                     lambda q, temp, lev, f_type: compute_xzTau(q, temp, lev, C_ice, f_type)],
+    'dst_mass_micro': [['dzTau', 'temp', 'lev', 'f_type'],
+                     lambda xTau, temp, lev, f_type: compute_mmr(xTau, temp, lev, C_dst, f_type)],
+    'ice_mass_micro': [['izTau', 'temp', 'lev', 'f_type'],
+                     lambda xTau, temp, lev, f_type: compute_mmr(xTau, temp, lev, C_ice, f_type)],
+    'Vg_sed':       [['q_dst', 'n_dst', 'temp'], compute_Vg_sed],
+    'w_net':        [['Vg_sed', 'w'], compute_w_net],
+    'pfull3D':      [['p_3D'], lambda p_3D: p_3D],
+    'DP':           [['ps', 'ak_bk', 'shape_out'],
+                     lambda ps, ak_bk, shape_out: compute_DP_3D(ps, ak_bk[0], ak_bk[1], shape_out)],
+    'rho':          [['p_3D', 'temp'], compute_rho],
+    'theta':        [['p_3D', 'ps', 'temp', 'f_type'], compute_theta],
+    'w':            [['rho', 'omega'], compute_w],
+    # TODO 'zfull', 'N', 'Ri' and 'scorer_wl' are incompatible with 'pstd' files
+    'zfull':        [['ps', 'ak_bk', 'temp'],
+                     lambda ps, ak_bk, temp: compute_zfull(ps, ak_bk[0], ak_bk[1], temp)],
+    'DZ':           [['ps', 'ak_bk', 'temp', 'shape_out'],
+                     lambda ps, ak_bk, temp, shape_out: compute_DZ_3D(ps, ak_bk[0], ak_bk[1], temp, shape_out)],
+    'wdir':         [['wind_polar'], lambda wind_polar: wind_polar[0]],
+    'wspeed':       [['wind_polar'], lambda wind_polar: wind_polar[1]],
+    'N':            [['theta', 'zfull'], compute_N],
+    'Ri':           [['N', 'ucomp', 'vcomp', 'zfull'], compute_Ri],
+    'Tco2':         [['p_3D', 'temp'], compute_Tco2],
+    'scorer_wl':    [['N', 'ucomp', 'zfull'], compute_scorer],
+    'div':          [['ucomp', 'vcomp', 'lon', 'lat'],
+                     lambda u, v, lon, lat: spherical_div(u, v, lon, lat, R=3400*1000., spacing='regular')],
+    'curl':         [['ucomp', 'vcomp', 'lon', 'lat'],
+                     lambda u, v, lon, lat: spherical_curl(u, v, lon, lat, R=3400*1000., spacing='regular')],
+    'fn':           [['ucomp', 'vcomp', 'theta', 'lon', 'lat'],
+                     lambda u, v, theta, lon, lat: frontogenesis(u, v, theta, lon, lat, R=3400*1000., spacing='regular')],
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~ Interpolated files ~~~~~~~~~~~~~~~~~~~~~~
+    'msf':          [['vcomp', 'lat', 'lev', 'f_type', 'interp_type'], compute_msf],
+    'ep':           [['temp'], compute_Ep],
+    'ek':           [['ucomp', 'vcomp'], compute_Ek],
+    'mx':           [['ucomp', 'w'], compute_MF],
+    'my':           [['vcomp', 'w'], compute_MF],
+    'ax':           [['mx', 'rho', 'lev', 'interp_type'], compute_WMFF],
+    'ay':           [['my', 'rho', 'lev', 'interp_type'], compute_WMFF],
+    'tp_t':         [['temp'], lambda temp: zonal_detrend(temp)/temp],
+}
+
+# =====================================================================
+def get_recipe(name, interp_type):
+    """
+    Returns the [inputs, function] recipe of a variable for this vertical grid.
+    """
+    recipe = RECIPES[name]
+    if isinstance(recipe, dict):
+        if interp_type in recipe:
+            return recipe[interp_type]
+        if 'default' in recipe:
+            return recipe['default']
+        raise ValueError("'%s' cannot be derived on '%s' files" % (name, interp_type))
+    return recipe
+
+# =====================================================================
+def plan_add_list(add_list, file_vars, interp_type, known):
+    """
+    Resolves the dependency graph of the variables to be added.
+    Args:
+        add_list:    the variables to add, in the order requested
+        file_vars:   the variables already present in the file
+        interp_type: the vertical grid of the file, e.g. 'pfull' or 'pstd'
+        known:       the names already available (e.g. 'f_type')
+    Returns:
+        order:    a list of [name, inputs] in evaluation order.
+                  inputs is None for a variable read from the file.
+        refcount: the number of pending consumers of each name
+    """
+    order = []
+    refcount = {}
+    done = set(known)
+    visiting = set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError("circular dependency on '%s'" % (name))
+        visiting.add(name)
+        if name in RECIPES and (name in add_list or name not in file_vars):
+            inputs = get_recipe(name, interp_type)[0]
+            for iname in inputs:
+                visit(iname)
+                refcount[iname] = refcount.get(iname, 0)+1
+        else:
+            inputs = None
+        visiting.remove(name)
+        done.add(name)
+        order.append([name, inputs])
+
+    for ivar in add_list:
+        visit(ivar)
+    return order, refcount
+
+# =====================================================================
+def check_add_list(fileNC, ifile, add_list):
+    """
+    Returns the variables of add_list that are supported and not already in
+    the file, without duplicates.
+    """
+    request_list = []
+    for ivar in add_list:
+        if ivar not in VAR.keys():
+            prRed("Variable '%s' is not supported and cannot be added to the file. " % (ivar))
+        elif ivar in fileNC.variables.keys():
+            prYellow("""***Error*** Variable already exists in file.""")
+            prYellow(
+                """Delete the existing variables %s with 'MarsVars.py %s -rm %s'""" % (ivar, ifile, ivar))
+        elif ivar not in request_list:
+            request_list.append(ivar)
+    return request_list
+
+# =====================================================================
+def plan_file_add_list(fileNC, request_list):
+    """
+    Resolves the dependency graph of the variables to add in this file.
+    Returns:
+        memo:           the values set for the whole file
+        order:          a list of [name, inputs] in evaluation order
+        refcount:       the number of pending consumers of each name
+        varies_in_time: the names that change from one block of the time axis
+                        to the next. The others (e.g. 'lev', 'ak_bk') are
+                        computed once for the whole file.
+        failed:         the variables of request_list that cannot be planned,
+                        with the exception raised
+    """
+    f_type, interp_type = FV3_file_type(fileNC)
+    # In 'diurn' file, 'level' is the 3rd axis: (time, tod, lev, lat, lon)
+    # In 'average' and 'daily' files, 'level' is the 2nd axis: (time, lev, lat, lon)
+    lev_axis = 2 if f_type == 'diurn' else 1
+
+    memo = {'fileNC': fileNC, 'f_type': f_type, 'interp_type': interp_type,
+            'lev_axis': lev_axis}
+    seeds = set(memo.keys()) | set(['time_slice', 'shape_out'])
+
+    # Plan each variable on its own first, so that a variable that cannot be
+    # derived on this file does not prevent adding the others
+    failed = {}
+    for ivar in request_list:
+        try:
+            plan_add_list([ivar], fileNC.variables.keys(), interp_type, seeds)
+        except Exception as exception:
+            failed[ivar] = exception
+    order, refcount = plan_add_list(
+        [ivar for ivar in request_list if ivar not in failed],
+        fileNC.variables.keys(), interp_type, seeds)
+
+    varies_in_time = set(['time_slice', 'shape_out'])
+    for name, inputs in order:
+        if inputs is None:
+            if 'time' in fileNC.variables[name].dimensions[0:1]:
+                varies_in_time.add(name)
+        elif any(iname in varies_in_time for iname in inputs):
+            varies_in_time.add(name)
+    return memo, order, refcount, varies_in_time, failed
+
+# =====================================================================
+def evaluate_add_list(fileNC, request_list, debug=False, chunk=None):
+    """
+    Computes the variables in request_list, yielding the result for each
+    block of the time axis as (name, time_slice, OUT, last).
+    The inputs are read only once and each intermediate field is computed
+    only once, then released as soon as no remaining variable requires it.
+    Args:
+        fileNC:       the Netcdf file
+        request_list: the variables to add, e.g. ['rho', 'theta', 'N']
+        debug:        if True, release the exceptions
+        chunk:        if provided, evaluate the variables by blocks of
+                      'chunk' timesteps to limit the memory usage
+    """
+    # An array to swap vertical axis forward and backward:
+    # [1, 0, 2, 3]    for [time, lev, lat, lon]      and
+    # [2, 1, 0, 3, 4] for [time, tod, lev, lat, lon]
+    global lev_T
+    global lev_T_out  # Reshape in 'zfull' and 'zhalf' calculation
+
+    try:
+        memo, order, refcount0, varies_in_time, failed = plan_file_add_list(
+            fileNC, request_list)
+    except Exception as exception:
+        if debug:
+            raise
+        prRed('***Error*** %s' % (exception))
+        return
+    for name in request_list:
+        if name in failed:
+            if debug:
+                raise failed[name]
+            prRed("***Error*** '%s' could not be computed, %s" % (name, failed[name]))
+    request_list = [name for name in request_list if name not in failed]
+    interp_type = memo['interp_type']
+    seeds = set(memo.keys()) | set(['time_slice', 'shape_out'])
+
+    # 'temp' and 'ps' are always required
+    # Get dimension
+    shape_in = fileNC.variables['temp'].shape
+    if memo['f_type'] == 'diurn':
+        # [time, tod, lev, lat, lon] -> [lev, tod, time, lat, lon] -> [time, tod, lev, lat, lon]
+        lev_T = [2, 1, 0, 3, 4]
+        # (0 1 2 3 4) -> (2 1 0 3 4) -> (2 1 0 3 4)
+        lev_T_out = [1, 2, 0, 3, 4]
+    else:
+        # [tim, lev, lat, lon] -> [lev, time, lat, lon] -> [tim, lev, lat, lon]
+        lev_T = [1, 0, 2, 3]
+        # (0 1 2 3) -> (1 0 2 3) -> (1 0 2 3)
+        lev_T_out = lev_T
+
+    blocks = time_blocks(fileNC, chunk)
+    for time_slice in blocks:
+        for name in varies_in_time:
+            memo.pop(name, None)
+        memo['time_slice'] = time_slice
+        memo['shape_out'] = (len(range(*time_slice.indices(shape_in[0]))),)+tuple(shape_in[1:])
+        refcount = refcount0.copy()
+
+        for name, inputs in order:
+            if name in memo:
+                # Computed for an earlier block and constant in time
+                continue
+            if name in request_list and time_slice.start in [None, 0]:
+                print('Processing: %s...' % (name))
+            try:
+                if name in failed:
+                    raise failed[name]
+                if inputs is None:
+                    memo[name] = read_block(fileNC, name, time_slice)
+                else:
+                    missing = [iname for iname in inputs if iname in failed]
+                    if missing:
+                        raise ValueError("requires '%s': %s" % (missing[0], failed[missing[0]]))
+                    function = get_recipe(name, interp_type)[1]
+                    memo[name] = function(*[memo[iname] for iname in inputs])
+            except Exception as exception:
+                if debug:
+                    raise
+                if name not in failed and name in request_list:
+                    prRed("***Error*** '%s' could not be computed, %s" % (name, exception))
+                failed[name] = exception
+
+            # Release the inputs that are no longer needed
+            for iname in inputs or []:
+                refcount[iname] -= 1
+                if refcount[iname] == 0 and iname in varies_in_time and iname not in seeds:
+                    memo.pop(iname, None)
+
+            if name in request_list and name not in failed:
+                # Work on a copy, 'OUT' may still be needed by other variables
+                OUT = memo[name].copy()
+
+                # Filter out NANs in the native files
+                if interp_type == 'pfull':
+                    OUT[np.isnan(OUT)] = fill_value
+
+                # Add NANs to the interpolated files
+                else:
+                    with warnings.catch_warnings():
+                        warnings.simplefilter("ignore", category=RuntimeWarning)
+                        OUT[OUT > 1.e30] = np.NaN
+                        OUT[OUT < -1.e30] = np.NaN
+
+                yield name, time_slice, OUT, time_slice is blocks[-1]
+                del OUT
+
+            if refcount.get(name, 0) == 0 and name in varies_in_time:
+                memo.pop(name, None)
+
+# =====================================================================
+def log_add_variable(fileNC, name, time_slice, OUT, last=True, dim_out=None,
+                     long_name=None, units=None):
+    """
+    Logs a block of an added variable in a file opened in append mode.
+    The blocks are logged in a variable 'name_incomplete', created on the
+    first call with the dimensions dim_out (those of 'temp' by default) and
+    renamed 'name' after the last block. If a block fails, the partial
+    variable is not mistaken for a complete one, and is overwritten on the
+    next run.
+    """
+    tmpname = name+'_incomplete'
+    if tmpname not in fileNC.variables.keys():
+        if name in fileNC.variables.keys():
+            # Same error as createVariable()
+            raise RuntimeError('NetCDF: String match to name in use')
+        # 'temp' and 'ps' are always required
+        if dim_out is None:
+            dim_out = fileNC.variables['temp'].dimensions
+        var_Ncdf = fileNC.createVariable(tmpname, 'f4', dim_out)
+        var_Ncdf.long_name = VAR[name][0] if long_name is None else long_name
+        var_Ncdf.units = VAR[name][1] if units is None else units
+    fileNC.variables[tmpname][time_slice] = OUT
+    if last:
+        fileNC.renameVariable(tmpname, name)
+
+# =====================================================================
+def add_variables(fileNC, ifile, add_list, debug=False, chunk=None):
+    """
+    Computes the variables in add_list and logs them in an opened file.
+    Args:
+        fileNC:   the Netcdf file, opened in append mode
+        ifile:    the file name (for the messages)
+        add_list: the variables to add, e.g. ['rho', 'theta', 'N']
+        debug:    if True, release the exceptions
+        chunk:    if provided, evaluate and log the variables by blocks of
+                  'chunk' timesteps to limit the memory usage
+    Returns:
+        the variables of add_list that could not be added
+    """
+    request_list = check_add_list(fileNC, ifile, add_list)
+    done = []
+    for name, time_slice, OUT, last in evaluate_add_list(fileNC, request_list, debug, chunk):
+        log_add_variable(fileNC, name, time_slice, OUT, last)
+        if last:
+            print('%s: \033[92mDone\033[00m' % (name))
+            done.append(name)
+    for name in request_list:
+        if name+'_incomplete' in fileNC.variables.keys():
+            prYellow("'%s' is incomplete and was kept as '%s_incomplete', it will be overwritten on the next run" % (name, name))
+    return [ivar for ivar in dict.fromkeys(add_list) if ivar not in done]
+
+# =====================================================================
+def group_add_list(fileNC, request_list):
+    """
+    Splits the variables to add into groups that can be computed
+    independently: two variables are in the same group if one requires
+    the other or if they share a derived field that changes in time
+    (e.g. 'rho' and 'theta' both use 'p_3D'). Inputs read from the file and
+    fields constant in time (e.g. 'lev', 'ak_bk') are not shared.
+    """
+    memo, order, refcount, varies_in_time, failed = plan_file_add_list(
+        fileNC, request_list)
+
+    # Union-find over the derived fields
+    parent = {}
+
+    def find(name):
+        while parent.setdefault(name, name) != name:
+            name = parent[name]
+        return name
+
+    for name, inputs in order:
+        for iname in inputs or []:
+            if iname in varies_in_time and iname in parent:
+                parent[find(iname)] = find(name)
+        if inputs is not None:
+            find(name)
+
+    groups = {}
+    for ivar in request_list:
+        groups.setdefault(find(ivar), []).append(ivar)
+    return list(groups.values())
+
+# =====================================================================
+def compute_add_group(ifile, group, tmpfile, debug=False, chunk=None):
+    """
+    Computes a group of variables from a file opened in read mode, and logs
+    them block by block in a temporary file.
+    Returns:
+        the variables of the group that were added to the temporary file,
+        and the printed messages
+    """
+    output = io.StringIO()
+    done = []
+    with contextlib.redirect_stdout(output):
+        fileNC = Dataset(ifile, 'r', format='NETCDF4_CLASSIC')
+        tmpNC = Dataset(tmpfile, 'w', format='NETCDF4_CLASSIC')
+        try:
+            # 'temp' and 'ps' are always required
+            dim_out = fileNC.variables['temp'].dimensions
+            for dname in dim_out:
+                tmpNC.createDimension(dname, len(fileNC.dimensions[dname]))
+            for name, time_slice, OUT, last in evaluate_add_list(fileNC, group, debug, chunk):
+                log_add_variable(tmpNC, name, time_slice, OUT, last, dim_out)
+                if last:
+                    done.append(name)
+        except SystemExit:
+            # Exiting would kill the worker and leave the pool waiting for its result
+            pass
+        finally:
+            tmpNC.close()
+            fileNC.close()
+    return done, output.getvalue()
+
+# =====================================================================
+def add_variables_parallel(ifile, add_list, debug=False, chunk=None, jobs=1):
+    """
+    Computes the independent groups of variables in add_list in a pool of
+    'jobs' processes. Each process logs its variables in a temporary file,
+    which are then copied block by block to the file from this process so
+    that the file has a single writer.
+    Returns:
+        the variables of add_list that could not be added
+    """
+    fileNC = Dataset(ifile, 'r', format='NETCDF4_CLASSIC')
+    try:
+        request_list = check_add_list(fileNC, ifile, add_list)
+        groups = group_add_list(fileNC, request_list)
+    except Exception as exception:
+        if debug:
+            raise
+        prRed('***Error*** %s' % (exception))
+        return list(dict.fromkeys(add_list))
+    finally:
+        fileNC.close()
+
+    if len(groups) < 2 or jobs < 2:
+        fileNC = Dataset(ifile, 'a', format='NETCDF4_CLASSIC')
+        failed = add_variables(fileNC, ifile, add_list, debug, chunk)
+        fileNC.close()
+        return failed
+
+    # The readers must be done before the file is opened in append mode.
+    # The temporary files have unique names so they never replace a user file.
+    tmpfiles = []
+    for igroup in range(len(groups)):
+        fd, tmpfile = tempfile.mkstemp(suffix='.nc', prefix=os.path.basename(ifile)[:-3]+'_tmp%i_' % (igroup),
+                                       dir=os.path.dirname(os.path.abspath(ifile)))
+        os.close(fd)
+        tmpfiles.append(tmpfile)
+    done = []
+    try:
+        with Pool(min(jobs, len(groups))) as pool:
+            results = pool.starmap(compute_add_group,
+                                   [(ifile, group, tmpfile, debug, chunk)
+                                    for group, tmpfile in zip(groups, tmpfiles)])
+
+        fileNC = Dataset(ifile, 'a', format='NETCDF4_CLASSIC')
+        for tmpfile, (group_done, output) in zip(tmpfiles, results):
+            sys.stdout.write(output)
+            tmpNC = Dataset(tmpfile, 'r', format='NETCDF4_CLASSIC')
+            blocks = time_blocks(tmpNC, chunk)
+            for name in group_done:
+                for time_slice in blocks:
+                    log_add_variable(fileNC, name, time_slice,
+                                     read_block(tmpNC, name, time_slice),
+                                     time_slice is blocks[-1])
+                print('%s: \033[92mDone\033[00m' % (name))
+                done.append(name)
+            tmpNC.close()
+        fileNC.close()
+    finally:
+        for tmpfile in tmpfiles:
+            if os.path.exists(tmpfile):
+                os.remove(tmpfile)
+    return [ivar for ivar in dict.fromkeys(add_list) if ivar not in done]
+
 # =====================================================================
 # =====================================================================
 # =====================================================================
 
 filepath = os.getcwd()
 
-def main():
-    # Load all the .nc files
-    file_list       = parser.parse_args().input_file
+def process_file(ifile, jobs=1):
+    """
+    Performs the requested operations on one file.
+    Args:
+        ifile: the file name
+        jobs:  if > 1, the number of processes used to add independent
+               variables in parallel
+    Returns:
+        the errors on individual variables, which do not stop the processing
+    """
     add_list        = parser.parse_args().add
     zdiff_list      = parser.parse_args().zdiff
     zdetrend_list   = parser.parse_args().zonal_detrend
@@ -539,6 +1135,7 @@ def main():
     extract_list    = parser.parse_args().extract
     edit_var        = parser.parse_args().edit
     debug           = parser.parse_args().debug
+    chunk           = parser.parse_args().chunk
 
     # An array to swap vertical axis forward and backward:
     # [1, 0, 2, 3]    for [time, lev, lat, lon]      and
@@ -546,391 +1143,138 @@ def main():
     global lev_T
     global lev_T_out  # Reshape in 'zfull' and 'zhalf' calculation
 
-    # Check if an operation is requested. Otherwise, print file content.
-    if not (add_list or zdiff_list or zdetrend_list or remove_list or col_list or extract_list or dp_to_dz_list or dz_to_dp_list or edit_var):
-        print_fileContent(file_list[0])
-        prYellow(''' ***Notice***  No operation requested. Use '-add', '-zdiff', '-zd', '-col', '-dp_to_dz', '-rm' '-edit' ''')
-        exit()  # Exit cleanly
-
-    # For all the files
-    for ifile in file_list:
-        # First check if file is on the disk (Lou only)
-        check_file_tape(ifile)
-
-        # =================================================================
-        # ========================= Remove ================================
-        # =================================================================
-        if remove_list:
-            cmd_txt = 'ncks --version'
-            try:
-                # If ncks is available, use it
-                subprocess.check_call(cmd_txt, shell=True, stdout=open(
-                    os.devnull, "w"), stderr=open(os.devnull, "w"))
-                print('ncks is available. Using it.')
-                for ivar in remove_list:
-                    print('Creating new file %s without %s:' % (ifile, ivar))
-                    cmd_txt = 'ncks -C -O -x -v %s %s %s' % (
-                        ivar, ifile, ifile)
-                    try:
-                        subprocess.check_call(cmd_txt, shell=True, stdout=open(
-                            os.devnull, "w"), stderr=open(os.devnull, "w"))
-                    except Exception as exception:
-                        print(exception.__class__.__name__ +
-                              ": " + exception.message)
-            except subprocess.CalledProcessError:
-                # ncks is not available, use internal method
-                print('Using internal method instead.')
-                f_IN = Dataset(ifile, 'r', format='NETCDF4_CLASSIC')
-                ifile_tmp = ifile[:-3]+'_tmp'+'.nc'
-                Log = Ncdf(ifile_tmp, 'Edited postprocess')
-                Log.copy_all_dims_from_Ncfile(f_IN)
-                Log.copy_all_vars_from_Ncfile(f_IN, remove_list)
-                f_IN.close()
-                Log.close()
-                cmd_txt = 'mv '+ifile_tmp+' '+ifile
-                p = subprocess.run(
-                    cmd_txt, universal_newlines=True, shell=True)
-                prCyan(ifile+' was updated')
-
-        # =================================================================
-        # ======================== Extract ================================
-        # =================================================================
-        if extract_list:
+    # Errors on individual variables, reported at the end of the run
+    errors = []
+
+    # First check if file is on the disk (Lou only)
+    check_file_tape(ifile)
+    if not os.path.exists(ifile):
+        raise FileNotFoundError("No such file: '%s'" % (ifile))
+
+    # =================================================================
+    # ========================= Remove ================================
+    # =================================================================
+    if remove_list:
+        cmd_txt = 'ncks --version'
+        try:
+            # If ncks is available, use it
+            subprocess.check_call(cmd_txt, shell=True, stdout=open(
+                os.devnull, "w"), stderr=open(os.devnull, "w"))
+            print('ncks is available. Using it.')
+            for ivar in remove_list:
+                print('Creating new file %s without %s:' % (ifile, ivar))
+                cmd_txt = 'ncks -C -O -x -v %s %s %s' % (
+                    ivar, ifile, ifile)
+                try:
+                    subprocess.check_call(cmd_txt, shell=True, stdout=open(
+                        os.devnull, "w"), stderr=open(os.devnull, "w"))
+                except Exception as exception:
+                    print(exception.__class__.__name__ +
+                          ": " + exception.message)
+        except subprocess.CalledProcessError:
+            # ncks is not available, use internal method
+            print('Using internal method instead.')
             f_IN = Dataset(ifile, 'r', format='NETCDF4_CLASSIC')
-            exclude_list = filter_vars(f_IN, parser.parse_args(
-            ).extract, giveExclude=True)  # The variable to exclude
-            print()
-            ifile_tmp = ifile[:-3]+'_extract.nc'
-            Log = Ncdf(ifile_tmp, 'Edited in postprocessing')
+            ifile_tmp = ifile[:-3]+'_tmp'+'.nc'
+            Log = Ncdf(ifile_tmp, 'Edited postprocess')
             Log.copy_all_dims_from_Ncfile(f_IN)
-            Log.copy_all_vars_from_Ncfile(f_IN, exclude_list)
+            Log.copy_all_vars_from_Ncfile(f_IN, remove_list)
             f_IN.close()
             Log.close()
-            prCyan(ifile+' was created')
-
-        # =================================================================
-        # ============================ Add ================================
-        # =================================================================
-        # If the list is not empty, load ak and bk for thepressure calculation.
-        # ak and bk are always needed.
-
-        # Check if the variable to be added is currently supported.
-        for ivar in add_list:
-            if ivar not in VAR.keys():
-                prRed("Variable '%s' is not supported and cannot be added to the file. " % (ivar))
-            else:
-                print('Processing: %s...' % (ivar))
-                try:
-                    fileNC = Dataset(ifile, 'a', format='NETCDF4_CLASSIC')
-                    f_type, interp_type = FV3_file_type(fileNC)
-                    # Load ak and bk for pressure calculation. Usually required.
-                    if interp_type == 'pfull':
-                        ak, bk = ak_bk_loader(fileNC)
-                    # 'temp' and 'ps' always required
-                    # Get dimension
-                    dim_out = fileNC.variables['temp'].dimensions
-                    temp = fileNC.variables['temp'][:]
-                    shape_out = temp.shape
-                    if f_type == 'diurn':
-                        # [time, tod, lev, lat, lon] -> [lev, tod, time, lat, lon] -> [time, tod, lev, lat, lon]
-                        lev_T = [2, 1, 0, 3, 4]
-                        # (0 1 2 3 4) -> (2 1 0 3 4) -> (2 1 0 3 4)
-                        lev_T_out = [1, 2, 0, 3, 4]
-                        # In 'diurn' file, 'level' is the 3rd axis: (time, tod, lev, lat, lon)
-                        lev_axis = 2
-                    else:
-                        # [tim, lev, lat, lon] -> [lev, time, lat, lon] -> [tim, lev, lat, lon]
-                        lev_T = [1, 0, 2, 3]
-                        # (0 1 2 3) -> (1 0 2 3) -> (1 0 2 3)
-                        lev_T_out = lev_T
-                        # In 'average' and 'daily' files, 'level' is the 2nd axis: (time, lev, lat, lon)
-                        lev_axis = 1
-
-                    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-                    # ~~~~~~~~~~~~  Non-Interpolated Files ~~~~~~~~~~~~~~~~~
-                    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-
-                    # 'level', 'ps', and 'p_3d' are often required.
-                    if interp_type == 'pfull':
-                        lev  = fileNC.variables['pfull'][:]
-                        ps   = fileNC.variables['ps'][:]
-                        p_3D = compute_p_3D(ps, ak, bk, shape_out)
-
-                    # If file interpolated to 'pstd', calculate the 3D pressure field.
-                    # This is quick and easy:
-                    elif interp_type == 'pstd':
-                        lev = fileNC.variables['pstd'][:]
-                        reshape_shape = [1 for i in range(
-                            0, len(shape_out))]  # (0 1 2 3)
-                        reshape_shape[lev_axis] = len(lev)  # e.g [1, 28, 1, 1]
-                        p_3D = lev.reshape(reshape_shape)
-                    # If requested interp_type is 'zstd', or 'zagl', 'pfull3D' is required before interpolation.
-                    # Some computations (e.g. wind speed) do not require 'pfull3D' and will work without it,
-                    # so we use a 'try' statement here.
-                    else:
-                        try:
-                            p_3D = fileNC.variables['pfull3D'][:]
-                        except:
-                            pass
-
-                    if ivar == 'dzTau':
-                        if 'dst_mass_micro' in fileNC.variables.keys():
-                            q = fileNC.variables['dst_mass_micro'][:]
-                        elif 'dst_mass' in fileNC.variables.keys():
-                            q = fileNC.variables['dst_mass'][:]
-                        OUT = compute_xzTau(q, temp, lev, C_dst, f_type)
-
-                    if ivar == 'izTau':
-                        if 'ice_mass_micro' in fileNC.variables.keys():
-                            q = fileNC.variables['ice_mass_micro'][:]
-                        elif 'ice_mass' in fileNC.variables.keys():
-                            q = fileNC.variables['ice_mass'][:]
-                        OUT = compute_xzTau(q, temp, lev, C_ice, f_type)
-
-                    if ivar == 'dst_mass_micro':
-                        xTau = fileNC.variables['dzTau'][:]
-                        OUT = compute_mmr(xTau, temp, lev, C_dst, f_type)
-
-                    if ivar == 'ice_mass_micro':
-                        xTau = fileNC.variables['izTau'][:]
-                        OUT = compute_mmr(xTau, temp, lev, C_ice, f_type)
-
-                    if ivar == 'Vg_sed':
-                        if 'dst_mass_micro' in fileNC.variables.keys():
-                            xTau = fileNC.variables['dst_mass_micro'][:]
-                            nTau = fileNC.variables['dst_num_micro'][:]
-                        elif 'dst_mass' in fileNC.variables.keys():
-                            xTau = fileNC.variables['dst_mass'][:]
-                            nTau = fileNC.variables['dst_num'][:]
-                        OUT = compute_Vg_sed(xTau, nTau, temp)
-
-                    if ivar == 'w_net':
-                        Vg = fileNC.variables['Vg_sed'][:]
-                        wvar = fileNC.variables['w'][:]
-                        OUT = compute_w_net(Vg, wvar)
-
-                    if ivar == 'pfull3D':
-                        OUT = p_3D
-
-                    if ivar == 'DP':
-                        OUT = compute_DP_3D(ps, ak, bk, shape_out)
-
-                    if ivar == 'rho':
-                        OUT = compute_rho(p_3D, temp)
-
-                    if ivar == 'theta':
-                        OUT = compute_theta(p_3D, ps, temp, f_type)
-
-                    if ivar == 'w':
-                        omega = fileNC.variables['omega'][:]
-                        rho = compute_rho(p_3D, temp)
-                        OUT = compute_w(rho, omega)
-
-                    if ivar == 'zfull':
-                        # TODO not with _pstd
-                        OUT = compute_zfull(ps, ak, bk, temp)
-
-                    if ivar == 'DZ':
-                        OUT = compute_DZ_3D(ps, ak, bk, temp, shape_out)
-
-                    if ivar == 'wspeed' or ivar == 'wdir':
-                        ucomp = fileNC.variables['ucomp'][:]
-                        vcomp = fileNC.variables['vcomp'][:]
-                        theta, mag = cart_to_azimut_TR(
-                            ucomp, vcomp, mode='from')
-                        if ivar == 'wdir':
-                            OUT = theta
-                        if ivar == 'wspeed':
-                            OUT = mag
-
-                    if ivar == 'N':
-                        theta = compute_theta(p_3D, ps, temp, f_type)
-                        # TODO incompatible with 'pstd' files
-                        zfull = compute_zfull(ps, ak, bk, temp)
-                        OUT = compute_N(theta, zfull)
-
-                    if ivar == 'Ri':
-                        theta = compute_theta(p_3D, ps, temp, f_type)
-                        # TODO incompatible with 'pstd' files
-                        zfull = compute_zfull(ps, ak, bk, temp)
-                        N = compute_N(theta, zfull)
-
-                        ucomp = fileNC.variables['ucomp'][:]
-                        vcomp = fileNC.variables['vcomp'][:]
-                        du_dz = dvar_dh(ucomp.transpose(
-                            lev_T), zfull.transpose(lev_T)).transpose(lev_T)
-                        dv_dz = dvar_dh(vcomp.transpose(
-                            lev_T), zfull.transpose(lev_T)).transpose(lev_T)
-                        OUT = N**2/(du_dz**2+dv_dz**2)
-
-                    if ivar == 'Tco2':
-                        OUT = compute_Tco2(p_3D, temp)
-
-                    if ivar == 'scorer_wl':
-                        ucomp = fileNC.variables['ucomp'][:]
-                        theta = compute_theta(p_3D, ps, temp, f_type)
-                        zfull = compute_zfull(ps, ak, bk, temp)
-                        N = compute_N(theta, zfull)
-                        OUT = compute_scorer(N, ucomp, zfull)
-
-                    if ivar in ['div', 'curl', 'fn']:
-                        lat = fileNC.variables['lat'][:]
-                        lon = fileNC.variables['lon'][:]
-                        ucomp = fileNC.variables['ucomp'][:]
-                        vcomp = fileNC.variables['vcomp'][:]
-
-                    if ivar == 'div':
-                        OUT = spherical_div(
-                            ucomp, vcomp, lon, lat, R=3400*1000., spacing='regular')
-
-                    if ivar == 'curl':
-                        OUT = spherical_curl(
-                            ucomp, vcomp, lon, lat, R=3400*1000., spacing='regular')
-
-                    if ivar == 'fn':
-                        theta = fileNC.variables['theta'][:]
-                        OUT = frontogenesis(
-                            ucomp, vcomp, theta, lon, lat, R=3400*1000., spacing='regular')
-
-                    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-                    # ~~~~~~~~~~~~~~~~~ Interpolated files ~~~~~~~~~~~~~~~~~~~
-                    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-
-                    # All interpolated files have the following
-                    if interp_type != 'pfull':
-                        lev = fileNC.variables[interp_type][:]
-
-                    if ivar == 'msf':
-                        vcomp = fileNC.variables['vcomp'][:]
-                        lat = fileNC.variables['lat'][:]
-                        if f_type == 'diurn':
-                            # [lev, lat, time, tod, lon] -> [time, tod, lev, lat, lon]
-                            # (0 1 2 3 4) -> (2 3 0 1 4) -> (2 3 0 1 4)
-                            OUT = mass_stream(vcomp.transpose(
-                                [2, 3, 0, 1, 4]), lat, lev, type=interp_type).transpose([2, 3, 0, 1, 4])
-                        else:
-                            OUT = mass_stream(vcomp.transpose(
-                                [1, 2, 3, 0]), lat, lev, type=interp_type).transpose([3, 0, 1, 2])
-                            # [time, lev, lat, lon] -> [lev, lat, lon, time]  ->  [time, lev, lat, lon]
-                            # (0 1 2 3) -> (1 2 3 0) -> (3 0 1 2)
-
-                    if ivar == 'ep':
-                        OUT = compute_Ep(temp)
-
-                    if ivar == 'ek':
-                        ucomp = fileNC.variables['ucomp'][:]
-                        vcomp = fileNC.variables['vcomp'][:]
-                        OUT = compute_Ek(ucomp, vcomp)
-
-                    if ivar == 'mx':
-                        OUT = compute_MF(
-                            fileNC.variables['ucomp'][:], fileNC.variables['w'][:])
-
-                    if ivar == 'my':
-                        OUT = compute_MF(
-                            fileNC.variables['vcomp'][:], fileNC.variables['w'][:])
-
-                    if ivar == 'ax':
-                        mx = compute_MF(
-                            fileNC.variables['ucomp'][:], fileNC.variables['w'][:])
-                        rho = fileNC.variables['rho'][:]
-                        OUT = compute_WMFF(mx, rho, lev, interp_type)
-
-                    if ivar == 'ay':
-                        my = compute_MF(
-                            fileNC.variables['vcomp'][:], fileNC.variables['w'][:])
-                        rho = fileNC.variables['rho'][:]
-                        OUT = compute_WMFF(my, rho, lev, interp_type)
-
-                    if ivar == 'tp_t':
-                        OUT = zonal_detrend(temp)/temp
-
-                    # Filter out NANs in the native files
-                    if interp_type == 'pfull':
-                        OUT[np.isnan(OUT)] = fill_value
-
-                    # Add NANs to the interpolated files
-                    else:
-                        with warnings.catch_warnings():
-                            warnings.simplefilter(
-                                "ignore", category=RuntimeWarning)
-                            OUT[OUT > 1.e30] = np.NaN
-                            OUT[OUT < -1.e30] = np.NaN
-
-                    # Log the variable
-                    var_Ncdf = fileNC.createVariable(ivar, 'f4', dim_out)
-                    var_Ncdf.long_name = VAR[ivar][0]
-                    var_Ncdf.units = VAR[ivar][1]
-                    var_Ncdf[:] = OUT
-                    fileNC.close()
-
-                    print('%s: \033[92mDone\033[00m' % (ivar))
+            cmd_txt = 'mv '+ifile_tmp+' '+ifile
+            p = subprocess.run(
+                cmd_txt, universal_newlines=True, shell=True)
+            prCyan(ifile+' was updated')
 
-                except Exception as exception:
-                    if debug:
-                        raise
-                    if str(exception) == 'NetCDF: String match to name in use':
-                        prYellow("""***Error*** Variable already exists in file.""")
-                        prYellow(
-                            """Delete the existing variables %s with 'MarsVars.py %s -rm %s'""" % (ivar, ifile, ivar))
-
-        # =================================================================
-        # ================== Vertical Differentiation =====================
-        # =================================================================
-        for idiff in zdiff_list:
-            fileNC = Dataset(ifile, 'a', format='NETCDF4_CLASSIC')
-            f_type, interp_type = FV3_file_type(fileNC)
-
-            if interp_type == 'pfull':
-                ak, bk = ak_bk_loader(fileNC)
-
-            if idiff not in fileNC.variables.keys():
-                prRed("zdiff error: variable '%s' is not present in %s" %
-                      (idiff, ifile))
-                fileNC.close()
-            else:
-                print('Differentiating: %s...' % (idiff))
-                if f_type == 'diurn':
-                    lev_T = [2, 1, 0, 3, 4]
-                else:  # [time, lat, lon]
-                    lev_T = [1, 0, 2, 3]  # [tim, lev, lat, lon]
-                try:
-                    var = fileNC.variables[idiff][:]
-                    longname_txt, units_txt = get_longname_units(fileNC, idiff)
-                    # Remove the last ']' to update the units (e.g '[kg]' to '[kg/m]')
-                    newUnits = units_txt[:-2]+'/m]'
-                    newLong_name = 'vertical gradient of '+longname_txt
-                    # Alex's version of the above 2 lines:
-                    # remove the last ']' to update units, (e.g '[kg]' to '[kg/m]')
-                    #newUnits = getattr(fileNC.variables[idiff],'units','')[:-2]+'/m]'
-                    #newLong_name = 'vertical gradient of ' + getattr(fileNC.variables[idiff], 'long_name', '')
-
-                    # 'temp' and 'ps' are always required
-                    # Get dimension
-                    dim_out = fileNC.variables['temp'].dimensions
+    # =================================================================
+    # ======================== Extract ================================
+    # =================================================================
+    if extract_list:
+        f_IN = Dataset(ifile, 'r', format='NETCDF4_CLASSIC')
+        exclude_list = filter_vars(f_IN, parser.parse_args(
+        ).extract, giveExclude=True)  # The variable to exclude
+        print()
+        ifile_tmp = ifile[:-3]+'_extract.nc'
+        Log = Ncdf(ifile_tmp, 'Edited in postprocessing')
+        Log.copy_all_dims_from_Ncfile(f_IN)
+        Log.copy_all_vars_from_Ncfile(f_IN, exclude_list)
+        f_IN.close()
+        Log.close()
+        prCyan(ifile+' was created')
+
+    # =================================================================
+    # ============================ Add ================================
+    # =================================================================
+    if add_list and jobs > 1:
+        failed = add_variables_parallel(ifile, add_list, debug, chunk, jobs)
+    elif add_list:
+        fileNC = Dataset(ifile, 'a', format='NETCDF4_CLASSIC')
+        failed = add_variables(fileNC, ifile, add_list, debug, chunk)
+        fileNC.close()
+    if add_list:
+        errors += ["'%s' was not added" % (ivar) for ivar in failed]
+
+    # =================================================================
+    # ================== Vertical Differentiation =====================
+    # =================================================================
+    for idiff in zdiff_list:
+        fileNC = Dataset(ifile, 'a', format='NETCDF4_CLASSIC')
+        f_type, interp_type = FV3_file_type(fileNC)
+
+        if interp_type == 'pfull':
+            ak, bk = ak_bk_loader(fileNC)
+
+        if idiff not in fileNC.variables.keys():
+            prRed("zdiff error: variable '%s' is not present in %s" %
+                  (idiff, ifile))
+            errors.append("'%s' is not in the file" % (idiff))
+            fileNC.close()
+        else:
+            print('Differentiating: %s...' % (idiff))
+            if f_type == 'diurn':
+                lev_T = [2, 1, 0, 3, 4]
+                lev_T_out = [1, 2, 0, 3, 4]
+            else:  # [time, lat, lon]
+                lev_T = [1, 0, 2, 3]  # [tim, lev, lat, lon]
+                lev_T_out = lev_T
+            try:
+                longname_txt, units_txt = get_longname_units(fileNC, idiff)
+                # Remove the last ']' to update the units (e.g '[kg]' to '[kg/m]')
+                newUnits = units_txt[:-2]+'/m]'
+                newLong_name = 'vertical gradient of '+longname_txt
+                # Alex's version of the above 2 lines:
+                # remove the last ']' to update units, (e.g '[kg]' to '[kg/m]')
+                #newUnits = getattr(fileNC.variables[idiff],'units','')[:-2]+'/m]'
+                #newLong_name = 'vertical gradient of ' + getattr(fileNC.variables[idiff], 'long_name', '')
+
+                # 'temp' and 'ps' are always required
+                # Get dimension
+                dim_out = fileNC.variables['temp'].dimensions
+                blocks = time_blocks(fileNC, chunk)
+                for time_slice in blocks:
+                    var = read_block(fileNC, idiff, time_slice)
                     if interp_type == 'pfull':
                         if 'zfull' in fileNC.variables.keys():
-                            zfull = fileNC.variables['zfull'][:]
+                            zfull = read_block(fileNC, 'zfull', time_slice)
                         else:
-                            temp = fileNC.variables['temp'][:]
-                            ps = fileNC.variables['ps'][:]
-                            zfull = fms_Z_calc(ps, ak, bk, temp.transpose(
-                                lev_T), topo=0., lev_type='full')  # Z is the first axis
-                        # 'average' file: zfull = (lev, time, lat, lon)
-                        # 'diurn' file:   zfull = (lev, tod, time, lat, lon)
+                            temp = read_block(fileNC, 'temp', time_slice)
+                            ps = read_block(fileNC, 'ps', time_slice)
+                            zfull = compute_zfull(ps, ak, bk, temp)
+                        # 'average' file: zfull = (time, lev, lat, lon)
+                        # 'diurn' file:   zfull = (time, tod, lev, lat, lon)
                         # Differentiate the variable w.r.t. Z:
                         darr_dz = dvar_dh(var.transpose(
-                            lev_T), zfull).transpose(lev_T)
+                            lev_T), zfull.transpose(lev_T)).transpose(lev_T)
 
                     elif interp_type == 'pstd':
                         # If 'pstd', requires 'zfull'
                         if 'zfull' in fileNC.variables.keys():
-                            zfull = fileNC.variables['zfull'][:]
+                            zfull = read_block(fileNC, 'zfull', time_slice)
                             darr_dz = dvar_dh(var.transpose(
                                 lev_T), zfull.transpose(lev_T)).transpose(lev_T)
                         else:
                             lev = fileNC.variables[interp_type][:]
-                            temp = fileNC.variables['temp'][:]
+                            temp = read_block(fileNC, 'temp', time_slice)
                             dzfull_pstd = compute_DZ_full_pstd(lev, temp)
                             darr_dz = dvar_dh(var.transpose(
                                 lev_T)).transpose(lev_T)/dzfull_pstd
@@ -941,260 +1285,346 @@ def main():
                             lev_T), lev).transpose(lev_T)
 
                     # Log the variable
-                    var_Ncdf = fileNC.createVariable(
-                        'd_dz_'+idiff, 'f4', dim_out)
-                    var_Ncdf.long_name = newLong_name
-                    var_Ncdf.units = newUnits
-                    var_Ncdf[:] = darr_dz
-                    fileNC.close()
-
-                    print('%s: \033[92mDone\033[00m' % ('d_dz_'+idiff))
-                except Exception as exception:
-                    if debug:
-                        raise
-                    if str(exception) == 'NetCDF: String match to name in use':
-                        prYellow("""***Error*** Variable already exists in file.""")
-                        prYellow("""Delete the existing variable %s with 'MarsVars %s -rm %s'""" %
-                                 ('d_dz_'+idiff, ifile, 'd_dz_'+idiff))
-
-        # =================================================================
-        # ====================== Zonal Detrending =========================
-        # =================================================================
-        for izdetrend in zdetrend_list:
-            fileNC = Dataset(ifile, 'a', format='NETCDF4_CLASSIC')
-            f_type, interp_type = FV3_file_type(fileNC)
-            if izdetrend not in fileNC.variables.keys():
-                prRed("zdiff error: variable '%s' is not in %s" %
-                      (izdetrend, ifile))
+                    log_add_variable(fileNC, 'd_dz_'+idiff, time_slice, darr_dz,
+                                     time_slice is blocks[-1], dim_out, newLong_name, newUnits)
                 fileNC.close()
-            else:
-                print('Detrending: %s...' % (izdetrend))
-
-                try:
-                    var = fileNC.variables[izdetrend][:]
-                    longname_txt, units_txt = get_longname_units(
-                        fileNC, izdetrend)
-                    newLong_name = 'zonal perturbation of '+longname_txt
-                    # Alex's version of the above (and below) lines:
-                    #newUnits = getattr(fileNC.variables[izdetrend], 'units', '')
-                    #newLong_name = 'zonal perturbation of ' + getattr(fileNC.variables[izdetrend], 'long_name', '')
 
-                    # Get dimension
-                    dim_out = fileNC.variables[izdetrend].dimensions
+                print('%s: \033[92mDone\033[00m' % ('d_dz_'+idiff))
+            except Exception as exception:
+                if debug:
+                    raise
+                errors.append("'%s' could not be differentiated, %s" % (idiff, exception))
+                if str(exception) == 'NetCDF: String match to name in use':
+                    prYellow("""***Error*** Variable already exists in file.""")
+                    prYellow("""Delete the existing variable %s with 'MarsVars %s -rm %s'""" %
+                             ('d_dz_'+idiff, ifile, 'd_dz_'+idiff))
+
+    # =================================================================
+    # ====================== Zonal Detrending =========================
+    # =================================================================
+    for izdetrend in zdetrend_list:
+        fileNC = Dataset(ifile, 'a', format='NETCDF4_CLASSIC')
+        f_type, interp_type = FV3_file_type(fileNC)
+        if izdetrend not in fileNC.variables.keys():
+            prRed("zdiff error: variable '%s' is not in %s" %
+                  (izdetrend, ifile))
+            errors.append("'%s' is not in the file" % (izdetrend))
+            fileNC.close()
+        else:
+            print('Detrending: %s...' % (izdetrend))
 
-                    # Log the variable
-                    var_Ncdf = fileNC.createVariable(
-                        izdetrend+'_p', 'f4', dim_out)
-                    var_Ncdf.long_name = newLong_name
-                    var_Ncdf.units = units_txt
-                    #var_Ncdf.units = newUnits # alex's version
-                    var_Ncdf[:] = zonal_detrend(var)
-                    fileNC.close()
-
-                    print('%s: \033[92mDone\033[00m' % (izdetrend+'_p'))
-                except Exception as exception:
-                    if debug:
-                        raise
-                    if str(exception) == 'NetCDF: String match to name in use':
-                        prYellow("""***Error*** Variable already exists in file.""")
-                        prYellow("""Delete the existing variable %s with 'MarsVars %s -rm %s'""" %
-                                 ('d_dz_'+idiff, ifile, 'd_dz_'+idiff))
-
-        # =================================================================
-        # ========= Opacity Conversion (dp_to_dz and dz_to_dp) ============
-        # =================================================================
-        # ========= Case 1: dp_to_dz
-        for idp_to_dz in dp_to_dz_list:
-            fileNC = Dataset(ifile, 'a', format='NETCDF4_CLASSIC')
-            f_type, interp_type = FV3_file_type(fileNC)
-            if idp_to_dz not in fileNC.variables.keys():
-                prRed("dp_to_dz error: variable '%s' is not in %s" %
-                      (idp_to_dz, ifile))
+            try:
+                var = fileNC.variables[izdetrend][:]
+                longname_txt, units_txt = get_longname_units(
+                    fileNC, izdetrend)
+                newLong_name = 'zonal perturbation of '+longname_txt
+                # Alex's version of the above (and below) lines:
+                #newUnits = getattr(fileNC.variables[izdetrend], 'units', '')
+                #newLong_name = 'zonal perturbation of ' + getattr(fileNC.variables[izdetrend], 'long_name', '')
+
+                # Get dimension
+                dim_out = fileNC.variables[izdetrend].dimensions
+
+                # Log the variable
+                var_Ncdf = fileNC.createVariable(
+                    izdetrend+'_p', 'f4', dim_out)
+                var_Ncdf.long_name = newLong_name
+                var_Ncdf.units = units_txt
+                #var_Ncdf.units = newUnits # alex's version
+                var_Ncdf[:] = zonal_detrend(var)
                 fileNC.close()
-            else:
-                print('Converting: %s...' % (idp_to_dz))
 
-                try:
-                    var = fileNC.variables[idp_to_dz][:]
-                    newUnits = getattr(
-                        fileNC.variables[idp_to_dz], 'units', '')+'/m'
-                    newLong_name = getattr(
-                        fileNC.variables[idp_to_dz], 'long_name', '')+' rescaled to meter-1'
-                    # Get dimension
-                    dim_out = fileNC.variables[idp_to_dz].dimensions
+                print('%s: \033[92mDone\033[00m' % (izdetrend+'_p'))
+            except Exception as exception:
+                if debug:
+                    raise
+                errors.append("'%s' could not be detrended, %s" % (izdetrend, exception))
+                if str(exception) == 'NetCDF: String match to name in use':
+                    prYellow("""***Error*** Variable already exists in file.""")
+                    prYellow("""Delete the existing variable %s with 'MarsVars %s -rm %s'""" %
+                             ('d_dz_'+idiff, ifile, 'd_dz_'+idiff))
+
+    # =================================================================
+    # ========= Opacity Conversion (dp_to_dz and dz_to_dp) ============
+    # =================================================================
+    # ========= Case 1: dp_to_dz
+    for idp_to_dz in dp_to_dz_list:
+        fileNC = Dataset(ifile, 'a', format='NETCDF4_CLASSIC')
+        f_type, interp_type = FV3_file_type(fileNC)
+        if idp_to_dz not in fileNC.variables.keys():
+            prRed("dp_to_dz error: variable '%s' is not in %s" %
+                  (idp_to_dz, ifile))
+            errors.append("'%s' is not in the file" % (idp_to_dz))
+            fileNC.close()
+        else:
+            print('Converting: %s...' % (idp_to_dz))
 
-                    # Log the variable
-                    var_Ncdf = fileNC.createVariable(
-                        idp_to_dz+'_dp_to_dz', 'f4', dim_out)
-                    var_Ncdf.long_name = newLong_name
-                    var_Ncdf.units = newUnits
-                    var_Ncdf[:] = var*fileNC.variables['DP'][:] / \
-                        fileNC.variables['DZ'][:]
-                    fileNC.close()
-
-                    print('%s: \033[92mDone\033[00m' % (idp_to_dz+'_dp_to_dz'))
-                except Exception as exception:
-                    if debug:
-                        raise
-                    if str(exception) == 'NetCDF: String match to name in use':
-                        prYellow("""***Error*** Variable already exists in file.""")
-                        prYellow("""Delete the existing variable %s with 'MarsVars %s -rm %s'""" %
-                                 (idp_to_dz+'_dp_to_dz', ifile, idp_to_dz+'_dp_to_dz'))
-
-       # ========= Case 2: dz_to_dp
-        for idz_to_dp in dz_to_dp_list:
-            fileNC = Dataset(ifile, 'a', format='NETCDF4_CLASSIC')
-            f_type, interp_type = FV3_file_type(fileNC)
-            if idz_to_dp not in fileNC.variables.keys():
-                prRed("dz_to_dp error: variable '%s' is not in %s" %
-                      (idz_to_dp, ifile))
+            try:
+                var = fileNC.variables[idp_to_dz][:]
+                newUnits = getattr(
+                    fileNC.variables[idp_to_dz], 'units', '')+'/m'
+                newLong_name = getattr(
+                    fileNC.variables[idp_to_dz], 'long_name', '')+' rescaled to meter-1'
+                # Get dimension
+                dim_out = fileNC.variables[idp_to_dz].dimensions
+
+                # Log the variable
+                var_Ncdf = fileNC.createVariable(
+                    idp_to_dz+'_dp_to_dz', 'f4', dim_out)
+                var_Ncdf.long_name = newLong_name
+                var_Ncdf.units = newUnits
+                var_Ncdf[:] = var*fileNC.variables['DP'][:] / \
+                    fileNC.variables['DZ'][:]
                 fileNC.close()
-            else:
-                print('Converting: %s...' % (idz_to_dp))
 
-                try:
-                    var = fileNC.variables[idz_to_dp][:]
-                    newUnits = getattr(
-                        fileNC.variables[idz_to_dp], 'units', '')+'/m'
-                    newLong_name = getattr(
-                        fileNC.variables[idz_to_dp], 'long_name', '')+' rescaled to Pa-1'
-                    # Get dimension
-                    dim_out = fileNC.variables[idz_to_dp].dimensions
+                print('%s: \033[92mDone\033[00m' % (idp_to_dz+'_dp_to_dz'))
+            except Exception as exception:
+                if debug:
+                    raise
+                errors.append("'%s' could not be converted, %s" % (idp_to_dz, exception))
+                if str(exception) == 'NetCDF: String match to name in use':
+                    prYellow("""***Error*** Variable already exists in file.""")
+                    prYellow("""Delete the existing variable %s with 'MarsVars %s -rm %s'""" %
+                             (idp_to_dz+'_dp_to_dz', ifile, idp_to_dz+'_dp_to_dz'))
+
+   # ========= Case 2: dz_to_dp
+    for idz_to_dp in dz_to_dp_list:
+        fileNC = Dataset(ifile, 'a', format='NETCDF4_CLASSIC')
+        f_type, interp_type = FV3_file_type(fileNC)
+        if idz_to_dp not in fileNC.variables.keys():
+            prRed("dz_to_dp error: variable '%s' is not in %s" %
+                  (idz_to_dp, ifile))
+            errors.append("'%s' is not in the file" % (idz_to_dp))
+            fileNC.close()
+        else:
+            print('Converting: %s...' % (idz_to_dp))
 
-                    # Log the variable
-                    var_Ncdf = fileNC.createVariable(
-                        idz_to_dp+'_dz_to_dp', 'f4', dim_out)
-                    var_Ncdf.long_name = newLong_name
-                    var_Ncdf.units = newUnits
-                    var_Ncdf[:] = var*fileNC.variables['DZ'][:] / \
-                        fileNC.variables['DP'][:]
-                    fileNC.close()
-
-                    print('%s: \033[92mDone\033[00m' % (idz_to_dp+'_dz_to_dp'))
-                except Exception as exception:
-                    if debug:
-                        raise
-                    if str(exception) == 'NetCDF: String match to name in use':
-                        prYellow("""***Error*** Variable already exists in file.""")
-                        prYellow("""Delete the existing variable %s with 'MarsVars.py %s -rm %s'""" %
-                                 (idp_to_dz+'_dp_to_dz', ifile, idp_to_dz+'_dp_to_dz'))
-
-        # =================================================================
-        # ====================== Column Integration =======================
-        # =================================================================
-        """
-                          z_top
-                          ⌠
-        We have col=      ⌡ var (rho dz)  with [(dp/dz) = (-rho g)] => [(rho dz) = (-dp/g)]
-                          0
-
-                      ___ p_sfc
-             >  col = \
-                      /__ var (dp/g)
-                        p_top
-        """
-
-        for icol in col_list:
-            fileNC = Dataset(ifile, 'a')  # , format='NETCDF4_CLASSIC
-            f_type, interp_type = FV3_file_type(fileNC)
-            if interp_type == 'pfull':
-                ak, bk = ak_bk_loader(fileNC)
-
-            if icol not in fileNC.variables.keys():
-                prRed("column integration error: variable '%s' is not in %s" % (
-                    icol, ifile))
+            try:
+                var = fileNC.variables[idz_to_dp][:]
+                newUnits = getattr(
+                    fileNC.variables[idz_to_dp], 'units', '')+'/m'
+                newLong_name = getattr(
+                    fileNC.variables[idz_to_dp], 'long_name', '')+' rescaled to Pa-1'
+                # Get dimension
+                dim_out = fileNC.variables[idz_to_dp].dimensions
+
+                # Log the variable
+                var_Ncdf = fileNC.createVariable(
+                    idz_to_dp+'_dz_to_dp', 'f4', dim_out)
+                var_Ncdf.long_name = newLong_name
+                var_Ncdf.units = newUnits
+                var_Ncdf[:] = var*fileNC.variables['DZ'][:] / \
+                    fileNC.variables['DP'][:]
                 fileNC.close()
-            else:
-                print('Performing column integration: %s...' % (icol))
 
-                try:
-                    var = fileNC.variables[icol][:]
-                    longname_txt, units_txt = get_longname_units(fileNC, icol)
-                    newUnits = units_txt[:-3]+'/m2'  # turn 'kg/kg'> to 'kg/m2'
-                    newLong_name = 'column integration of '+longname_txt
-                    # Alex's version of the above 2 lines:
-                    #newUnits = getattr(fileNC.variables[icol], 'units', '')[:-3]+'/m2' # 'kg/kg' -> 'kg/m2'
-                    #newLong_name = 'column integration of '+getattr(fileNC.variables[icol], 'long_name', '')
-
-                    # 'temp' and 'ps' always required
-                    # Get dimension
-                    dim_in = fileNC.variables['temp'].dimensions
-                    shape_in = fileNC.variables['temp'].shape
-                    # TODO edge cases where time = 1
-                    if f_type == 'diurn':
-                        # [time, tod, lat, lon]
-                        lev_T = [2, 1, 0, 3, 4]  # [time, tod, lev, lat, lon]
-                        dim_out = tuple(
-                            [dim_in[0], dim_in[1], dim_in[3], dim_in[4]])
-                        # In 'diurn', 'level' is the 3rd axis: (time, tod, lev, lat, lon)
-                        lev_axis = 2
-                    else:  # [time, lat, lon]
-                        lev_T = [1, 0, 2, 3]  # [time, lev, lat, lon]
-                        dim_out = tuple([dim_in[0], dim_in[2], dim_in[3]])
-                        lev_axis = 1
-
-                    ps = fileNC.variables['ps'][:]
-                    DP = compute_DP_3D(ps, ak, bk, shape_in)
+                print('%s: \033[92mDone\033[00m' % (idz_to_dp+'_dz_to_dp'))
+            except Exception as exception:
+                if debug:
+                    raise
+                errors.append("'%s' could not be converted, %s" % (idz_to_dp, exception))
+                if str(exception) == 'NetCDF: String match to name in use':
+                    prYellow("""***Error*** Variable already exists in file.""")
+                    prYellow("""Delete the existing variable %s with 'MarsVars.py %s -rm %s'""" %
+                             (idp_to_dz+'_dp_to_dz', ifile, idp_to_dz+'_dp_to_dz'))
+
+    # =================================================================
+    # ====================== Column Integration =======================
+    # =================================================================
+    """
+                      z_top
+                      ⌠
+    We have col=      ⌡ var (rho dz)  with [(dp/dz) = (-rho g)] => [(rho dz) = (-dp/g)]
+                      0
+
+                  ___ p_sfc
+         >  col = \
+                  /__ var (dp/g)
+                    p_top
+    """
+
+    for icol in col_list:
+        fileNC = Dataset(ifile, 'a')  # , format='NETCDF4_CLASSIC
+        f_type, interp_type = FV3_file_type(fileNC)
+        if interp_type == 'pfull':
+            ak, bk = ak_bk_loader(fileNC)
+
+        if icol not in fileNC.variables.keys():
+            prRed("column integration error: variable '%s' is not in %s" % (
+                icol, ifile))
+            errors.append("'%s' is not in the file" % (icol))
+            fileNC.close()
+        else:
+            print('Performing column integration: %s...' % (icol))
+
+            try:
+                longname_txt, units_txt = get_longname_units(fileNC, icol)
+                newUnits = units_txt[:-3]+'/m2'  # turn 'kg/kg'> to 'kg/m2'
+                newLong_name = 'column integration of '+longname_txt
+                # Alex's version of the above 2 lines:
+                #newUnits = getattr(fileNC.variables[icol], 'units', '')[:-3]+'/m2' # 'kg/kg' -> 'kg/m2'
+                #newLong_name = 'column integration of '+getattr(fileNC.variables[icol], 'long_name', '')
+
+                # 'temp' and 'ps' always required
+                # Get dimension
+                dim_in = fileNC.variables['temp'].dimensions
+                # TODO edge cases where time = 1
+                if f_type == 'diurn':
+                    # [time, tod, lat, lon]
+                    lev_T = [2, 1, 0, 3, 4]  # [time, tod, lev, lat, lon]
+                    lev_T_out = [1, 2, 0, 3, 4]
+                    dim_out = tuple(
+                        [dim_in[0], dim_in[1], dim_in[3], dim_in[4]])
+                    # In 'diurn', 'level' is the 3rd axis: (time, tod, lev, lat, lon)
+                    lev_axis = 2
+                else:  # [time, lat, lon]
+                    lev_T = [1, 0, 2, 3]  # [time, lev, lat, lon]
+                    lev_T_out = lev_T
+                    dim_out = tuple([dim_in[0], dim_in[2], dim_in[3]])
+                    lev_axis = 1
+
+                blocks = time_blocks(fileNC, chunk)
+                for time_slice in blocks:
+                    var = read_block(fileNC, icol, time_slice)
+                    ps = read_block(fileNC, 'ps', time_slice)
+                    DP = compute_DP_3D(ps, ak, bk, var.shape)
                     out = np.sum(var*DP/g, axis=lev_axis)
 
                     # Log the variable
-                    var_Ncdf = fileNC.createVariable(
-                        icol+'_col', 'f4', dim_out)
-                    var_Ncdf.long_name = newLong_name
-                    var_Ncdf.units = newUnits
-                    var_Ncdf[:] = out
+                    log_add_variable(fileNC, icol+'_col', time_slice, out,
+                                     time_slice is blocks[-1], dim_out, newLong_name, newUnits)
 
-                    fileNC.close()
+                fileNC.close()
 
-                    print('%s: \033[92mDone\033[00m' % (icol+'_col'))
-                except Exception as exception:
-                    if debug:
-                        raise
-                    if str(exception) == 'NetCDF: String match to name in use':
-                        prYellow("""***Error*** Variable already exists in file.""")
-                        prYellow("""Delete the existing variable %s with 'MarsVars %s -rm %s'""" %
-                                 (icol+'_col', ifile, icol+'_col'))
-        if edit_var:
-            f_IN = Dataset(ifile, 'r', format='NETCDF4_CLASSIC')
-            ifile_tmp = ifile[:-3]+'_tmp.nc'
-            Log = Ncdf(ifile_tmp, 'Edited in postprocessing')
-            Log.copy_all_dims_from_Ncfile(f_IN)
-            # Copy all variables but this one
-            Log.copy_all_vars_from_Ncfile(f_IN, exclude_var=edit_var)
-            # Read value, longname, units, name, and log the new variable
-            var_Ncdf = f_IN.variables[edit_var]
-
-            name_txt = edit_var
-            vals = var_Ncdf[:]
-            dim_out = var_Ncdf.dimensions
-            longname_txt = getattr(var_Ncdf, 'long_name', '')
-            units_txt = getattr(var_Ncdf, 'units', '')
-            cart_txt = getattr(var_Ncdf, 'cartesian_axis', '')
-
-            if parser.parse_args().rename:
-                name_txt = parser.parse_args().rename
-            if parser.parse_args().longname:
-                longname_txt = parser.parse_args().longname
-            if parser.parse_args().unit:
-                units_txt = parser.parse_args().unit
-            if parser.parse_args().multiply:
-                vals *= parser.parse_args().multiply
-
-            if cart_txt == '':
-                Log.log_variable(name_txt, vals, dim_out,
-                                 longname_txt, units_txt)
-            else:
-                Log.log_axis1D(name_txt, vals, dim_out,
-                               longname_txt, units_txt, cart_txt)
+                print('%s: \033[92mDone\033[00m' % (icol+'_col'))
+            except Exception as exception:
+                if debug:
+                    raise
+                errors.append("'%s' could not be integrated, %s" % (icol, exception))
+                if str(exception) == 'NetCDF: String match to name in use':
+                    prYellow("""***Error*** Variable already exists in file.""")
+                    prYellow("""Delete the existing variable %s with 'MarsVars %s -rm %s'""" %
+                             (icol+'_col', ifile, icol+'_col'))
+    if edit_var:
+        f_IN = Dataset(ifile, 'r', format='NETCDF4_CLASSIC')
+        ifile_tmp = ifile[:-3]+'_tmp.nc'
+        Log = Ncdf(ifile_tmp, 'Edited in postprocessing')
+        Log.copy_all_dims_from_Ncfile(f_IN)
+        # Copy all variables but this one
+        Log.copy_all_vars_from_Ncfile(f_IN, exclude_var=edit_var)
+        # Read value, longname, units, name, and log the new variable
+        var_Ncdf = f_IN.variables[edit_var]
+
+        name_txt = edit_var
+        vals = var_Ncdf[:]
+        dim_out = var_Ncdf.dimensions
+        longname_txt = getattr(var_Ncdf, 'long_name', '')
+        units_txt = getattr(var_Ncdf, 'units', '')
+        cart_txt = getattr(var_Ncdf, 'cartesian_axis', '')
+
+        if parser.parse_args().rename:
+            name_txt = parser.parse_args().rename
+        if parser.parse_args().longname:
+            longname_txt = parser.parse_args().longname
+        if parser.parse_args().unit:
+            units_txt = parser.parse_args().unit
+        if parser.parse_args().multiply:
+            vals *= parser.parse_args().multiply
+
+        if cart_txt == '':
+            Log.log_variable(name_txt, vals, dim_out,
+                             longname_txt, units_txt)
+        else:
+            Log.log_axis1D(name_txt, vals, dim_out,
+                           longname_txt, units_txt, cart_txt)
+
+        f_IN.close()
+        Log.close()
+
+        # Rename the new file
+        cmd_txt = 'mv '+ifile_tmp+' '+ifile
+        subprocess.call(cmd_txt, shell=True)
+
+        prCyan(ifile+' was updated')
+
+    return errors
 
-            f_IN.close()
-            Log.close()
+# =====================================================================
+def run_file(ifile, jobs=1, capture=False):
+    """
+    Processes one file, collecting the error instead of aborting the run.
+    Args:
+        ifile:   the file name
+        jobs:    the number of processes used within the file
+        capture: if True, return the printed messages instead of printing
+                 them, so that the outputs from parallel files do not mix
+    Returns:
+        ifile, the error message (None if successful) and the captured output
+    """
+    output = io.StringIO() if capture else sys.stdout
+    error = None
+    with contextlib.redirect_stdout(output):
+        try:
+            errors = process_file(ifile, jobs)
+            if errors:
+                error = '; '.join(errors)
+        except Exception as exception:
+            if parser.parse_args().debug:
+                raise
+            error = exception.__class__.__name__ + ": " + str(exception)
+            prRed('***Error*** %s: %s' % (ifile, error))
+        except SystemExit as exception:
+            # exit() in a worker of the file pool would leave imap waiting forever
+            if parser.parse_args().debug:
+                raise
+            error = 'SystemExit' + ('' if exception.code is None else ': %s' % (exception.code))
+            prRed('***Error*** %s: %s' % (ifile, error))
+    return ifile, error, output.getvalue() if capture else ''
 
-            # Rename the new file
-            cmd_txt = 'mv '+ifile_tmp+' '+ifile
-            subprocess.call(cmd_txt, shell=True)
 
-            prCyan(ifile+' was updated')
+def main():
+    # Load all the .nc files
+    file_list       = parser.parse_args().input_file
+    add_list        = parser.parse_args().add
+    zdiff_list      = parser.parse_args().zdiff
+    zdetrend_list   = parser.parse_args().zonal_detrend
+    dp_to_dz_list   = parser.parse_args().dp_to_dz
+    dz_to_dp_list   = parser.parse_args().dz_to_dp
+    col_list        = parser.parse_args().col
+    remove_list     = parser.parse_args().remove
+    extract_list    = parser.parse_args().extract
+    edit_var        = parser.parse_args().edit
+    jobs            = parser.parse_args().jobs
+
+    # Check if an operation is requested. Otherwise, print file content.
+    if not (add_list or zdiff_list or zdetrend_list or remove_list or col_list or extract_list or dp_to_dz_list or dz_to_dp_list or edit_var):
+        print_fileContent(file_list[0])
+        prYellow(''' ***Notice***  No operation requested. Use '-add', '-zdiff', '-zd', '-col', '-dp_to_dz', '-rm' '-edit' ''')
+        exit()  # Exit cleanly
+
+    # Check the status of all the files on tape at once, migrating them to disk
+    # in the background if needed (Lou only)
+    check_files_tape(file_list)
+
+    # For all the files. With several files, each process handles one file
+    # at a time and is its only writer. With a single file, the processes
+    # are used for the variables to add.
+    failed_files = []
+    if jobs > 1 and len(file_list) > 1:
+        with Pool(min(jobs, len(file_list))) as pool:
+            for ifile, error, output in pool.imap(partial(run_file, capture=True), file_list):
+                sys.stdout.write(output)
+                if error:
+                    failed_files.append((ifile, error))
+    else:
+        for ifile in file_list:
+            ifile, error, output = run_file(ifile, jobs)
+            if error:
+                failed_files.append((ifile, error))
+
+    if failed_files:
+        prRed('***Error*** %i file(s) could not be fully processed:' % (len(failed_files)))
+        for ifile, error in failed_files:
+            prRed('    %s: %s' % (ifile, error))
 
 
 if __name__ == '__main__':
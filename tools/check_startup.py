@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+'''
+Check the start-up time of the command line tools.
+
+Each command is run with 'python -X importtime'. The check fails if a command
+imports one of the heavy modules (matplotlib, netCDF4, scipy, xarray) it does
+not need, or if its imports take longer than the threshold.
+
+Usage: ./tools/check_startup.py
+       ./tools/check_startup.py -i 00668.atmos_average.nc  (also checks MarsPlot -i)
+       ./tools/check_startup.py --max 0.3
+'''
+import argparse  # parsing arguments
+import os        # paths
+import subprocess
+import sys
+
+bin_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin')
+
+# Modules that --help must not import
+heavy_modules = ['matplotlib', 'netCDF4', 'scipy', 'xarray']
+
+parser = argparse.ArgumentParser(description='Check the start-up time of the command line tools',
+                                 formatter_class=argparse.RawTextHelpFormatter)
+parser.add_argument('-i', '--inspect', default=None,
+                    help='''Netcdf file used to also check 'MarsPlot.py -i' \n'''
+                         '''netCDF4 is needed there and bounds the start-up time \n''')
+parser.add_argument('--max', type=float, default=0.25,
+                    help='''Maximum import time of each command in seconds (default 0.25) \n''')
+
+
+def import_times(args):
+    '''
+    Run a command with -X importtime.
+    Args:
+        args: list, the script and its arguments
+    Returns:
+        times: dictionary, the cumulative import time (s) of each top-level module
+        status: the exit status of the command
+    '''
+    env = dict(os.environ)
+    root = os.path.abspath(os.path.join(bin_dir, '..'))
+    env['PYTHONPATH'] = os.pathsep.join([root]+[p for p in [env.get('PYTHONPATH')] if p])
+    proc = subprocess.run([sys.executable, '-X', 'importtime']+args, env=env,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):
+            # Top-level import, the nested ones are included in its cumulative time
+            times[name.strip()] = times.get(name.strip(), 0.)+int(cumulative)*1e-6
+    return times, proc.returncode
+
+
+def main():
+    parser_args = parser.parse_args()
+    commands = [([os.path.join(bin_dir, name+'.py'), '--help'], heavy_modules)
+                for name in ['MarsPlot', 'MarsVars', 'MarsFiles', 'MarsInterp',
+                             'MarsFormat', 'MarsPull', 'MarsCalendar']]
+    commands.append(([os.path.join(bin_dir, 'MarsCalendar.py'), '350'], heavy_modules))
+    if parser_args.inspect:
+        commands.append(([os.path.join(bin_dir, 'MarsPlot.py'), '-i', parser_args.inspect],
+                         [m for m in heavy_modules if m != 'netCDF4']))
+
+    failed = False
+    for args, forbidden in commands:
+        times, status = import_times(args)
+        total = sum(times.values())
+        txt = ' '.join([os.path.basename(args[0])]+args[1:])
+        heavy = sorted({name.split('.')[0] for name in times} & set(forbidden))
+        errors = []
+        if status != 0:
+            errors.append('exit status %i' % (status))
+        if heavy:
+            errors.append('imports %s' % (', '.join(heavy)))
+        if total > parser_args.max:
+            errors.append('imports take %.3f s > %.3f s' % (total, parser_args.max))
+        print('%-40s %6.3f s  %s' % (txt, total, '; '.join(errors) if errors else 'OK'))
+        failed = failed or bool(errors)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()